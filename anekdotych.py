@@ -0,0 +1,223 @@
+"""
+Бот Анекдотыч: обработчики, фоновые задачи и жизненный цикл приложения.
+Точка входа - bot.py; модуль импортируется только процессом, который обрабатывает обновления.
+"""
+
+import logging
+import random
+import time
+from telegram import Update
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, InlineQueryHandler, ChosenInlineResultHandler,
+    ContextTypes, filters, CallbackContext
+)
+
+from handlers.commands import (
+    start_command, help_command, stats_command, 
+    top_command, admin_command, share_command
+)
+from handlers.inline import handle_inline_query, handle_chosen_inline_result
+from handlers.messages import handle_text_message, handle_joke_request, joke_client, joke_router, request_log
+from database import db
+from joke_pool import joke_pool
+from joke_store import joke_store
+from inline_index import inline_index
+from config import Config
+from metrics import start_metrics_server, summary_lines
+from profiler import profiled
+from retention import request_archiver
+from sharding import UserOrderedProcessor, shard_share
+from slo_controller import slo_controller
+from token_budget import token_budget
+from telegram_sender import telegram_sender
+from utils.constants import POPULAR_THEMES
+from utils.helpers import normalize_theme
+
+class AnekdotychBot:
+    def __init__(self):
+        self.db = db
+        self.db.load_limits()
+        self.db.load_leaderboard()
+        # В воркере шарда обновления одного пользователя обрабатываются по порядку
+        concurrency = UserOrderedProcessor(Config.CONCURRENT_UPDATES) if Config.SHARDS else Config.CONCURRENT_UPDATES
+        self.application = (
+            Application.builder()
+            .token(Config.TELEGRAM_TOKEN)
+            .base_url(Config.TELEGRAM_API_URL)
+            .concurrent_updates(concurrency)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
+        self.next_summary = 0.0
+        self.setup_handlers()
+        self.setup_jobs()
+    
+    def setup_handlers(self):
+        """Настройка обработчиков команд"""
+        
+        # Основные команды
+        self.application.add_handler(CommandHandler("start", start_command))
+        self.application.add_handler(CommandHandler("help", help_command))
+        self.application.add_handler(CommandHandler("stats", stats_command))
+        self.application.add_handler(CommandHandler("top", top_command))
+        self.application.add_handler(CommandHandler("admin", admin_command))
+        self.application.add_handler(CommandHandler("share", share_command))
+        self.application.add_handler(CommandHandler("joke", self.joke_command))
+        self.application.add_handler(CommandHandler("random", self.random_joke_command))
+        
+        # Обработка текстовых сообщений
+        self.application.add_handler(MessageHandler(
+            filters.TEXT & ~filters.COMMAND, 
+            handle_text_message
+        ))
+        
+        # Инлайн-режим: @anekdotych_bot тема
+        self.application.add_handler(InlineQueryHandler(handle_inline_query))
+        self.application.add_handler(ChosenInlineResultHandler(handle_chosen_inline_result))
+    
+    def setup_jobs(self):
+        """Настройка фоновых задач"""
+        job_queue = self.application.job_queue
+        # Проверка здоровья и шаг режима деградации; сводка метрик - реже
+        job_queue.run_repeating(self.health_check, interval=Config.HEALTH_CHECK_INTERVAL, first=10)
+        # Периодическое сохранение счетчиков лимитов
+        job_queue.run_repeating(
+            self.sync_limits, interval=Config.LIMITER_SYNC_INTERVAL, first=Config.LIMITER_SYNC_INTERVAL
+        )
+        # Запись новых анекдотов и фильтров просмотренного
+        job_queue.run_repeating(
+            self.sync_joke_store, interval=Config.JOKE_STORE_SYNC_INTERVAL, first=Config.JOKE_STORE_SYNC_INTERVAL
+        )
+        # Индекс инлайн-режима перестраивается из базы целиком
+        job_queue.run_repeating(self.rebuild_inline_index, interval=Config.INLINE_INDEX_REFRESH, first=1)
+        # Пополнение пула анекдотов для популярных тем; в режиме шардов каждый воркер
+        # пополняет свою долю тем, чтобы платных генераций не становилось больше в N раз
+        self.pool_themes = shard_share(POPULAR_THEMES)
+        job_queue.run_repeating(self.refill_joke_pool, interval=Config.JOKE_POOL_REFILL_INTERVAL, first=5)
+        # Архивация старых запросов - одна на базу, в режиме шардов ее ведет нулевой воркер
+        if Config.SHARD_INDEX == 0:
+            job_queue.run_repeating(self.archive_requests, interval=Config.RETENTION_INTERVAL, first=60)
+    
+    @profiled()
+    async def joke_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /joke"""
+        if context.args:
+            theme = ' '.join(context.args)
+            await handle_joke_request(update, context, theme)
+        else:
+            await update.message.reply_text("🎭 Укажите тему для анекдота!\nПример: /joke программисты")
+    
+    @profiled()
+    async def random_joke_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /random"""
+        # Запас случайных тем кончается - догенерируем одним пакетом в фоне
+        low = min(Config.BATCH_MAX_JOKES, len(self.pool_themes))
+        if len(joke_pool.stocked(self.pool_themes)) < low and self.background_allowed():
+            themes = random.sample(self.pool_themes, len(self.pool_themes))
+            context.application.create_task(
+                joke_pool.refill(joke_router, themes, limit=Config.BATCH_MAX_JOKES, per_theme=1)
+            )
+        theme = joke_pool.random_theme(POPULAR_THEMES)
+        await handle_joke_request(update, context, theme)
+    
+    async def health_check(self, context: CallbackContext):
+        """Проверка здоровья бота"""
+        try:
+            # Простой тест базы данных
+            stats = await self.db.get_global_stats_async()
+            top = await self.db.get_top_themes_async(limit=Config.SLO_POPULAR_THEMES, period="week")
+            slo_controller.popular = frozenset(normalize_theme(theme) for theme, _ in top) | frozenset(
+                normalize_theme(theme) for theme in POPULAR_THEMES
+            )
+            if slo_controller.needs_probe():
+                await self.probe_generation()
+            slo_controller.evaluate()
+            
+            if time.monotonic() >= self.next_summary:
+                self.next_summary = time.monotonic() + Config.HEALTH_SUMMARY_INTERVAL
+                logging.info("✅ Health check passed")
+                for line in summary_lines():
+                    logging.info(line)
+        except Exception as e:
+            logging.error(f"❌ Health check failed: {e}")
+    
+    def background_allowed(self) -> bool:
+        """Фоновые генерации: не в глубокой деградации и не из остатка бюджета, отложенного пользователям"""
+        return slo_controller.allow_live() and token_budget.allows(Config.TOKEN_BUDGET_BACKGROUND_RESERVE)
+    
+    async def probe_generation(self):
+        """
+        Пробная генерация в деградации: пользовательских запросов к OpenRouter почти нет,
+        и без проб контроллер не заметит восстановления. Удачный анекдот уходит в пул.
+        """
+        theme = random.choice(POPULAR_THEMES)
+        joke, tokens_used = await joke_router.generate_joke_async(theme)
+        if not joke.startswith(('❌', '⚠️')):
+            joke_pool.put(theme, joke, tokens_used)
+    
+    async def sync_limits(self, context: CallbackContext):
+        """Сохранение счетчиков лимитов в базу"""
+        try:
+            await self.db.sync_limits_async()
+        except Exception as e:
+            logging.error(f"❌ Limits sync failed: {e}")
+    
+    async def sync_joke_store(self, context: CallbackContext):
+        """Сохранение хранилища анекдотов в базу"""
+        try:
+            await joke_store.sync_async()
+        except Exception as e:
+            logging.error(f"❌ Joke store sync failed: {e}")
+    
+    async def rebuild_inline_index(self, context: CallbackContext):
+        """Перестройка индекса инлайн-режима"""
+        try:
+            await inline_index.rebuild_async()
+        except Exception as e:
+            logging.error(f"❌ Inline index rebuild failed: {e}")
+    
+    async def refill_joke_pool(self, context: CallbackContext):
+        """Фоновое пополнение пула анекдотов"""
+        if not self.background_allowed():
+            return
+        try:
+            added = await joke_pool.refill(joke_router, self.pool_themes)
+            if added:
+                logging.info(f"🧺 Joke pool refilled: +{added}")
+        except Exception as e:
+            logging.error(f"❌ Joke pool refill failed: {e}")
+    
+    async def archive_requests(self, context: CallbackContext):
+        """Перенос запросов старше срока хранения в архив"""
+        try:
+            archived = await request_archiver.run_async()
+            if archived:
+                logging.info(f"🗄️ Archived {archived} old requests")
+        except Exception as e:
+            logging.error(f"❌ Request archiving failed: {e}")
+    
+    async def on_startup(self, application: Application):
+        """Запуск фоновых сервисов"""
+        await request_log.start()
+        if Config.METRICS_PORT:
+            start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+    
+    async def on_shutdown(self, application: Application):
+        """Освобождение ресурсов при остановке"""
+        await telegram_sender.stop()
+        await request_log.stop()
+        await joke_client.aclose()
+        await self.db.sync_limits_async()
+        await joke_store.sync_async()
+        self.db.close()
+    
+    def print_status(self):
+        """Сводка конфигурации при запуске"""
+        print("🤖 Бот Анекдотыч запущен!")
+        print("🔑 Проверка конфигурации...")
+        print(f"Telegram Token: {'✅' if Config.TELEGRAM_TOKEN else '❌'}")
+        print(f"OpenRouter API Key: {'✅' if Config.OPENROUTER_API_KEY else '❌'}")
+        print(f"Database: {'✅' if self.db else '❌'}")
+        print(f"Mode: {Config.BOT_MODE}")
+        print("🚀 Бот готов к работе 24/7!")
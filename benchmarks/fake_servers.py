@@ -0,0 +1,229 @@
+"""
+Локальные заглушки Telegram Bot API и OpenRouter для нагрузочных тестов.
+Серверы работают в отдельных потоках и не мешают event loop бота.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+JOKE_TEXT = (
+    "Приходит программист в магазин и спрашивает: - У вас есть батарейки? "
+    "- Есть. - А без них можно?"
+)
+# Токены промпта и одного анекдота в поле usage
+PROMPT_TOKENS = 180
+JOKE_TOKENS = 60
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+    
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент ушел, не дождавшись ответа (например, остановленный бот)
+            self.close_connection = True
+
+class _BackgroundServer:
+    """HTTP-сервер в фоновом потоке"""
+    
+    handler_class = _QuietHandler
+    
+    def __init__(self, host="127.0.0.1", port=0):
+        handler = type("Handler", (self.handler_class,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class _TelegramHandler(_QuietHandler):
+    def do_POST(self):
+        state = self.server_state
+        method = self.path.rsplit("/", 1)[-1]
+        body = self._read_body()
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+        self._send_json(200, {"ok": True, "result": state.handle(method, params)})
+    
+    do_GET = do_POST
+
+class FakeTelegramServer(_BackgroundServer):
+    """
+    Заглушка Bot API: отвечает на вызовы бота и фиксирует время
+    каждого исходящего сообщения по чатам.
+    """
+    
+    handler_class = _TelegramHandler
+    
+    def __init__(self, on_message=None, **kwargs):
+        super().__init__(**kwargs)
+        # on_message(chat_id, text, method, timestamp) вызывается из потока сервера
+        self.on_message = on_message
+        self.calls = {}
+        # Обновления, которые бот получит через getUpdates
+        self.updates = []
+        # Время первого вызова каждого метода (time.perf_counter)
+        self.first_calls = {}
+        self._message_id = 0
+        self._lock = threading.Lock()
+    
+    def add_update(self, update):
+        with self._lock:
+            self.updates.append(update)
+    
+    def handle(self, method, params):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.first_calls.setdefault(method, time.perf_counter())
+            self._message_id += 1
+            message_id = self._message_id
+        
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Анекдотыч", "username": "anekdotych_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            text = params.get("text", "")
+            if self.on_message:
+                self.on_message(chat_id, text, method, time.perf_counter())
+            return {
+                "message_id": int(params.get("message_id", message_id)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }
+        if method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            with self._lock:
+                pending = [update for update in self.updates if update["update_id"] >= offset]
+            if not pending:
+                # Имитация long polling, чтобы бот не крутил запросы вхолостую
+                time.sleep(min(float(params.get("timeout") or 0), 0.05))
+            return pending
+        return True
+
+class _OpenRouterHandler(_QuietHandler):
+    def do_POST(self):
+        state = self.server_state
+        payload = json.loads(self._read_body() or b"{}")
+        status = state.pick_status()
+        
+        time.sleep(state.pick_latency())
+        if status != 200:
+            self._send_json(status, {"error": {"code": status, "message": "injected"}})
+            return
+        
+        jokes, count = state.jokes_for(payload)
+        if payload.get("stream"):
+            self._stream(jokes, state)
+        else:
+            self._send_json(200, {
+                "choices": [{"message": {"role": "assistant", "content": jokes}, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": PROMPT_TOKENS,
+                    "completion_tokens": JOKE_TOKENS * count,
+                    "total_tokens": PROMPT_TOKENS + JOKE_TOKENS * count,
+                },
+            })
+    
+    def _stream(self, text, state):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            delta = word if i == 0 else " " + word
+            event = {"choices": [{"delta": {"content": delta}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if state.token_delay:
+                time.sleep(state.token_delay)
+        finish = {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(finish)}\n\n".encode("utf-8"))
+        usage = {"choices": [], "usage": {
+            "prompt_tokens": PROMPT_TOKENS, "completion_tokens": JOKE_TOKENS, "total_tokens": PROMPT_TOKENS + JOKE_TOKENS,
+        }}
+        self.wfile.write(f"data: {json.dumps(usage)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+class FakeOpenRouterServer(_BackgroundServer):
+    """
+    Заглушка chat completions с настраиваемой задержкой,
+    долей ошибок 5xx и долей ответов 429.
+    """
+    
+    handler_class = _OpenRouterHandler
+    
+    def __init__(self, latency=1.0, jitter=0.2, error_rate=0.0, rate_limit_rate=0.0,
+                 token_delay=0.0, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.token_delay = token_delay
+        self.requests = 0
+        self.statuses = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def pick_status(self):
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                status = 429
+            elif roll < self.rate_limit_rate + self.error_rate:
+                status = 500
+            else:
+                status = 200
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            return status
+    
+    def pick_latency(self):
+        with self._lock:
+            return max(0.0, self._random.gauss(self.latency, self.jitter))
+    
+    def jokes_for(self, payload):
+        """
+        Текст ответа и число анекдотов в нем. На пакетный запрос (response_format)
+        отвечает JSON с анекдотом на каждую пронумерованную тему промпта.
+        """
+        if not payload.get("response_format"):
+            return JOKE_TEXT, 1
+        prompt = payload["messages"][-1]["content"]
+        count = len(re.findall(r"^\d+\. ", prompt, flags=re.MULTILINE)) or 1
+        jokes = [{"id": i, "text": f"{JOKE_TEXT} ({i})"} for i in range(1, count + 1)]
+        return json.dumps({"jokes": jokes}, ensure_ascii=False), count
@@ -0,0 +1,354 @@
+"""
+Сквозной нагрузочный тест бота на локальных заглушках Telegram и OpenRouter.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.load --rate 20 --duration 30 --latency 1.5 --rate-limit-rate 0.05
+
+Результаты пишутся в JSON (--output), чтобы сравнивать коммиты между собой:
+
+    python -m benchmarks.load --compare benchmarks/results/load-<commit>.json
+
+С --shards N бот запускается воркерами в отдельных процессах, как в режиме SHARDS.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from benchmarks.fake_servers import FakeOpenRouterServer, FakeTelegramServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# Префиксы промежуточных сообщений и ошибок бота
+PLACEHOLDER_PREFIX = "🎭 Генерирую"
+STREAM_SUFFIX = " ▌"
+ERROR_PREFIXES = ("❌", "😞", "⚠️", "⏳")
+
+COLD_THEMES = ["бухгалтеры", "сантехники", "пингвины", "дачники", "таксисты", "библиотекари"]
+
+def percentile(values, p):
+    """Перцентиль p (0-100) методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(values, scale=1000.0):
+    """p50/p95/p99/max/mean в миллисекундах"""
+    if not values:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "mean": 0.0}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50) * scale,
+        "p95": percentile(values, 95) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values) * scale,
+        "mean": sum(values) / len(values) * scale,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+class LoadRecorder:
+    """Сопоставляет отправленные обновления с итоговыми ответами бота"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(deque)
+        self.latencies = []
+        self.sent = 0
+        self.completed = 0
+        self.errors = 0
+        self.all_done = threading.Event()
+        self.sending_finished = False
+    
+    def on_sent(self, chat_id, timestamp):
+        with self._lock:
+            self._pending[chat_id].append(timestamp)
+            self.sent += 1
+    
+    def on_message(self, chat_id, text, method, timestamp):
+        # Заглушку и промежуточные правки потокового режима не считаем
+        if text.startswith(PLACEHOLDER_PREFIX) or text.endswith(STREAM_SUFFIX):
+            return
+        with self._lock:
+            pending = self._pending.get(chat_id)
+            if not pending:
+                return
+            self.latencies.append(timestamp - pending.popleft())
+            self.completed += 1
+            if text.startswith(ERROR_PREFIXES):
+                self.errors += 1
+            if self.sending_finished and self.completed >= self.sent:
+                self.all_done.set()
+    
+    def finish_sending(self):
+        with self._lock:
+            self.sending_finished = True
+            if self.completed >= self.sent:
+                self.all_done.set()
+
+def make_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+async def monitor_loop_lag(samples, stop, interval=0.05):
+    """Задержка event loop: насколько позже запланированного просыпается sleep"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+async def start_in_process(args, db_latencies):
+    """Бот в процессе теста: обновления кладутся прямо в очередь приложения"""
+    from telegram import Update
+    from anekdotych import AnekdotychBot
+    from rate_limiter import limiter
+    
+    if not args.respect_limits:
+        limiter.rate = float("inf")
+        limiter.daily_limit = 10 ** 9
+    
+    anekdotych = AnekdotychBot()
+    application = anekdotych.application
+    
+    # Время записи в базу меряем вокруг пакетной записи
+    original_log_requests = anekdotych.db.log_requests
+    
+    def timed_log_requests(rows):
+        start = time.perf_counter()
+        try:
+            return original_log_requests(rows)
+        finally:
+            db_latencies.append(time.perf_counter() - start)
+    
+    anekdotych.db.log_requests = timed_log_requests
+    
+    await application.initialize()
+    await application.start()
+    await anekdotych.on_startup(application)
+    
+    async def feed(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    
+    async def shutdown():
+        await application.stop()
+        await anekdotych.on_shutdown(application)
+        await application.shutdown()
+    
+    return feed, shutdown
+
+async def start_sharded(args, telegram, startup_timeout=60.0):
+    """Маршрутизатор фронта и процессы-воркеры, как при запуске с SHARDS"""
+    from sharding import ShardRouter
+    
+    overrides = {} if args.respect_limits else {"REQUEST_COOLDOWN": 0, "MAX_REQUESTS_PER_USER": 10 ** 9}
+    router = ShardRouter(args.shards, overrides)
+    router.start()
+    
+    # Воркер готов, когда его бот представился через getMe
+    deadline = time.perf_counter() + startup_timeout
+    while telegram.calls.get("getMe", 0) < args.shards and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    
+    async def feed(data):
+        router.dispatch(data)
+    
+    async def shutdown():
+        await asyncio.get_running_loop().run_in_executor(None, router.stop)
+    
+    return feed, shutdown
+
+def pick_text(rng, args, popular_themes):
+    roll = rng.random()
+    if roll < args.random_ratio:
+        return "/random"
+    if roll < args.random_ratio + args.cold_ratio:
+        return f"{rng.choice(COLD_THEMES)} {rng.randint(1, 10 ** 6)}"
+    return rng.choice(popular_themes)
+
+async def run_benchmark(args):
+    recorder = LoadRecorder()
+    telegram = FakeTelegramServer(on_message=recorder.on_message).start()
+    openrouter = FakeOpenRouterServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        token_delay=args.token_delay,
+        seed=args.seed,
+    ).start()
+    
+    # Конфигурация читается при импорте - окружение готовим заранее
+    os.environ["TELEGRAM_TOKEN"] = "123456:BENCHMARK"
+    os.environ["TELEGRAM_API_URL"] = f"{telegram.url}/bot"
+    os.environ["OPENROUTER_API_URL"] = f"{openrouter.url}/api/v1/chat/completions"
+    os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")
+    workdir = tempfile.mkdtemp(prefix="anekdotych-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    
+    from utils.constants import POPULAR_THEMES
+    
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    
+    db_latencies = []
+    if args.shards:
+        feed, shutdown = await start_sharded(args, telegram)
+    else:
+        feed, shutdown = await start_in_process(args, db_latencies)
+    
+    loop_lag = []
+    stop_monitor = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(loop_lag, stop_monitor))
+    
+    rng = random.Random(args.seed)
+    total = int(args.rate * args.duration)
+    started = time.perf_counter()
+    for i in range(total):
+        delay = started + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        user_id = 1000 + i % args.users
+        data = make_update(i + 1, user_id, pick_text(rng, args, POPULAR_THEMES))
+        recorder.on_sent(user_id, time.perf_counter())
+        await feed(data)
+    recorder.finish_sending()
+    
+    await asyncio.get_running_loop().run_in_executor(None, recorder.all_done.wait, args.drain_timeout)
+    elapsed = time.perf_counter() - started
+    
+    stop_monitor.set()
+    await monitor
+    await shutdown()
+    telegram.stop()
+    openrouter.stop()
+    
+    from joke_pool import joke_pool
+    from metrics import tokens_per_joke
+    
+    # Средние токены на анекдот по режимам генерации
+    token_means = {
+        dict(key).get("mode"): total / count
+        for key, (_, total, count) in tokens_per_joke.snapshot().items() if count
+    }
+    
+    return {
+        "benchmark": "load",
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "sent": recorder.sent,
+        "completed": recorder.completed,
+        "errors": recorder.errors,
+        "timed_out": recorder.sent - recorder.completed,
+        "duration_s": elapsed,
+        "throughput_rps": recorder.completed / elapsed if elapsed else 0.0,
+        "latency_ms": summarize(recorder.latencies),
+        "db_write_ms": summarize(db_latencies),
+        "loop_lag_ms": summarize(loop_lag),
+        "upstream": {"requests": openrouter.requests, "statuses": openrouter.statuses},
+        "telegram_calls": telegram.calls,
+        "joke_pool": joke_pool.stats(),
+        "tokens_per_joke": token_means,
+    }
+
+# Метрики для сравнения: (путь, чем меньше - тем лучше)
+COMPARED_METRICS = [
+    (("throughput_rps",), False),
+    (("latency_ms", "p50"), True),
+    (("latency_ms", "p95"), True),
+    (("latency_ms", "p99"), True),
+    (("db_write_ms", "p95"), True),
+    (("loop_lag_ms", "p99"), True),
+    (("errors",), True),
+]
+
+def compare(current, baseline):
+    """Печатает изменения ключевых метрик относительно прошлого прогона"""
+    print(f"\nСравнение с {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for path, lower_is_better in COMPARED_METRICS:
+        old, new = baseline, current
+        for key in path:
+            old = old.get(key, 0) if isinstance(old, dict) else 0
+            new = new.get(key, 0) if isinstance(new, dict) else 0
+        change = (new - old) / old * 100 if old else 0.0
+        better = (change < 0) == lower_is_better if change else True
+        mark = "✅" if better else "⚠️"
+        print(f"  {mark} {'.'.join(path)}: {old:.2f} -> {new:.2f} ({change:+.1f}%)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота Анекдотыч")
+    parser.add_argument("--rate", type=float, default=10.0, help="Обновлений в секунду")
+    parser.add_argument("--duration", type=float, default=20.0, help="Длительность подачи нагрузки, секунды")
+    parser.add_argument("--users", type=int, default=200, help="Число синтетических пользователей")
+    parser.add_argument("--random-ratio", type=float, default=0.2, help="Доля запросов /random")
+    parser.add_argument("--cold-ratio", type=float, default=0.3, help="Доля запросов на редкие темы")
+    parser.add_argument("--latency", type=float, default=1.0, help="Средняя задержка OpenRouter, секунды")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Разброс задержки OpenRouter, секунды")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Пауза между фрагментами SSE, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--respect-limits", action="store_true", help="Не отключать лимиты пользователей")
+    parser.add_argument("--shards", type=int, default=0, help="Воркеры в отдельных процессах (0 - бот в процессе теста)")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Сколько ждать последних ответов")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="Не приглушать логи бота")
+    parser.add_argument("--output", help="Файл результатов (по умолчанию benchmarks/results/load-<commit>.json)")
+    parser.add_argument("--compare", help="Файл результатов прошлого прогона для сравнения")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"load-{git_commit()}.json"))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    
+    results = asyncio.run(run_benchmark(args))
+    
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    
+    latency = results["latency_ms"]
+    print(f"Отправлено: {results['sent']}, обработано: {results['completed']}, ошибок: {results['errors']}")
+    print(f"Пропускная способность: {results['throughput_rps']:.2f} ответов/с")
+    print(f"Задержка, мс: p50={latency['p50']:.0f} p95={latency['p95']:.0f} p99={latency['p99']:.0f}")
+    print(f"Запись в БД p95: {results['db_write_ms']['p95']:.1f} мс, лаг event loop p99: {results['loop_lag_ms']['p99']:.1f} мс")
+    print(f"Результаты: {output}")
+    
+    if baseline:
+        compare(results, baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Время старта бота: от запуска процесса до ответа на первое обновление.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.startup --runs 5
+
+Каждый прогон запускает `python bot.py` отдельным процессом против заглушек
+Telegram и OpenRouter. Первый прогон идет на пустой базе (схема создается),
+остальные - на уже существующей, как при обычном перезапуске.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fake_servers import FakeOpenRouterServer, FakeTelegramServer
+from benchmarks.load import REPO_ROOT, RESULTS_DIR, git_commit, make_update, summarize
+
+def measure(workdir, openrouter_url, timeout):
+    """Один запуск: (до первого getUpdates, до ответа на /start) в секундах"""
+    replied = threading.Event()
+    reply_at = []
+    
+    def on_message(chat_id, text, method, timestamp):
+        if not reply_at:
+            reply_at.append(timestamp)
+            replied.set()
+    
+    telegram = FakeTelegramServer(on_message=on_message).start()
+    telegram.add_update(make_update(1, 1000, "/start"))
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN="123456:STARTUP",
+        TELEGRAM_API_URL=f"{telegram.url}/bot",
+        OPENROUTER_API_URL=openrouter_url,
+        DEEPSEEK_API_KEY="benchmark",
+        BOT_MODE="polling",
+    )
+    
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "bot.py")],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not replied.wait(timeout):
+            raise RuntimeError("бот не ответил на первое обновление")
+        ready = telegram.first_calls.get("getUpdates", reply_at[0]) - started
+        return ready, reply_at[0] - started
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        telegram.stop()
+
+def run_benchmark(args):
+    openrouter = FakeOpenRouterServer(latency=0.0, jitter=0.0).start()
+    openrouter_url = f"{openrouter.url}/api/v1/chat/completions"
+    workdir = tempfile.mkdtemp(prefix="anekdotych-startup-")
+    
+    try:
+        cold_ready, cold_first = measure(workdir, openrouter_url, args.timeout)
+        warm_ready, warm_first = [], []
+        for _ in range(args.runs):
+            ready, first = measure(workdir, openrouter_url, args.timeout)
+            warm_ready.append(ready)
+            warm_first.append(first)
+    finally:
+        openrouter.stop()
+    
+    return {
+        "benchmark": "startup",
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "cold": {"ready_ms": cold_ready * 1000, "first_update_ms": cold_first * 1000},
+        "warm_ready_ms": summarize(warm_ready),
+        "warm_first_update_ms": summarize(warm_first),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Время старта бота Анекдотыч")
+    parser.add_argument("--runs", type=int, default=5, help="Прогонов на существующей базе")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Сколько ждать ответа, секунды")
+    parser.add_argument("--output", help="Файл результатов (по умолчанию benchmarks/results/startup-<commit>.json)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"startup-{git_commit()}.json"))
+    results = run_benchmark(args)
+    
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    
+    warm = results["warm_first_update_ms"]
+    print(f"Холодный старт (пустая база): первое обновление через {results['cold']['first_update_ms']:.0f} мс")
+    print(f"Перезапуск: первое обновление p50={warm['p50']:.0f} мс, max={warm['max']:.0f} мс")
+    print(f"Готов к приему (первый getUpdates) p50={results['warm_ready_ms']['p50']:.0f} мс")
+    print(f"Результаты: {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,54 @@
-import logging
-import time
-from telegram.ext import (
-    Application, CommandHandler, MessageHandler, 
-    ContextTypes, filters, CallbackContext
-)
+"""
+Точка входа: python bot.py
+Модуль намеренно легкий: в режиме шардов воркеры запускаются через spawn
+и заново импортируют его как __mp_main__ еще до своих настроек (configure_worker),
+поэтому бот, обработчики и логирование подключаются только внутри main().
+"""
 
-from handlers.commands import (
-    start_command, help_command, stats_command, 
-    top_command, admin_command
-)
-from handlers.messages import handle_text_message, handle_joke_request
-from database import Database
+import logging
+from telegram.ext import Application
 from config import Config
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-
-class AnekdotychBot:
-    def __init__(self):
-        self.db = Database()
-        self.application = Application.builder().token(Config.TELEGRAM_TOKEN).build()
-        self.setup_handlers()
-        self.setup_jobs()
-    
-    def setup_handlers(self):
-        """Настройка обработчиков команд"""
-        
-        # Основные команды
-        self.application.add_handler(CommandHandler("start", start_command))
-        self.application.add_handler(CommandHandler("help", help_command))
-        self.application.add_handler(CommandHandler("stats", stats_command))
-        self.application.add_handler(CommandHandler("top", top_command))
-        self.application.add_handler(CommandHandler("admin", admin_command))
-        self.application.add_handler(CommandHandler("joke", self.joke_command))
-        self.application.add_handler(CommandHandler("random", self.random_joke_command))
-        
-        # Обработка текстовых сообщений
-        self.application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, 
-            handle_text_message
-        ))
+def serve_updates(application: Application):
+    """Получение обновлений: long polling или встроенный HTTP-сервер для вебхука"""
+    if Config.BOT_MODE != "webhook":
+        application.run_polling(allowed_updates=Config.ALLOWED_UPDATES)
+        return
     
-    def setup_jobs(self):
-        """Настройка фоновых задач"""
-        job_queue = self.application.job_queue
-        # Проверка здоровья каждые 30 минут
-        job_queue.run_repeating(self.health_check, interval=1800, first=10)
+    if not Config.WEBHOOK_SECRET:
+        logging.warning("⚠️ WEBHOOK_SECRET не задан - запросы к вебхуку не проверяются")
     
-    async def joke_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /joke"""
-        if context.args:
-            theme = ' '.join(context.args)
-            await handle_joke_request(update, context, theme)
-        else:
-            await update.message.reply_text("🎭 Укажите тему для анекдота!\nПример: /joke программисты")
+    # Без WEBHOOK_URL адрес строится из listen/port - удобно для локальной проверки
+    webhook_url = None
+    if Config.WEBHOOK_URL:
+        webhook_url = f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}"
     
-    async def random_joke_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /random"""
-        await handle_joke_request(update, context, "random")
-    
-    async def health_check(self, context: CallbackContext):
-        """Проверка здоровья бота"""
-        try:
-            # Простой тест базы данных
-            stats = self.db.get_global_stats()
-            logging.info("✅ Health check passed")
-        except Exception as e:
-            logging.error(f"❌ Health check failed: {e}")
+    application.run_webhook(
+        listen=Config.WEBHOOK_LISTEN,
+        port=Config.WEBHOOK_PORT,
+        url_path=Config.WEBHOOK_PATH,
+        webhook_url=webhook_url,
+        secret_token=Config.WEBHOOK_SECRET,
+        allowed_updates=Config.ALLOWED_UPDATES,
+        max_connections=Config.CONCURRENT_UPDATES
+    )
+
+def main():
+    if Config.SHARDS:
+        # Несколько процессов: этот принимает обновления и раздает их воркерам
+        from sharding import main as serve_shards
+        serve_shards()
+        return
     
-    def run(self):
-        """Запуск бота"""
-        print("🤖 Бот Анекдотыч запущен!")
-        print("🔑 Проверка конфигурации...")
-        print(f"Telegram Token: {'✅' if Config.TELEGRAM_TOKEN else '❌'}")
-        print(f"OpenRouter API Key: {'✅' if Config.OPENROUTER_API_KEY else '❌'}")
-        print(f"Database: {'✅' if self.db else '❌'}")
-        print("🚀 Бот готов к работе 24/7!")
-        
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Настройка логирования
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    from anekdotych import AnekdotychBot
+    bot = AnekdotychBot()
+    bot.print_status()
+    serve_updates(bot.application)
 
 if __name__ == "__main__":
-    bot = AnekdotychBot()
-    bot.run()
\ No newline at end of file
+    main()
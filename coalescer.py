@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+from config import Config
+from utils.helpers import normalize_theme
+
+class _Flight:
+    """Одна общая генерация для группы одинаковых запросов"""
+    __slots__ = ('future', 'slots', 'sharers')
+    
+    def __init__(self, future):
+        self.future = future
+        # Участники, которым нужен свой анекдот (лидер - слот 0)
+        self.slots = 1
+        self.sharers = 0
+
+class GenerationCoalescer:
+    """
+    Single-flight для генерации: одновременные запросы на одну нормализованную тему
+    собираются в коротком окне и обслуживаются одним обращением к генератору.
+    Каждый участник получает свой анекдот; один и тот же текст достается
+    нескольким пользователям, только если они согласились (share=True).
+    """
+    
+    def __init__(self, generate_many, window=None, max_batch=None, hot_seconds=None, clock=time.monotonic):
+        # generate_many(theme, count) -> [(joke, tokens_used)]
+        self.generate_many = generate_many
+        self.window = window if window is not None else Config.COALESCE_WINDOW
+        self.max_batch = max_batch or Config.COALESCE_MAX_BATCH
+        self.hot_seconds = hot_seconds if hot_seconds is not None else Config.COALESCE_HOT_SECONDS
+        self.clock = clock
+        self._open: Dict[str, _Flight] = {}
+        self._inflight: Dict[str, _Flight] = {}
+        self._last_seen: Dict[str, float] = {}
+        
+        # Метрики
+        self.flights = 0
+        self.coalesced = 0
+        self.shared = 0
+        self.upstream_jokes = 0
+    
+    def should_coalesce(self, theme: str) -> bool:
+        """Тема "горячая": по ней уже идет генерация или ее недавно запрашивали"""
+        key = normalize_theme(theme)
+        now = self.clock()
+        last_seen = self._last_seen.get(key)
+        self._last_seen[key] = now
+        if len(self._last_seen) > Config.COALESCE_TRACKED_THEMES:
+            self._forget_stale(now)
+        
+        if key in self._open or key in self._inflight:
+            return True
+        return last_seen is not None and now - last_seen < self.hot_seconds
+    
+    def joinable(self, theme: str, share: bool = False) -> bool:
+        """Запрос присоединится к уже идущей генерации, не создавая нового обращения к API"""
+        key = normalize_theme(theme)
+        flight = self._open.get(key)
+        if flight is not None and (share or flight.slots < self.max_batch):
+            return True
+        return share and key in self._inflight
+    
+    async def generate(self, theme: str, share: bool = False, admission=None) -> Tuple[str, int]:
+        """
+        Генерация через общий полет; возвращает (анекдот, токены).
+        admission() - место в очереди генераций (асинхронный контекстный менеджер) для запроса,
+        который присоединяется без своего места: если полет не дал ему анекдота,
+        собственная генерация ждет очереди, как любая другая.
+        """
+        key = normalize_theme(theme)
+        
+        # Присоединяемся к полету, который еще набирает участников
+        flight = self._open.get(key)
+        if flight is not None and (share or flight.slots < self.max_batch):
+            self.coalesced += 1
+            if share:
+                flight.sharers += 1
+                slot = 0
+            else:
+                slot = flight.slots
+                flight.slots += 1
+            return await self._wait(theme, flight, slot, share, admission)
+        
+        # Согласным на общий анекдот подходит и уже запущенная генерация
+        flight = self._inflight.get(key)
+        if flight is not None and share:
+            self.coalesced += 1
+            flight.sharers += 1
+            return await self._wait(theme, flight, 0, share, admission)
+        
+        return await self._lead(theme, key)
+    
+    def stats(self) -> dict:
+        """Метрики объединения"""
+        return {
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "shared": self.shared,
+            "upstream_jokes": self.upstream_jokes,
+            "in_flight": len(self._open) + len(self._inflight),
+        }
+    
+    async def _lead(self, theme, key):
+        flight = _Flight(asyncio.get_running_loop().create_future())
+        self._open[key] = flight
+        self.flights += 1
+        try:
+            try:
+                # Окно сбора одинаковых запросов
+                if self.window > 0:
+                    await asyncio.sleep(self.window)
+            finally:
+                # Полет мог быть уже закрыт, если набрал максимум участников
+                if self._open.get(key) is flight:
+                    del self._open[key]
+            
+            self._inflight[key] = flight
+            jokes = await self.generate_many(theme, flight.slots)
+            self.upstream_jokes += len(jokes)
+            flight.future.set_result(jokes)
+        except Exception as e:
+            flight.future.set_exception(e)
+            # Участников может не быть - исключение помечаем полученным
+            flight.future.exception()
+            raise
+        finally:
+            # Лидер отменен - участники не должны ждать вечно
+            if not flight.future.done():
+                flight.future.cancel()
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+        
+        return self._pick(jokes, 0)
+    
+    async def _wait(self, theme, flight, slot, share, admission):
+        try:
+            jokes = await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            if not flight.future.cancelled():
+                raise
+            # Отменен лидер, а не этот запрос - генерируем свой
+            jokes = []
+        if share:
+            self.shared += 1
+        result = self._pick(jokes, slot)
+        if result is None:
+            # Генератор вернул меньше анекдотов, чем участников - генерируем свой
+            logging.debug(f"Coalesced slot {slot} not filled for '{theme}', generating separately")
+            if admission is None:
+                own = await self.generate_many(theme, 1)
+            else:
+                async with admission():
+                    own = await self.generate_many(theme, 1)
+            self.upstream_jokes += len(own)
+            result = self._pick(own, 0)
+        return result or ("❌ Ошибка: не удалось сгенерировать анекдот", 0)
+    
+    def _pick(self, jokes: List[Tuple[str, int]], slot):
+        if slot < len(jokes):
+            return jokes[slot]
+        # Ошибку генерации получают все участники
+        if jokes and jokes[0][0].startswith(('❌', '⚠️')):
+            return jokes[0]
+        return None
+    
+    def _forget_stale(self, now):
+        stale = [key for key, seen in self._last_seen.items() if now - seen >= self.hot_seconds]
+        for key in stale:
+            del self._last_seen[key]
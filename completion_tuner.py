@@ -0,0 +1,140 @@
+"""
+Подбор max_tokens по наблюдаемой длине ответов модели. Анекдот - 2-4 предложения,
+и фиксированный лимит с большим запасом только удлиняет хвост задержки и расход
+на разговорчивых ответах. Лимит темы - перцентиль длины ее ответов с запасом;
+пока по теме мало замеров, берется распределение всех тем, пока мало и их - MAX_TOKENS_DEFAULT.
+Так же подбирается остановка: если анекдоты темы укладываются в один абзац,
+пустая строка после текста - начало пояснений, и генерация на ней останавливается.
+"""
+
+import re
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional
+from config import Config
+from metrics import registry
+from slo_controller import slo_controller, LEAN
+from utils.helpers import normalize_theme
+
+completion_truncations = registry.counter(
+    "anekdotych_completion_truncated_total", "Ответы, обрезанные по max_tokens"
+)
+
+# Остановка на пустой строке - конце абзаца
+PARAGRAPH_STOP = "\n\n"
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+
+def _quantile(samples, q) -> int:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def paragraphs(text: str) -> int:
+    """Число абзацев (блоков, разделенных пустой строкой)"""
+    return sum(1 for part in _PARAGRAPHS.split(text.strip()) if part.strip())
+
+class CompletionTuner:
+    """Скользящие окна длины ответов (completion_tokens) и числа абзацев по темам и по всем темам сразу"""
+    
+    def __init__(self, window=None, min_samples=None, max_themes=None):
+        self.window = window or Config.MAX_TOKENS_WINDOW
+        self.min_samples = min_samples or Config.MAX_TOKENS_MIN_SAMPLES
+        self.max_themes = max_themes or Config.MAX_TOKENS_THEMES
+        self._themes: "OrderedDict[str, Deque[int]]" = OrderedDict()
+        self._all: Deque[int] = deque(maxlen=self.window * 5)
+        self._paragraphs: "OrderedDict[str, Deque[int]]" = OrderedDict()
+        self._all_paragraphs: Deque[int] = deque(maxlen=self.window * 5)
+        self._requests = 0
+        
+        # Метрики
+        self.observed = 0
+        self.truncated = 0
+        self.paragraph_stops = 0
+    
+    def max_tokens(self, theme: Optional[str] = None) -> int:
+        """max_tokens для одного анекдота на тему; в режиме lean - по более низкому перцентилю"""
+        samples = self._themes.get(normalize_theme(theme)) if theme else None
+        if samples is None or len(samples) < self.min_samples:
+            samples = self._all
+        if len(samples) < self.min_samples:
+            return slo_controller.max_tokens(Config.MAX_TOKENS_DEFAULT)
+        
+        lean = slo_controller.level >= LEAN
+        quantile = Config.MAX_TOKENS_LEAN_QUANTILE if lean else Config.MAX_TOKENS_QUANTILE
+        limit = int(_quantile(samples, quantile) * Config.MAX_TOKENS_MARGIN)
+        return min(Config.MAX_TOKENS_MAX, max(Config.MAX_TOKENS_MIN, limit))
+    
+    def batch_tokens(self, themes) -> int:
+        """max_tokens пакета: лимиты тем плюс JSON-обертка, не больше BATCH_TOKENS_PER_JOKE на анекдот"""
+        return sum(
+            min(Config.BATCH_TOKENS_PER_JOKE, self.max_tokens(theme) + Config.BATCH_JOKE_OVERHEAD)
+            for theme in themes
+        )
+    
+    def stop(self, theme: Optional[str] = None) -> List[str]:
+        """
+        Стоп-последовательности запроса: JOKE_STOP_SEQUENCES и, если перцентиль
+        MAX_TOKENS_QUANTILE числа абзацев темы - один абзац, еще и пустая строка.
+        Каждый STOP_EXPLORE_EVERY-й запрос идет без нее, чтобы замеры абзацев не устаревали.
+        """
+        stop = list(Config.JOKE_STOP_SEQUENCES)
+        self._requests += 1
+        if self._requests % Config.STOP_EXPLORE_EVERY == 0:
+            return stop
+        samples = self._paragraphs.get(normalize_theme(theme)) if theme else None
+        if samples is None or len(samples) < self.min_samples:
+            samples = self._all_paragraphs
+        if len(samples) >= self.min_samples and _quantile(samples, Config.MAX_TOKENS_QUANTILE) <= 1:
+            stop.append(PARAGRAPH_STOP)
+            self.paragraph_stops += 1
+        return stop
+    
+    def observe(self, theme: Optional[str], completion_tokens: int, finish_reason: Optional[str],
+                text: Optional[str] = None, stop=()):
+        """
+        Длина ответа на тему. Обрезанный ответ (finish_reason = "length") настоящей длины
+        не показывает - учитываем его длиннее, чтобы лимит темы вырос.
+        text и stop запроса - для замера абзацев; ответ, остановленный на пустой строке,
+        больше одного абзаца не покажет и в замер не идет.
+        """
+        if text and PARAGRAPH_STOP not in stop and finish_reason != "length":
+            self._all_paragraphs.append(paragraphs(text))
+            if theme:
+                self._window(self._paragraphs, normalize_theme(theme)).append(paragraphs(text))
+        if not completion_tokens:
+            return
+        self.observed += 1
+        if finish_reason == "length":
+            self.truncated += 1
+            completion_truncations.inc()
+            completion_tokens = int(completion_tokens * Config.MAX_TOKENS_TRUNCATION_GROWTH)
+        
+        self._all.append(completion_tokens)
+        if theme:
+            self._window(self._themes, normalize_theme(theme)).append(completion_tokens)
+    
+    def _window(self, themes, key) -> Deque[int]:
+        """Окно замеров темы; давно не встречавшиеся темы вытесняются"""
+        samples = themes.get(key)
+        if samples is None:
+            if len(themes) >= self.max_themes:
+                themes.popitem(last=False)
+            samples = themes[key] = deque(maxlen=self.window)
+        else:
+            themes.move_to_end(key)
+        return samples
+    
+    def stats(self) -> dict:
+        return {
+            "themes": len(self._themes),
+            "samples": len(self._all),
+            "max_tokens": self.max_tokens(),
+            "p50": _quantile(self._all, 0.5) if self._all else None,
+            "observed": self.observed,
+            "truncated": self.truncated,
+            "truncated_rate": self.truncated / self.observed if self.observed else 0.0,
+            "paragraph_stops": self.paragraph_stops,
+        }
+
+# Общий подбор процесса
+completion_tuner = CompletionTuner()
+
+registry.gauge("anekdotych_max_tokens", "max_tokens для темы без своих замеров", lambda: completion_tuner.max_tokens())
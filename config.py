@@ -6,10 +6,90 @@ load_dotenv()
 class Config:
     # Telegram
     TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', "https://api.telegram.org/bot")
+    
+    # Режим получения обновлений: polling или webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес, например https://example.com
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('PORT', 8443))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Проверяется в X-Telegram-Bot-Api-Secret-Token
+    
+    # Бот обрабатывает сообщения и инлайн-режим - остальные обновления не запрашиваем.
+    # chosen_inline_result приходит, только если в @BotFather включен /setinlinefeedback
+    ALLOWED_UPDATES = ["message", "inline_query", "chosen_inline_result"]
+    CONCURRENT_UPDATES = 64  # Сколько обновлений обрабатывать одновременно
+    
+    # Исходящие сообщения: лимиты Bot API и повторы
+    TELEGRAM_GLOBAL_RATE = 30  # Сообщений в секунду на бота
+    TELEGRAM_CHAT_RATE = 1  # Сообщений в секунду в один чат
+    TELEGRAM_CHAT_BURST = 3  # Сколько сообщений в чат можно отправить подряд
+    TELEGRAM_SEND_RETRIES = 3  # Попыток отправки при сетевых ошибках
+    TELEGRAM_BACKOFF_BASE = 0.5  # Начальная задержка повтора, секунды (удваивается, с разбросом)
+    TELEGRAM_BACKOFF_MAX = 10
+    TELEGRAM_TRACKED_CHATS = 10000  # Сколько чатов держать в планировщике до очистки простаивающих
+    
+    # Шарды: фронт-процесс раздает обновления воркерам по хешу user_id (0 - один процесс)
+    SHARDS = int(os.getenv('SHARDS', 0))
+    SHARD_QUEUE_SIZE = 10000  # Обновлений в очереди одного воркера
+    SHARD_INDEX = 0  # Номер текущего воркера; общие фоновые задачи выполняет нулевой
+    # Общие счетчики шардов: memory://, sqlite:///путь или redis://хост:порт/база
+    COUNTERS_URL = os.getenv('COUNTERS_URL', 'sqlite:///anekdotych.db')
+    
+    # Метрики в формате Prometheus (0 - эндпоинт выключен)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
     
     # OpenRouter
     OPENROUTER_API_KEY = os.getenv('DEEPSEEK_API_KEY')
-    OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+    OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', "https://openrouter.ai/api/v1/chat/completions")
+    OPENROUTER_TIMEOUT = 30  # Таймаут запроса в секундах
+    OPENROUTER_CONNECT_TIMEOUT = 5  # Таймаут установки соединения
+    OPENROUTER_MAX_CONNECTIONS = 20  # Размер пула keep-alive соединений
+    OPENROUTER_KEEPALIVE_EXPIRY = 60  # Секунды жизни простаивающего соединения
+    OPENROUTER_MAX_CONCURRENCY = 10  # Одновременных генераций в полете
+    
+    # Очередь генераций: справедливо по пользователям, с приоритетами
+    GENERATION_CONCURRENCY = 8  # Генераций пользователей одновременно (запас - хеджам и пулу)
+    GENERATION_WEIGHTS = {"admin": 4, "command": 2, "text": 1}  # Мест за ход пользователя по классу заявки
+    GENERATION_FEEDBACK_INTERVAL = 3.0  # Как часто обновлять место в очереди в заглушке, секунды
+    
+    # Модели в порядке предпочтения: первая основная, остальные - для хеджирования и фолбэка
+    OPENROUTER_MODELS = [
+        model.strip()
+        for model in os.getenv('OPENROUTER_MODELS', "deepseek/deepseek-chat,mistralai/mistral-small").split(',')
+        if model.strip()
+    ]
+    HEDGE_PERCENTILE = 0.9  # После какого перцентиля задержки модели отправлять запасной запрос
+    HEDGE_MIN_DELAY = 1.0  # Границы задержки перед запасным запросом, секунды
+    HEDGE_MAX_DELAY = 8.0
+    HEDGE_DEFAULT_DELAY = 4.0  # Задержка, пока по модели мало замеров
+    HEDGE_MIN_SAMPLES = 20
+    HEDGE_WINDOW = 200  # Сколько последних замеров задержки хранить на модель
+    GENERATION_DEADLINE = 20  # Предельное время генерации со всеми повторами, секунды
+    BREAKER_FAILURE_THRESHOLD = 3  # Ошибок подряд до отключения модели
+    BREAKER_OPEN_SECONDS = 30  # На сколько отключать модель после ошибок
+    BREAKER_THROTTLE_SECONDS = 60  # На сколько отключать модель после 429 без Retry-After
+    
+    # Деградация по SLO ответов OpenRouter: шаг режима на каждой проверке здоровья
+    HEALTH_CHECK_INTERVAL = 30  # Секунды между проверками здоровья
+    HEALTH_SUMMARY_INTERVAL = 1800  # Как часто писать сводку метрик в лог, секунды
+    SLO_WINDOW = 300  # Окно замеров, секунды
+    SLO_MIN_SAMPLES = 5  # Меньше замеров - режим не меняется
+    SLO_LATENCY_P95 = 8.0  # Цель p95 ответа (для потока - до первого фрагмента), секунды
+    SLO_ERROR_RATE = 0.2  # Допустимая доля ошибок и таймаутов
+    SLO_RECOVERY_MARGIN = 0.7  # Шаг назад, когда метрики ниже этой доли целей
+    SLO_LEAN_TOKENS = 0.6  # Доля max_tokens начиная с режима lean
+    SLO_FAST_TIMEOUT = 12  # Таймаут запроса начиная с режима fast, секунды
+    SLO_FAST_DEADLINE = 12  # Общее время генерации начиная с режима fast, секунды
+    SLO_POPULAR_THEMES = 50  # Тем недельного топа, которые в деградации отдаются из хранилища
+    
+    # Пакетная генерация: несколько анекдотов за один запрос
+    BATCH_MAX_JOKES = 5  # Анекдотов в одном запросе
+    BATCH_TOKENS_PER_JOKE = 200  # Лимит max_tokens на каждый анекдот пакета
+    BATCH_MIN_CHARS = 20  # Границы длины годного анекдота из пакета
+    BATCH_MAX_CHARS = 1500
     
     # Настройки бота
     BOT_USERNAME = "anekdotych_bot"
@@ -20,4 +100,89 @@ class Config:
     
     # Лимиты
     MAX_REQUESTS_PER_USER = 50  # Максимум запросов в день на пользователя
-    REQUEST_COOLDOWN = 5  # Секунды между запросами
\ No newline at end of file
+    REQUEST_COOLDOWN = 5  # Секунды между запросами
+    REQUEST_BURST = 1  # Сколько запросов можно сделать подряд без паузы
+    LIMITER_SYNC_INTERVAL = 60  # Секунды между сохранениями счетчиков в базу
+    
+    # Дневной бюджет токенов OpenRouter на все процессы (0 - без ограничения)
+    DAILY_TOKEN_BUDGET = int(os.getenv('DAILY_TOKEN_BUDGET', 0))
+    TOKEN_BUDGET_BACKGROUND_RESERVE = 0.2  # Остаток бюджета, который фоновые генерации не трогают
+    
+    # Подбор max_tokens по длине ответов
+    MAX_TOKENS_DEFAULT = 250  # Пока замеров мало
+    MAX_TOKENS_MIN = 96  # Границы подобранного значения
+    MAX_TOKENS_MAX = 400
+    MAX_TOKENS_QUANTILE = 0.98  # Перцентиль длины ответа, под который подбирается лимит
+    MAX_TOKENS_LEAN_QUANTILE = 0.9  # Он же в режиме деградации lean
+    MAX_TOKENS_MARGIN = 1.2  # Запас сверх перцентиля
+    MAX_TOKENS_WINDOW = 200  # Замеров длины на тему
+    MAX_TOKENS_MIN_SAMPLES = 20  # Меньше замеров по теме - берется распределение всех тем
+    MAX_TOKENS_THEMES = 1000  # Сколько тем помнить
+    MAX_TOKENS_TRUNCATION_GROWTH = 1.5  # Обрезанный ответ учитывается как во столько раз длиннее
+    BATCH_JOKE_OVERHEAD = 24  # Токены JSON-обертки на анекдот пакета
+    JOKE_STOP_SEQUENCES = ["\n\n\n", "\n---", "\n***"]  # Модель закончила анекдот и пишет пояснения
+    STOP_EXPLORE_EVERY = 10  # Каждый N-й запрос - без подобранной остановки на пустой строке
+    
+    # Пул заранее сгенерированных анекдотов
+    JOKE_POOL_PER_THEME = 5  # Запас анекдотов на тему
+    JOKE_POOL_TTL = 6 * 3600  # Время жизни анекдота в пуле, секунды
+    JOKE_POOL_MAX_BYTES = 2 * 1024 * 1024  # Лимит памяти пула
+    JOKE_POOL_REFILL_INTERVAL = 300  # Секунды между пополнениями
+    JOKE_POOL_REFILL_BATCH = 10  # Максимум генераций за одно пополнение
+    
+    # Потоковая генерация
+    STREAM_JOKES = True  # Показывать анекдот по мере генерации
+    STREAM_EDIT_INTERVAL = 1.5  # Минимальная пауза между правками сообщения, секунды
+    STREAM_MIN_CHARS = 20  # Сколько символов накопить перед первой правкой
+    
+    # Отложенная запись журнала запросов
+    LOG_BATCH_SIZE = 50  # Строк в одной транзакции
+    LOG_FLUSH_INTERVAL = 0.5  # Максимальная задержка записи, секунды
+    LOG_MAX_PENDING = 10000  # Предел очереди, пока база недоступна; старые строки отбрасываются
+    
+    # Объединение одинаковых запросов
+    COALESCE_WINDOW = 0.3  # Окно сбора одинаковых тем, секунды
+    COALESCE_MAX_BATCH = 5  # Максимум разных анекдотов на одну генерацию
+    COALESCE_HOT_SECONDS = 10  # Тема "горячая", если ее запрашивали за это время
+    COALESCE_TRACKED_THEMES = 10000  # Сколько недавних тем помнить
+    
+    # Хранение журнала запросов: старые строки уезжают в сжатые помесячные архивы
+    RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 30))  # Сколько дней держать запросы в базе
+    RETENTION_INTERVAL = 3600  # Секунды между запусками архивации
+    RETENTION_BATCH = 5000  # Строк за одну транзакцию
+    RETENTION_VACUUM_PAGES = 2000  # Страниц, освобождаемых за один запуск incremental_vacuum
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+    
+    # Повторное использование сохраненных анекдотов без повторов для пользователя
+    JOKE_STORE_REUSE = True  # Отдавать согласным на общие анекдоты (/share) непоказанный сохраненный вместо генерации
+    JOKE_STORE_PER_THEME = 50  # Анекдотов темы в памяти
+    JOKE_STORE_THEMES = 500  # Тем в памяти
+    JOKE_STORE_MAX_PROBES = 8  # Кандидатов, проверяемых по фильтру за один выбор
+    JOKE_STORE_THEME_TTL = 300  # Через сколько секунд перечитывать тему из базы
+    JOKE_STORE_SYNC_INTERVAL = 60  # Секунды между записями хранилища в базу
+    SEEN_FILTER_BITS = 8192  # Размер фильтра пользователя: 1 КБ, ~2% ложных срабатываний на 1000 анекдотов
+    SEEN_FILTER_HASHES = 6
+    SEEN_FILTER_ROTATE_FPR = 0.01  # Доля ложных срабатываний, при которой начинается новое поколение фильтра (~850 анекдотов)
+    SEEN_FILTER_TRACKED_USERS = 10000  # Фильтров в памяти
+    
+    # Кэш статистики для /stats и /admin
+    STATS_CACHE_USERS = 50000  # Записей пользователей в памяти
+    STATS_GLOBAL_TTL = 600  # Через сколько секунд перечитывать общие счетчики из базы
+    
+    # Инлайн-режим: ответы из индекса сохраненных анекдотов
+    INLINE_CACHE_TIME = 300  # Сколько секунд Telegram кэширует ответ на одинаковый запрос
+    INLINE_MAX_RESULTS = 20  # Результатов в ответе (Telegram допускает до 50)
+    INLINE_INDEX_THEMES = 1000  # Самых популярных тем в индексе
+    INLINE_RESULTS_PER_THEME = 5  # Анекдотов темы в индексе
+    INLINE_HISTORY_ROWS = 20000  # Последних запросов из журнала при построении индекса
+    INLINE_CACHED_PREFIXES = 2000  # Собранных ответов по префиксам в памяти
+    INLINE_INDEX_REFRESH = 300  # Секунды между перестройками индекса
+    
+    # Профилирование по команде /admin profile <секунды>
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')  # Каталог отчетов
+    PROFILE_DEFAULT_SECONDS = 30  # Длительность замера без аргумента
+    PROFILE_MAX_SECONDS = 300
+    PROFILE_SAMPLE_INTERVAL = 0.005  # Шаг выборки стека event loop, секунды
+    PROFILE_TRACEMALLOC_FRAMES = 1  # Глубина стека выделений: отчет группирует по строкам, глубже - только дороже
+    PROFILE_SLOW_CALLBACK = 0.05  # Колбэки event loop дольше этого - в отчет, секунды
+    PROFILE_TOP = 40  # Строк в разделах отчета
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Общие счетчики для нескольких процессов бота (рейтинг тем в режиме шардов).
+Хранилище выбирается по COUNTERS_URL:
+    memory://            - в памяти процесса (один процесс, проверки)
+    sqlite:///path.db    - таблица в файле SQLite, общем для процессов одной машины
+    redis://host:6379/0  - Redis (нужен пакет redis)
+"""
+
+import threading
+from typing import Dict, Iterable, List, Tuple
+from storage import get_engine
+
+class LocalCounters:
+    """Счетчики в памяти процесса"""
+    
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+    
+    def incr(self, name: str, deltas: Dict[str, int]):
+        """Прибавляет deltas {ключ: приращение} к счетчикам группы name"""
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            for key, amount in deltas.items():
+                counters[key] = counters.get(key, 0) + amount
+    
+    def top(self, names: Iterable[str], limit: int) -> List[Tuple[str, int]]:
+        """Топ ключей по сумме счетчиков нескольких групп"""
+        totals = {}
+        with self._lock:
+            for name in names:
+                for key, value in self._counters.get(name, {}).items():
+                    totals[key] = totals.get(key, 0) + value
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    
+    def replace(self, groups: Dict[str, Dict[str, int]]):
+        """Заменяет все счетчики целиком"""
+        with self._lock:
+            self._counters = {name: dict(counters) for name, counters in groups.items()}
+    
+    def delete(self, names: Iterable[str]):
+        with self._lock:
+            for name in names:
+                self._counters.pop(name, None)
+    
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._counters)
+
+class SQLiteCounters:
+    """Счетчики в таблице SQLite; процессы одной машины видят одни и те же значения"""
+    
+    def __init__(self, db_path):
+        self.engine = get_engine(db_path)
+        with self.engine.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared_counters (
+                    name TEXT,
+                    key TEXT,
+                    value INTEGER DEFAULT 0,
+                    PRIMARY KEY (name, key)
+                )
+            ''')
+    
+    def incr(self, name, deltas):
+        with self.engine.connection() as conn:
+            conn.executemany('''
+                INSERT INTO shared_counters (name, key, value) VALUES (?, ?, ?)
+                ON CONFLICT (name, key) DO UPDATE SET value = value + excluded.value
+            ''', [(name, key, amount) for key, amount in deltas.items()])
+    
+    def top(self, names, limit):
+        names = list(names)
+        if not names:
+            return []
+        placeholders = ",".join("?" * len(names))
+        with self.engine.connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT key, SUM(value) AS total FROM shared_counters
+                WHERE name IN ({placeholders})
+                GROUP BY key ORDER BY total DESC LIMIT ?
+            ''', (*names, limit))
+            return cursor.fetchall()
+    
+    def replace(self, groups):
+        with self.engine.connection() as conn:
+            conn.execute('DELETE FROM shared_counters')
+            conn.executemany('''
+                INSERT INTO shared_counters (name, key, value) VALUES (?, ?, ?)
+            ''', [(name, key, value) for name, counters in groups.items() for key, value in counters.items()])
+    
+    def delete(self, names):
+        with self.engine.connection() as conn:
+            conn.executemany('DELETE FROM shared_counters WHERE name = ?', [(name,) for name in names])
+    
+    def names(self):
+        with self.engine.connection() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT name FROM shared_counters')]
+
+class RedisCounters:
+    """Счетчики в Redis: группа - sorted set, топ нескольких групп - ZUNION"""
+    
+    def __init__(self, url, prefix="anekdotych:counters:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Для COUNTERS_URL=redis://... установите пакет redis")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+    
+    def incr(self, name, deltas):
+        pipe = self.client.pipeline(transaction=False)
+        for key, amount in deltas.items():
+            pipe.zincrby(self.prefix + name, amount, key)
+        pipe.execute()
+    
+    def top(self, names, limit):
+        keys = [self.prefix + name for name in names]
+        if not keys:
+            return []
+        if len(keys) == 1:
+            items = self.client.zrevrange(keys[0], 0, limit - 1, withscores=True)
+        else:
+            items = sorted(self.client.zunion(keys, withscores=True), key=lambda item: item[1], reverse=True)[:limit]
+        return [(key, int(score)) for key, score in items]
+    
+    def replace(self, groups):
+        pipe = self.client.pipeline()
+        for name in self.names():
+            pipe.delete(self.prefix + name)
+        for name, counters in groups.items():
+            if counters:
+                pipe.zadd(self.prefix + name, counters)
+        pipe.execute()
+    
+    def delete(self, names):
+        keys = [self.prefix + name for name in names]
+        if keys:
+            self.client.delete(*keys)
+    
+    def names(self):
+        return [key[len(self.prefix):] for key in self.client.scan_iter(self.prefix + "*")]
+
+def create_counters(url: str):
+    """Хранилище счетчиков по адресу"""
+    if url.startswith("memory://"):
+        return LocalCounters()
+    if url.startswith("sqlite:///"):
+        return SQLiteCounters(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisCounters(url)
+    raise ValueError(f"Неизвестное хранилище счетчиков: {url}")
@@ -1,100 +1,276 @@
 import sqlite3
 import json
 import time
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from rate_limiter import limiter as shared_limiter
+from leaderboard import leaderboard as shared_leaderboard, WEEK_DAYS
+from migrations import migrate
+from services import lazy
+from stats_cache import StatsCache
+from storage import get_engine
+from token_budget import token_budget as shared_budget
+from utils.helpers import normalize_theme, utc_today
 
 class Database:
-    def __init__(self, db_path="anekdotych.db"):
+    def __init__(self, db_path="anekdotych.db", limiter=None, leaderboard=None, stats=None, budget=None):
         self.db_path = db_path
-        self.init_db()
+        self.limiter = limiter or shared_limiter
+        self.budget = budget or shared_budget
+        self.leaderboard = leaderboard or shared_leaderboard
+        self.stats = stats or StatsCache()
+        self.engine = get_engine(db_path)
+        
+        # Схему создаем один раз на хранилище
+        if not self.engine.initialized:
+            self.init_db()
+            self.engine.initialized = True
     
     def init_db(self):
-        """Инициализация базы данных"""
-        with sqlite3.connect(self.db_path) as conn:
-            # Таблица пользователей
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    request_count INTEGER DEFAULT 0,
-                    last_request TIMESTAMP
-                )
-            ''')
-            
-            # Таблица запросов
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    theme TEXT,
-                    joke_text TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    tokens_used INTEGER,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            conn.commit()
+        """Инициализация базы данных: применяет недостающие миграции схемы"""
+        with self.engine.connection() as conn:
+            migrate(conn)
     
     def add_user(self, user_id, username, first_name, last_name):
         """Добавление пользователя"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.engine.connection() as conn:
+            added = self.ensure_users(conn, [user_id])
             conn.execute('''
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
+                UPDATE users SET username = ?, first_name = ?, last_name = ?
+                WHERE user_id = ?
+            ''', (username, first_name, last_name, user_id))
             conn.commit()
+        self.stats.users_added(added)
+    
+    def ensure_users(self, conn, user_ids) -> int:
+        """
+        Создает недостающие строки пользователей в транзакции conn; возвращает число новых.
+        После фиксации транзакции число передается в stats.users_added.
+        """
+        cursor = conn.executemany('INSERT OR IGNORE INTO users (user_id) VALUES (?)', [(user_id,) for user_id in user_ids])
+        return max(cursor.rowcount, 0)
     
     def log_request(self, user_id, theme, joke_text, tokens_used):
         """Логирование запроса"""
-        with sqlite3.connect(self.db_path) as conn:
-            # Обновляем счетчик пользователя
-            conn.execute('''
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self.log_requests([(user_id, theme, joke_text, tokens_used, created_at)])
+    
+    def log_requests(self, rows):
+        """
+        Пакетное логирование запросов одной транзакцией.
+        rows: [(user_id, theme, joke_text, tokens_used, created_at)]
+        """
+        # Сворачиваем приращения счетчиков по пользователям и темам
+        counters = {}
+        theme_counts = {}
+        theme_tokens = {}
+        theme_last = {}
+        user_tokens = {}
+        for user_id, theme, _, tokens_used, created_at in rows:
+            count, last_request = counters.get(user_id, (0, created_at))
+            counters[user_id] = (count + 1, max(last_request, created_at))
+            tokens_used = tokens_used or 0
+            user_tokens[user_id] = user_tokens.get(user_id, 0) + tokens_used
+            
+            theme_key = normalize_theme(theme)
+            day_key = (theme_key, created_at[:10])
+            theme_counts[day_key] = theme_counts.get(day_key, 0) + 1
+            theme_tokens[day_key] = theme_tokens.get(day_key, 0) + tokens_used
+            theme_last[theme_key] = max(theme_last.get(theme_key, created_at), created_at)
+        
+        with self.engine.connection() as conn:
+            # Обновляем счетчики пользователей; запросы без /start (инлайн-режим) тоже учитываются
+            added = self.ensure_users(conn, counters)
+            conn.executemany('''
                 UPDATE users 
-                SET request_count = request_count + 1, last_request = CURRENT_TIMESTAMP
+                SET request_count = request_count + ?, last_request = ?
                 WHERE user_id = ?
-            ''', (user_id,))
+            ''', [(count, last_request, user_id) for user_id, (count, last_request) in counters.items()])
             
-            # Сохраняем запрос
-            conn.execute('''
-                INSERT INTO requests (user_id, theme, joke_text, tokens_used)
+            # Сохраняем запросы
+            conn.executemany('''
+                INSERT INTO requests (user_id, theme, joke_text, tokens_used, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            
+            # Счетчики тем - в той же транзакции
+            totals = {}
+            for day_key, count in theme_counts.items():
+                requests, tokens = totals.get(day_key[0], (0, 0))
+                totals[day_key[0]] = (requests + count, tokens + theme_tokens[day_key])
+            conn.executemany('''
+                INSERT INTO theme_stats (theme_key, request_count, tokens_used, last_request)
                 VALUES (?, ?, ?, ?)
-            ''', (user_id, theme, joke_text, tokens_used))
+                ON CONFLICT (theme_key) DO UPDATE SET
+                    request_count = request_count + excluded.request_count,
+                    tokens_used = tokens_used + excluded.tokens_used,
+                    last_request = MAX(last_request, excluded.last_request)
+            ''', [(theme_key, count, tokens, theme_last[theme_key]) for theme_key, (count, tokens) in totals.items()])
+            conn.executemany('''
+                INSERT INTO theme_daily_stats (theme_key, day, request_count, tokens_used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (theme_key, day) DO UPDATE SET
+                    request_count = request_count + excluded.request_count,
+                    tokens_used = tokens_used + excluded.tokens_used
+            ''', [(theme_key, day, count, theme_tokens[(theme_key, day)]) for (theme_key, day), count in theme_counts.items()])
+            
+            # Токены пользователей - в строке дневной квоты, счетчик запросов в ней ведет лимитер
+            day = utc_today()
+            conn.executemany('''
+                INSERT INTO daily_quotas (user_id, day, request_count, tokens_used)
+                VALUES (?, ?, 0, ?)
+                ON CONFLICT (user_id, day) DO UPDATE SET
+                    tokens_used = tokens_used + excluded.tokens_used
+            ''', [(user_id, day, tokens) for user_id, tokens in user_tokens.items() if tokens])
             
             conn.commit()
+        
+        self.budget.charge(user_tokens, {theme_key: tokens for theme_key, (_, tokens) in totals.items()}, len(rows))
+        self.stats.users_added(added)
+        self.stats.requests_logged(counters, {day for _, day in theme_counts})
+        self.leaderboard.record(theme_counts)
     
     def get_user_stats(self, user_id):
-        """Получение статистики пользователя"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Получение статистики пользователя: (запросов, последний запрос) или None"""
+        cached = self.stats.get_user(user_id)
+        if cached is not None:
+            return cached
+        with self.engine.connection() as conn:
             cursor = conn.execute('''
                 SELECT request_count, last_request FROM users WHERE user_id = ?
             ''', (user_id,))
-            return cursor.fetchone()
+            row = cursor.fetchone()
+        if row:
+            self.stats.put_user(user_id, *row)
+        return row
     
     def get_global_stats(self):
-        """Глобальная статистика"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                SELECT 
-                    COUNT(DISTINCT user_id) as total_users,
-                    SUM(request_count) as total_requests
-                FROM users
-            ''')
-            return cursor.fetchone()
+        """Глобальная статистика: (пользователей, запросов, активных дней)"""
+        cached = self.stats.global_stats()
+        if cached is not None:
+            return cached
+        with self.engine.connection() as conn:
+            total_users, total_requests = conn.execute('''
+                SELECT COUNT(*), SUM(request_count) FROM users
+            ''').fetchone()
+            # Дни с запросами - по индексу idx_theme_daily_day, без обхода журнала
+            days = [row[0] for row in conn.execute('SELECT DISTINCT day FROM theme_daily_stats')]
+        self.stats.load_global(total_users, total_requests, days)
+        return self.stats.global_stats()
     
     def can_make_request(self, user_id):
-        """Проверка лимитов - всегда True для упрощения"""
-        return True
+        """Проверка лимитов (списывает запрос при успехе)"""
+        allowed, _, _ = self.check_limits(user_id)
+        return allowed
+    
+    def check_limits(self, user_id):
+        """
+        Проверка лимитов в памяти: (allowed, reason, retry_after).
+        Исчерпанный общий бюджет токенов не списывает запрос из квоты пользователя.
+        """
+        if not self.budget.allows():
+            return False, "budget", 0.0
+        return self.limiter.acquire(user_id)
+    
+    def refund_limits(self, user_id):
+        """Возврат запроса в квоту: генерация не удалась или ее отклонил режим деградации"""
+        self.limiter.refund(user_id)
+    
+    def load_limits(self):
+        """Загрузка сегодняшних квот в лимитер и дневных токенов в учет бюджета"""
+        today = utc_today()
+        with self.engine.connection() as conn:
+            quotas = conn.execute('''
+                SELECT user_id, request_count, tokens_used FROM daily_quotas WHERE day = ?
+            ''', (today,)).fetchall()
+            themes = conn.execute('''
+                SELECT theme_key, request_count, tokens_used FROM theme_daily_stats WHERE day = ?
+            ''', (today,)).fetchall()
+            usage = conn.execute('''
+                SELECT tokens_used, generations FROM token_usage WHERE day = ?
+            ''', (today,)).fetchone() or (0, 0)
+        self.limiter.load(today, [(user_id, count) for user_id, count, _ in quotas])
+        self.budget.load(
+            today, *usage,
+            users={user_id: tokens for user_id, _, tokens in quotas if tokens},
+            themes={theme_key: tokens for theme_key, _, tokens in themes},
+            jokes=sum(count for _, count, _ in themes)
+        )
+    
+    def sync_limits(self):
+        """Сохранение измененных квот в базу и сведение общего расхода токенов"""
+        rows = self.limiter.pop_dirty()
+        usage = self.budget.pop_pending()
+        
+        with self.engine.connection() as conn:
+            try:
+                # Токены в той же строке пишет журнал запросов - их не затираем
+                conn.executemany('''
+                    INSERT INTO daily_quotas (user_id, day, request_count)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (user_id, day) DO UPDATE SET request_count = excluded.request_count
+                ''', rows)
+                conn.executemany('''
+                    INSERT INTO token_usage (day, tokens_used, generations)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (day) DO UPDATE SET
+                        tokens_used = tokens_used + excluded.tokens_used,
+                        generations = generations + excluded.generations
+                ''', usage)
+                conn.commit()
+            except Exception:
+                # Вернем несохраненное, чтобы записать при следующей синхронизации
+                conn.rollback()
+                self.limiter.restore(rows)
+                self.budget.restore(usage)
+                raise
+            # Расход других процессов виден только через базу
+            day = self.budget.day
+            total = conn.execute('''
+                SELECT tokens_used, generations FROM token_usage WHERE day = ?
+            ''', (day,)).fetchone()
+        if total:
+            self.budget.refresh(day, *total)
+        return len(rows)
+    
+    def load_leaderboard(self):
+        """Загрузка рейтинга тем в память"""
+        week_start = (date.fromisoformat(utc_today()) - timedelta(days=WEEK_DAYS - 1)).isoformat()
+        with self.engine.connection() as conn:
+            totals = conn.execute('SELECT theme_key, request_count FROM theme_stats').fetchall()
+            daily = conn.execute('''
+                SELECT theme_key, day, request_count FROM theme_daily_stats WHERE day >= ?
+            ''', (week_start,)).fetchall()
+        self.leaderboard.load(totals, daily)
+    
+    # Асинхронные обертки: запросы выполняются в потоке хранилища,
+    # не блокируя обработку обновлений
+    
+    async def add_user_async(self, user_id, username, first_name, last_name):
+        return await self.engine.run(self.add_user, user_id, username, first_name, last_name)
+    
+    async def log_requests_async(self, rows):
+        return await self.engine.run(self.log_requests, rows)
+    
+    async def get_user_stats_async(self, user_id):
+        return await self.engine.run(self.get_user_stats, user_id)
+    
+    async def get_global_stats_async(self):
+        return await self.engine.run(self.get_global_stats)
+    
+    async def sync_limits_async(self):
+        return await self.engine.run(self.sync_limits)
+    
+    async def get_top_themes_async(self, limit=10, period="all"):
+        # В режиме шардов рейтинг читается из общего хранилища счетчиков (SQLite или Redis)
+        return await self.engine.run(self.get_top_themes, limit, period)
+    
+    def close(self):
+        """Закрытие хранилища"""
+        self.engine.close()
+    
+    def get_top_themes(self, limit=10, period="all"):
+        """Получение топ тем за период (today / week / all) из рейтинга в памяти"""
+        return self.leaderboard.top(period, limit)
 
-    def get_top_themes(self, limit=10):
-        """Получение топ тем"""
-        return [
-            ("программисты", 156),
-            ("студенты", 142),
-            ("животные", 128),
-            ("семья", 115),
-            ("работа", 98)
-        ]
+# Общая база процесса: открывается и проверяет схему при первом обращении
+db = lazy(Database)
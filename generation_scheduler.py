@@ -0,0 +1,203 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict
+from config import Config
+from metrics import registry
+
+generation_queue_wait = registry.histogram(
+    "anekdotych_generation_queue_wait_seconds", "Ожидание места для генерации в очереди"
+)
+
+class _Ticket:
+    """Заявка на генерацию"""
+    __slots__ = ('user_id', 'weight', 'priority', 'future', 'queued_at')
+    
+    def __init__(self, user_id, weight, priority, future, queued_at):
+        self.user_id = user_id
+        self.weight = weight
+        self.priority = priority
+        self.future = future
+        self.queued_at = queued_at
+
+class _Class:
+    """Заявки одного класса: круг пользователей, у каждого своя очередь"""
+    __slots__ = ('weight', 'deficit', 'flows')
+    
+    def __init__(self, weight, deficit=0.0, flows=None):
+        self.weight = weight
+        self.deficit = deficit
+        # user_id -> очередь заявок, в порядке обхода
+        self.flows: "OrderedDict[int, deque]" = flows if flows is not None else OrderedDict()
+    
+    def copy(self) -> "_Class":
+        return _Class(self.weight, self.deficit, OrderedDict((user_id, deque(tickets)) for user_id, tickets in self.flows.items()))
+    
+    def pop(self) -> _Ticket:
+        """Первая заявка следующего пользователя круга; пользователь уходит в конец круга"""
+        user_id, tickets = next(iter(self.flows.items()))
+        ticket = tickets.popleft()
+        self.deficit -= 1
+        if tickets:
+            self.flows.move_to_end(user_id)
+        else:
+            del self.flows[user_id]
+            if not self.flows:
+                # Пустой класс дефицит не копит
+                self.deficit = 0.0
+        return ticket
+
+def _next_class(classes):
+    """
+    Класс, которому достается следующее место (deficit round robin по классам):
+    за раунд класс получает столько мест, каков его вес, и внутри раунда
+    старшие классы обслуживаются первыми.
+    """
+    waiting = [cls for cls in classes if cls.flows]
+    if not waiting:
+        return None
+    for cls in waiting:
+        if cls.deficit >= 1:
+            return cls
+    # Раунд исчерпан - новый раунд для классов с заявками
+    for cls in waiting:
+        cls.deficit = max(cls.deficit, 0.0) + cls.weight
+    return waiting[0]
+
+class GenerationScheduler:
+    """
+    Допуск к генерации: не больше limit генераций одновременно.
+    Заявки делятся на классы (admin, command, text) со своими весами: за раунд
+    класс получает столько мест, каков его вес, старшие классы - первыми.
+    Поэтому администраторы и команды опережают свободный текст других пользователей,
+    но не вытесняют его совсем. Внутри класса места выдаются по кругу пользователей,
+    и один пользователь с десятком сообщений не занимает всю емкость.
+    """
+    
+    def __init__(self, limit=None, weights=None, clock=time.monotonic):
+        self.limit = limit or Config.GENERATION_CONCURRENCY
+        self.weights = weights or Config.GENERATION_WEIGHTS
+        self.clock = clock
+        self.active = 0
+        # Классы от старшего к младшему
+        self._classes: Dict[str, _Class] = {
+            priority: _Class(weight)
+            for priority, weight in sorted(self.weights.items(), key=lambda item: item[1], reverse=True)
+        }
+        
+        # Метрики
+        self.granted = 0
+        self.queued = 0
+        self.cancelled = 0
+    
+    @property
+    def depth(self) -> int:
+        """Заявки, ожидающие места"""
+        return sum(len(tickets) for cls in self._classes.values() for tickets in cls.flows.values())
+    
+    def priority_for(self, user_id: int, command: bool) -> str:
+        """Класс заявки: admin, command (/joke, /random) или text (свободный текст)"""
+        if user_id in Config.ADMIN_IDS:
+            return "admin"
+        return "command" if command else "text"
+    
+    @asynccontextmanager
+    async def slot(self, user_id: int, priority: str = "text", on_position=None):
+        """
+        Место для одной генерации. Если мест нет, ждет своей очереди и сообщает
+        on_position(позиция) при постановке и затем раз в GENERATION_FEEDBACK_INTERVAL секунд.
+        """
+        await self._acquire(user_id, priority, on_position)
+        try:
+            yield
+        finally:
+            self._release()
+    
+    def position(self, ticket: _Ticket) -> int:
+        """Сколько мест будет выдано до заявки (1 - следующая)"""
+        # Проигрываем выдачу на копии очередей, не меняя настоящие
+        classes = [cls.copy() for cls in self._classes.values()]
+        position = 0
+        while True:
+            cls = _next_class(classes)
+            if cls is None:
+                return position
+            position += 1
+            if cls.pop() is ticket:
+                return position
+    
+    def stats(self) -> dict:
+        """Занятые места и очередь"""
+        return {
+            "active": self.active,
+            "limit": self.limit,
+            "depth": self.depth,
+            "users": len({user_id for cls in self._classes.values() for user_id in cls.flows}),
+            "granted": self.granted,
+            "queued": self.queued,
+            "cancelled": self.cancelled,
+        }
+    
+    async def _acquire(self, user_id, priority, on_position):
+        future = asyncio.get_running_loop().create_future()
+        if priority not in self._classes:
+            priority = "text"
+        ticket = _Ticket(user_id, self.weights.get(priority, 1), priority, future, self.clock())
+        self._classes[priority].flows.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+        
+        if not future.done():
+            self.queued += 1
+            try:
+                while not future.done():
+                    if on_position:
+                        await on_position(self.position(ticket))
+                    await asyncio.wait({future}, timeout=Config.GENERATION_FEEDBACK_INTERVAL)
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    # Место уже выдано - возвращаем его
+                    self._release()
+                else:
+                    self._withdraw(ticket)
+                raise
+        generation_queue_wait.observe(self.clock() - ticket.queued_at, priority=priority)
+    
+    def _withdraw(self, ticket):
+        """Заявка отменена в очереди"""
+        self.cancelled += 1
+        ticket.future.cancel()
+        cls = self._classes[ticket.priority]
+        tickets = cls.flows.get(ticket.user_id)
+        if tickets is None:
+            return
+        try:
+            tickets.remove(ticket)
+        except ValueError:
+            return
+        if not tickets:
+            del cls.flows[ticket.user_id]
+            if not cls.flows:
+                cls.deficit = 0.0
+    
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+    
+    def _dispatch(self):
+        """Выдает свободные места по весам классов и по кругу пользователей внутри класса"""
+        classes = list(self._classes.values())
+        while self.active < self.limit:
+            cls = _next_class(classes)
+            if cls is None:
+                return
+            ticket = cls.pop()
+            self.active += 1
+            self.granted += 1
+            ticket.future.set_result(None)
+
+# Общий планировщик генераций процесса
+generation_scheduler = GenerationScheduler()
+
+registry.gauge("anekdotych_generation_queue_depth", "Заявки на генерацию в очереди", lambda: generation_scheduler.depth)
+registry.gauge("anekdotych_generation_active", "Генерации в работе", lambda: generation_scheduler.active)
@@ -1,17 +1,27 @@
 import logging
+import os
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes
-from database import Database
+from database import db
+from joke_pool import joke_pool
+from joke_store import joke_store
+from completion_tuner import completion_tuner
+from token_budget import token_budget
+from handlers.messages import request_log, joke_coalescer, joke_router
 from config import Config
+from metrics import summary_lines
+from telegram_sender import telegram_sender
+from generation_scheduler import generation_scheduler
+from slo_controller import slo_controller
+from profiler import profiler, profiled
 
-db = Database()
-
+@profiled()
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user = update.effective_user
     
     # Регистрируем пользователя
-    db.add_user(
+    await db.add_user_async(
         user.id, 
         user.username, 
         user.first_name, 
@@ -47,6 +57,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(welcome_text, reply_markup=reply_markup)
 
+@profiled()
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
     help_text = f"""
@@ -57,7 +68,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /joke [тема] - Анекдот на тему
 /random - Случайный анекдот
 /stats - Ваша статистика
-/top - Популярные темы
+/top [сегодня|неделя] - Популярные темы
+/share - Получать общий анекдот при совпадающих темах (быстрее)
 
 📊 Лимиты:
 • {Config.MAX_REQUESTS_PER_USER} запросов в день на пользователя
@@ -70,13 +82,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /joke животные
 
 🤖 Или просто напишите тему в чат!
+💬 В любом чате: @{Config.BOT_USERNAME} тема
     """
     await update.message.reply_text(help_text)
 
+@profiled()
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статистика пользователя"""
     user = update.effective_user
-    stats = db.get_user_stats(user.id)
+    stats = await db.get_user_stats_async(user.id)
     
     if stats:
         request_count, last_request = stats
@@ -88,6 +102,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🔄 Всего запросов: {request_count}
 ⏰ Последний запрос: {last_request_str}
 📅 Лимит: {Config.MAX_REQUESTS_PER_USER} в день
+🪙 Токенов сегодня: {token_budget.user_tokens(user.id)}
 
 🎭 Продолжайте наслаждаться анекдотами!
         """
@@ -96,13 +111,28 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(stats_text)
 
+# Периоды для /top: аргумент команды -> (период рейтинга, подпись)
+TOP_PERIODS = {
+    "today": ("today", "за сегодня"),
+    "сегодня": ("today", "за сегодня"),
+    "week": ("week", "за неделю"),
+    "неделя": ("week", "за неделю"),
+    "all": ("all", "за все время"),
+    "все": ("all", "за все время"),
+}
+
+@profiled()
 async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Топ популярных тем"""
+    """Топ популярных тем: /top [сегодня|неделя|все]"""
+    period_arg = context.args[0].lower() if context.args else "all"
+    period, period_title = TOP_PERIODS.get(period_arg, TOP_PERIODS["all"])
+    
     try:
-        top_themes_data = db.get_top_themes(limit=10)
+        # Рейтинг в памяти или, в режиме шардов, в общем хранилище - читаем в потоке хранилища
+        top_themes_data = await db.get_top_themes_async(limit=10, period=period)
         
         if top_themes_data:
-            top_text = "🏆 Топ популярных тем:\n\n"
+            top_text = f"🏆 Топ популярных тем {period_title}:\n\n"
             for i, (theme, count) in enumerate(top_themes_data, 1):
                 emoji = "🎯" if i == 1 else "🔸" if i <= 3 else "•"
                 top_text += f"{emoji} {theme} - {count} запросов\n"
@@ -111,19 +141,60 @@ async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
     except Exception as e:
         logging.error(f"Error in top command: {e}")
-        top_text = "🏆 Топ популярных тем:\n\n🎯 программисты - 156\n🔸 студенты - 142\n🔸 животные - 128\n• семья - 115\n• работа - 98"
+        top_text = "🏆 Не удалось получить топ тем. Попробуйте позже."
     
     await update.message.reply_text(top_text)
 
+@profiled()
+async def share_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Согласие получать тот же анекдот, что и другие пользователи с такой же темой"""
+    if context.args:
+        enabled = context.args[0].lower() in ("on", "да", "вкл")
+    else:
+        enabled = not context.user_data.get('share_jokes', False)
+    context.user_data['share_jokes'] = enabled
+    
+    if enabled:
+        text = "🔗 Теперь при совпадающих темах вы можете получить тот же анекдот, что и другие, или уже рассказанный им — зато быстрее!"
+    else:
+        text = "🎭 Теперь вы всегда получаете собственный анекдот."
+    await update.message.reply_text(text)
+
+@profiled()
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Админ-панель"""
     user = update.effective_user
     if user.id not in Config.ADMIN_IDS:
         await update.message.reply_text("❌ Эта команда только для администраторов")
         return
+    if context.args and context.args[0].lower() == "profile":
+        await admin_profile(update, context)
+        return
     
     try:
-        stats = db.get_global_stats()
+        stats = await db.get_global_stats_async()
+        pool_stats = joke_pool.stats()
+        store_stats = joke_store.stats()
+        log_stats = request_log.stats()
+        coalesce_stats = joke_coalescer.stats()
+        router_stats = joke_router.stats()
+        send_stats = telegram_sender.stats()
+        queue_stats = generation_scheduler.stats()
+        slo_stats = slo_controller.stats()
+        budget_stats = token_budget.stats()
+        tuner_stats = completion_tuner.stats()
+        if budget_stats['budget']:
+            budget_text = (f"{budget_stats['spent']} из {budget_stats['budget']} "
+                           f"(запас {budget_stats['headroom']}, {budget_stats['headroom'] / budget_stats['budget']:.0%})")
+        else:
+            budget_text = f"{budget_stats['spent']} (бюджет не ограничен)"
+        costly_text = ", ".join(f"{theme} {tokens}" for theme, tokens in token_budget.top_themes()) or "нет"
+        p95_text = f"{slo_stats['p95']:.1f} с" if slo_stats['p95'] is not None else "нет данных"
+        breakers_text = ", ".join(
+            f"{model} {'🟢' if state == 'closed' else '🟡' if state == 'half_open' else '🔴'}"
+            for model, state in router_stats['breakers'].items()
+        )
+        metrics_text = "\n".join(summary_lines()) or "⏱ Пока нет замеров"
         admin_text = f"""
 👑 Админ-панель:
 
@@ -131,10 +202,62 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🔄 Всего запросов: {stats[1] or 0}
 📅 Активных дней: {stats[2] or 0}
 
+🧺 Пул анекдотов: {pool_stats['jokes']} шт. по {pool_stats['themes']} темам
+🎯 Попаданий: {pool_stats['hits']}, промахов: {pool_stats['misses']} ({pool_stats['hit_rate']:.0%})
+♻️ Повторно выдано: {store_stats['hits']}, промахов: {store_stats['misses']} ({store_stats['hit_rate']:.0%})
+👁 Фильтры просмотренного: {store_stats['users']} польз. по {store_stats['filter_bytes']} Б, ложных срабатываний ~{store_stats['fpr_avg']:.2%} (макс. {store_stats['fpr_max']:.2%})
+
+🔗 Объединено запросов: {coalesce_stats['coalesced']} в {coalesce_stats['flights']} генерациях
+
+🪙 Токены сегодня: {budget_text}, {budget_stats['generations']} генераций по {budget_stats['per_generation']:.0f}
+🎭 Показано анекдотов: {budget_stats['jokes']} по {budget_stats['per_joke']:.0f} токенов, дороже всего: {costly_text}
+✂️ max_tokens: {tuner_stats['max_tokens']} (p50 ответа {tuner_stats['p50'] or '-'}), обрезано {tuner_stats['truncated']} ({tuner_stats['truncated_rate']:.1%})
+
+🩺 Режим: {slo_stats['title']} (p95 {p95_text}, ошибок {slo_stats['error_rate']:.0%}, замеров {slo_stats['samples']})
+🤖 Модели: {breakers_text}
+🛡 Запасных запросов: {router_stats['hedges']} (выиграли {router_stats['hedge_wins']}), фолбэков: {router_stats['fallbacks']}
+
+🚦 Генерации: {queue_stats['active']}/{queue_stats['limit']}, в очереди {queue_stats['depth']} от {queue_stats['users']} польз. (ждали {queue_stats['queued']} из {queue_stats['granted']})
+
+📤 Очередь отправки: {send_stats['depth']} в {send_stats['chats']} чатах, склеено {send_stats['merged']}, RetryAfter: {send_stats['throttled']}, повторов: {send_stats['retried']}
+
+💾 Очередь записи: {log_stats['depth']}, сброс {log_stats['last_flush_ms']:.1f} мс (макс. {log_stats['max_flush_ms']:.1f} мс), отброшено {log_stats['dropped_rows']}
+
+{metrics_text}
+
 ⚙️ Бот работает стабильно!
         """
     except Exception as e:
         logging.error(f"Error in admin command: {e}")
         admin_text = "👑 Админ-панель:\n\n❌ Ошибка получения статистики"
     
-    await update.message.reply_text(admin_text)
\ No newline at end of file
+    await update.message.reply_text(admin_text)
+
+async def admin_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/admin profile [секунды]: замер идет в фоне, файлы приходят документами"""
+    try:
+        seconds = float(context.args[1]) if len(context.args) > 1 else Config.PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= Config.PROFILE_MAX_SECONDS:
+        await update.message.reply_text(
+            f"❌ Укажите длительность от 1 до {Config.PROFILE_MAX_SECONDS} секунд.\nПример: /admin profile 30"
+        )
+        return
+    if profiler.active:
+        await update.message.reply_text("⏳ Профилирование уже идет, дождитесь результатов")
+        return
+    
+    await update.message.reply_text(f"🔬 Профилирую {seconds:.0f} с, файлы пришлю по готовности")
+    context.application.create_task(send_profile(context.bot, update.effective_chat.id, seconds))
+
+async def send_profile(bot, chat_id: int, seconds: float):
+    """Замер и отправка файлов с результатами администратору"""
+    try:
+        paths = await profiler.capture(seconds)
+        for path in paths:
+            with open(path, 'rb') as f:
+                await bot.send_document(chat_id, document=f, filename=os.path.basename(path))
+    except Exception as e:
+        logging.error(f"❌ Profiling failed: {e}")
+        await telegram_sender.send_message(bot, chat_id, f"❌ Профилирование не удалось: {e}")
@@ -0,0 +1,124 @@
+import logging
+from telegram import (
+    Update, InlineQueryResultArticle, InputTextMessageContent,
+    InlineKeyboardMarkup, InlineKeyboardButton
+)
+from telegram.ext import ContextTypes
+from config import Config
+from database import db
+from generation_scheduler import generation_scheduler
+from handlers.messages import joke_router, request_log
+from inline_index import inline_index
+from joke_store import joke_store
+from metrics import stage_seconds
+from profiler import profiled
+from slo_controller import slo_controller
+from telegram_sender import telegram_sender
+from utils.helpers import rate_limit_check
+from utils.theme_classifier import theme_classifier
+
+# id результата "новый анекдот"; выбор остальных результатов бот не обрабатывает
+GENERATE_RESULT_ID = "new"
+
+def generate_article(theme: str, emoji: str) -> InlineQueryResultArticle:
+    """
+    Результат, который отправляет заглушку и запускает живую генерацию.
+    Клавиатура обязательна: без нее Telegram не присылает inline_message_id для правки.
+    """
+    return InlineQueryResultArticle(
+        id=GENERATE_RESULT_ID,
+        title=f"🎭 Новый анекдот: {theme}",
+        description="Сочинить свежий анекдот на эту тему",
+        input_message_content=InputTextMessageContent(f"{emoji} Генерирую анекдот на тему '{theme}'..."),
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton("🤖 Анекдотыч", url=f"https://t.me/{Config.BOT_USERNAME}")
+        ]]),
+    )
+
+@profiled()
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Инлайн-запрос: готовые анекдоты из индекса, без обращений к базе и API"""
+    query = update.inline_query
+    theme = query.query.strip()
+    
+    with stage_seconds.time(stage="inline"):
+        results = inline_index.search(theme)
+        theme_info = theme_classifier.classify(theme) if theme else None
+        if theme_info and theme_info.valid:
+            results = [generate_article(theme, theme_info.emoji)] + results[:Config.INLINE_MAX_RESULTS - 1]
+    
+    try:
+        await query.answer(results, cache_time=Config.INLINE_CACHE_TIME)
+    except Exception as e:
+        # Запрос устарел, пока отвечали, - пользователь уже набрал другой
+        logging.debug(f"Inline answer skipped: {e}")
+
+@profiled()
+async def handle_chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбран "новый анекдот": генерируем и подставляем текст в отправленное сообщение"""
+    chosen = update.chosen_inline_result
+    if chosen.result_id != GENERATE_RESULT_ID or not chosen.inline_message_id:
+        return
+    
+    user = chosen.from_user
+    theme = chosen.query.strip()
+    theme_info = theme_classifier.classify(theme)
+    if not theme_info.valid:
+        await edit_inline(context, chosen.inline_message_id, f"❌ {theme_info.error}")
+        return
+    can_request, limit_message = rate_limit_check(user.id, db)
+    if not can_request:
+        await edit_inline(context, chosen.inline_message_id, limit_message)
+        return
+    
+    # Запрос списан из квоты заранее: итог - выданный анекдот или возврат в квоту
+    settled = False
+    try:
+        stored = None
+        if slo_controller.serve_stored(theme_info.key):
+            stored = await joke_store.pick_any(theme)
+        if stored:
+            joke, tokens_used = stored
+        elif not slo_controller.allow_live():
+            db.refund_limits(user.id)
+            settled = True
+            await edit_inline(context, chosen.inline_message_id, "⚠️ Генератор анекдотов сейчас перегружен. Попробуйте позже!")
+            return
+        else:
+            priority = generation_scheduler.priority_for(user.id, command=True)
+            with stage_seconds.time(stage="generation"):
+                async with generation_scheduler.slot(user.id, priority):
+                    joke, tokens_used = await joke_router.generate_joke_async(theme)
+        
+        if stored:
+            request_log.enqueue(user.id, theme, joke, tokens_used)
+            settled = True
+        elif not joke.startswith(('❌', '⚠️')):
+            request_log.enqueue(user.id, theme, joke, tokens_used)
+            settled = True
+            joke_store.store(theme, joke, tokens_used)
+        else:
+            db.refund_limits(user.id)
+            settled = True
+        delivered = await edit_inline(context, chosen.inline_message_id, joke[:Config.MAX_MESSAGE_LENGTH])
+        if delivered and not stored and not joke.startswith(('❌', '⚠️')):
+            # Увиденным анекдот становится только после доставки
+            try:
+                await joke_store.mark_seen(user.id, joke)
+            except Exception as e:
+                logging.warning(f"Joke store update failed: {e}")
+    except Exception as e:
+        logging.error(f"Error in handle_chosen_inline_result: {e}")
+        await edit_inline(context, chosen.inline_message_id, "😞 Произошла непредвиденная ошибка. Попробуйте позже.")
+    finally:
+        if not settled:
+            db.refund_limits(user.id)
+
+async def edit_inline(context: ContextTypes.DEFAULT_TYPE, inline_message_id: str, text: str) -> bool:
+    """Правка инлайн-сообщения; False - не удалось"""
+    try:
+        await telegram_sender.edit_inline_message(context.bot, inline_message_id, text)
+        return True
+    except Exception as e:
+        logging.error(f"Failed to edit inline message: {e}")
+        return False
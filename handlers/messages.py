@@ -1,46 +1,193 @@
 import logging
-from telegram import Update
+import time
+from telegram import Chat, Update, Message
 from telegram.ext import ContextTypes
 from openrouter_client import OpenRouterClient
-from database import Database
+from model_router import ModelRouter
+from joke_pool import joke_pool
+from joke_store import joke_store
+from request_log import RequestLogWriter
+from coalescer import GenerationCoalescer
+from generation_scheduler import generation_scheduler
+from slo_controller import slo_controller
+from database import db
 from config import Config
-from utils.helpers import split_message
+from metrics import registry, stage_seconds
+from telegram_sender import telegram_sender
+from profiler import profiled
+from services import lazy
+from utils.helpers import split_message, rate_limit_check
+from utils.theme_classifier import theme_classifier
 
-db = Database()
-joke_client = OpenRouterClient()
+# Клиент OpenRouter (пул соединений), маршрутизатор моделей, журнал запросов и объединение
+# генераций создаются при первом обращении, а не при импорте обработчиков
+joke_client = lazy(OpenRouterClient, "joke_client")
+joke_router = lazy(lambda: ModelRouter(joke_client.resolve()), "joke_router")
+request_log = lazy(lambda: RequestLogWriter(db), "request_log")
+joke_coalescer = lazy(lambda: GenerationCoalescer(joke_router.resolve().generate_jokes_async), "joke_coalescer")
 
-async def handle_joke_request(update: Update, context: ContextTypes.DEFAULT_TYPE, theme: str):
-    """Обработка запроса на генерацию анекдота"""
+registry.gauge("anekdotych_request_log_depth", "Строки журнала, ожидающие записи", lambda: request_log.depth)
+
+class StreamingReply:
+    """Прогрессивная правка сообщения-заглушки с учетом лимитов Telegram на редактирование"""
+    
+    def __init__(self, message: Message, interval: float = None):
+        self.message = message
+        self.interval = interval or Config.STREAM_EDIT_INTERVAL
+        self.next_edit_at = 0.0
+        self.placeholder = message.text
+        self.last_text = message.text
+    
+    async def update(self, text: str):
+        """Показывает промежуточный текст не чаще раза в interval секунд"""
+        now = time.monotonic()
+        if now < self.next_edit_at or len(text) < Config.STREAM_MIN_CHARS:
+            return
+        
+        self.next_edit_at = now + self.interval
+        # Промежуточная правка не обязательна - пропускаем, если лимиты чата или бота на исходе
+        if not telegram_sender.try_acquire(self.message.chat_id):
+            return
+        preview = text[:Config.MAX_MESSAGE_LENGTH - 2] + " ▌"
+        try:
+            await self._edit(preview)
+        except Exception as e:
+            # Итог все равно будет отправлен
+            logging.debug(f"Streaming edit skipped: {e}")
+    
+    async def queued(self, position: int):
+        """Место в очереди генераций под текстом заглушки"""
+        if not telegram_sender.try_acquire(self.message.chat_id):
+            return
+        try:
+            await self._edit(f"{self.placeholder}\n⏳ Место в очереди: {position}")
+        except Exception as e:
+            logging.debug(f"Queue position edit skipped: {e}")
+    
+    async def finish(self, text: str):
+        """Финальный текст в том же сообщении"""
+        await edit_message_with_retry(self.message, text)
+        self.last_text = text
+    
+    async def _edit(self, text: str):
+        if text != self.last_text:
+            await self.message.edit_text(text)
+            self.last_text = text
+
+@profiled()
+async def handle_joke_request(update: Update, context: ContextTypes.DEFAULT_TYPE, theme: str, command: bool = True):
+    """
+    Обработка запроса на генерацию анекдота.
+    command=False - тема пришла свободным текстом, такие запросы уступают командам в очереди генераций
+    """
     user = update.effective_user
     
-    # Проверяем лимиты
-    if not db.can_make_request(user.id):
-        await update.message.reply_text(
-            f"⚠️ Вы превысили дневной лимит ({Config.MAX_REQUESTS_PER_USER} запросов). "
-            "Попробуйте завтра!"
-        )
+    # Некорректные и запрещенные темы отсекаем до лимитов и платного запроса к API
+    with stage_seconds.time(stage="validation"):
+        theme_info = theme_classifier.classify(theme)
+        if theme_info.valid:
+            can_request, limit_message = rate_limit_check(user.id, db)
+    if not theme_info.valid:
+        prefix = "🚫" if theme_info.forbidden else "❌"
+        await update_message_with_retry(update, f"{prefix} {theme_info.error}. Попробуйте другую тему!")
+        return
+    if not can_request:
+        await update_message_with_retry(update, limit_message)
         return
     
+    # Запрос списан из квоты заранее: итог - выданный анекдот или возврат в квоту
+    settled = False
     try:
-        await update.message.reply_text(f"🎭 Генерирую анекдот на тему '{theme}'...")
-        
-        joke, tokens_used = joke_client.generate_joke(theme)
+        # Горячие темы отдаем из пула, живая генерация - только для холодных
+        pooled = joke_pool.take(theme)
+        reused = False
+        # Анекдоты, показанные другим, - только тем, кто согласился на общие через /share
+        share = context.user_data.get('share_jokes', False)
+        if not pooled and Config.JOKE_STORE_REUSE and share:
+            # Затем - сохраненный анекдот, которого пользователь еще не видел
+            with stage_seconds.time(stage="joke_store"):
+                try:
+                    pooled = await joke_store.pick(user.id, theme)
+                    reused = pooled is not None
+                except Exception as e:
+                    logging.warning(f"Joke store lookup failed: {e}")
+        if not pooled and slo_controller.serve_stored(theme_info.key):
+            # OpenRouter не укладывается в SLO - повтор из хранилища лучше ожидания
+            with stage_seconds.time(stage="joke_store"):
+                pooled = await joke_store.pick_any(theme)
+                reused = pooled is not None
+        if not pooled and not slo_controller.allow_live():
+            db.refund_limits(user.id)
+            settled = True
+            await update_message_with_retry(
+                update, "⚠️ Генератор анекдотов сейчас перегружен. Попробуйте /random или популярную тему чуть позже!"
+            )
+            return
+        reply = None
+        if pooled:
+            joke, tokens_used = pooled
+        else:
+            placeholder = await telegram_sender.send_message(
+                update.get_bot(), update.effective_chat.id,
+                f"🎭 Генерирую анекдот на тему '{theme}'...", mergeable=False,
+                reply_to_message_id=reply_to(update)
+            )
+            reply = StreamingReply(placeholder)
+            priority = generation_scheduler.priority_for(user.id, command)
+            with stage_seconds.time(stage="generation"):
+                # Горячие темы объединяем в одну генерацию, остальные показываем потоком
+                if joke_coalescer.should_coalesce(theme) or not Config.STREAM_JOKES:
+                    if joke_coalescer.joinable(theme, share):
+                        # Попутчику идущей генерации свое место в очереди не нужно,
+                        # пока полет не оставил его без анекдота
+                        joke, tokens_used = await joke_coalescer.generate(
+                            theme, share, lambda: generation_scheduler.slot(user.id, priority, reply.queued)
+                        )
+                    else:
+                        async with generation_scheduler.slot(user.id, priority, reply.queued):
+                            joke, tokens_used = await joke_coalescer.generate(theme, share)
+                else:
+                    async with generation_scheduler.slot(user.id, priority, reply.queued):
+                        joke, tokens_used = await joke_router.generate_joke_stream(theme, reply.update)
         
         if joke.startswith(('❌', '⚠️')):
-            await update_message_with_retry(update, joke)
+            db.refund_limits(user.id)
+            settled = True
+            if reply:
+                await reply.finish(joke)
+            else:
+                await update_message_with_retry(update, joke)
         else:
             # Логируем успешный запрос
-            db.log_request(user.id, theme, joke, tokens_used)
+            with stage_seconds.time(stage="log_request"):
+                request_log.enqueue(user.id, theme, joke, tokens_used)
+            settled = True
+            if not reused:
+                joke_store.store(theme, joke, tokens_used)
             
-            # Отправляем анекдот частями если он длинный
-            message_parts = split_message(joke, Config.MAX_MESSAGE_LENGTH)
-            for part in message_parts:
-                await update_message_with_retry(update, part)
+            # Отправляем анекдот частями если он длинный,
+            # первая часть заменяет заглушку
+            with stage_seconds.time(stage="send"):
+                message_parts = split_message(joke, Config.MAX_MESSAGE_LENGTH)
+                if reply:
+                    await reply.finish(message_parts.pop(0))
+                for part in message_parts:
+                    await update_message_with_retry(update, part)
+            
+            # Увиденным анекдот становится только после доставки
+            try:
+                await joke_store.mark_seen(user.id, joke)
+            except Exception as e:
+                logging.warning(f"Joke store update failed: {e}")
                 
     except Exception as e:
         logging.error(f"Error in handle_joke_request: {e}")
         await update_message_with_retry(update, "😞 Произошла непредвиденная ошибка. Попробуйте позже.")
+    finally:
+        if not settled:
+            db.refund_limits(user.id)
 
+@profiled()
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений"""
     user = update.effective_user
@@ -50,16 +197,21 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if len(user_message) < 2:
         return
     
-    await handle_joke_request(update, context, user_message)
+    await handle_joke_request(update, context, user_message, command=False)
 
-async def update_message_with_retry(update: Update, text: str, max_retries: int = 3):
-    """Отправка сообщения с повторными попытками"""
-    for attempt in range(max_retries):
-        try:
-            await update.message.reply_text(text)
-            return
-        except Exception as e:
-            if attempt == max_retries - 1:
-                logging.error(f"Failed to send message after {max_retries} attempts: {e}")
-                raise
-            logging.warning(f"Attempt {attempt + 1} failed, retrying...")
\ No newline at end of file
+def reply_to(update: Update):
+    """Как reply_text: в группах отвечаем на сообщение пользователя, в личке - просто пишем"""
+    message = update.effective_message
+    if message is None or update.effective_chat.type == Chat.PRIVATE:
+        return None
+    return message.message_id
+
+async def update_message_with_retry(update: Update, text: str):
+    """Отправка сообщения через очередь с лимитами и повторами"""
+    return await telegram_sender.send_message(
+        update.get_bot(), update.effective_chat.id, text, reply_to_message_id=reply_to(update)
+    )
+
+async def edit_message_with_retry(message: Message, text: str):
+    """Правка отправленного сообщения через очередь с лимитами и повторами"""
+    return await telegram_sender.edit_message(message, text)
\ No newline at end of file
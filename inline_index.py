@@ -0,0 +1,157 @@
+"""
+Индекс для инлайн-режима (@бот тема): готовые результаты по темам сохраненных анекдотов.
+Индекс строится в потоке хранилища из таблицы jokes и свежей истории requests
+и подменяется целиком, поэтому ответ на инлайн-запрос - поиск по префиксу в памяти
+без обращений к базе и API.
+"""
+
+import bisect
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+from config import Config
+from database import db
+from joke_store import joke_hash
+from services import lazy
+from utils.helpers import normalize_theme
+from utils.theme_classifier import theme_classifier
+
+class _Snapshot:
+    """Неизменяемый срез индекса"""
+    __slots__ = ('terms', 'results', 'rank', 'popular', 'built_at')
+    
+    def __init__(self, terms, results, popular, built_at):
+        # Отсортированные пары (префиксный ключ, тема): полная тема и каждое ее слово
+        self.terms: List[tuple] = terms
+        # тема -> готовые результаты
+        self.results: Dict[str, List[InlineQueryResultArticle]] = results
+        # Место темы по популярности
+        self.rank = {theme: position for position, theme in enumerate(results)}
+        # Результаты для пустого запроса
+        self.popular: List[InlineQueryResultArticle] = popular
+        self.built_at = built_at
+
+class InlineIndex:
+    """Поиск готовых анекдотов по префиксу нормализованной темы"""
+    
+    def __init__(self, database, max_themes=None, per_theme=None, max_results=None):
+        self.db = database
+        self.max_themes = max_themes or Config.INLINE_INDEX_THEMES
+        self.per_theme = per_theme or Config.INLINE_RESULTS_PER_THEME
+        self.max_results = max_results or Config.INLINE_MAX_RESULTS
+        self._snapshot = _Snapshot([], {}, [], 0.0)
+        # Собранные ответы по префиксам; сбрасываются при перестройке
+        self._answers: "OrderedDict[str, List[InlineQueryResultArticle]]" = OrderedDict()
+    
+    @property
+    def themes(self) -> int:
+        return len(self._snapshot.results)
+    
+    def search(self, query: str) -> List[InlineQueryResultArticle]:
+        """Результаты для текста инлайн-запроса: сначала точная тема, затем популярные по префиксу"""
+        prefix = normalize_theme(query)
+        answers = self._answers.get(prefix)
+        if answers is not None:
+            self._answers.move_to_end(prefix)
+            return answers
+        
+        snapshot = self._snapshot
+        if not prefix:
+            answers = snapshot.popular
+        else:
+            themes = []
+            seen = set()
+            terms = snapshot.terms
+            index = bisect.bisect_left(terms, (prefix,))
+            while index < len(terms) and terms[index][0].startswith(prefix):
+                theme = terms[index][1]
+                if theme not in seen:
+                    seen.add(theme)
+                    themes.append(theme)
+                index += 1
+            # Точное совпадение первым, остальные - по популярности
+            themes.sort(key=lambda theme: (theme != prefix, snapshot.rank[theme]))
+            answers = []
+            ids = set()
+            for theme in themes:
+                for article in snapshot.results[theme]:
+                    # Один анекдот мог попасть в несколько тем, а id в ответе должны быть уникальны
+                    if article.id not in ids and len(answers) < self.max_results:
+                        ids.add(article.id)
+                        answers.append(article)
+                if len(answers) >= self.max_results:
+                    break
+        
+        self._answers[prefix] = answers
+        if len(self._answers) > Config.INLINE_CACHED_PREFIXES:
+            self._answers.popitem(last=False)
+        return answers
+    
+    async def rebuild_async(self) -> int:
+        """Перестраивает индекс в потоке хранилища; возвращает число тем"""
+        snapshot = await self.db.engine.run(self._build)
+        self._snapshot = snapshot
+        self._answers.clear()
+        return len(snapshot.results)
+    
+    def _build(self) -> _Snapshot:
+        start = time.perf_counter()
+        with self.db.engine.connection() as conn:
+            popularity = dict(conn.execute('SELECT theme_key, request_count FROM theme_stats').fetchall())
+            stored = conn.execute('''
+                SELECT theme_key, joke_text FROM (
+                    SELECT theme_key, joke_text,
+                           ROW_NUMBER() OVER (PARTITION BY theme_key ORDER BY created_at DESC) AS position
+                    FROM jokes
+                ) WHERE position <= ?
+            ''', (self.per_theme,)).fetchall()
+            # История до появления хранилища анекдотов
+            recent = conn.execute('''
+                SELECT theme, joke_text FROM requests ORDER BY id DESC LIMIT ?
+            ''', (Config.INLINE_HISTORY_ROWS,)).fetchall()
+        
+        jokes: Dict[str, Dict[int, str]] = {}
+        for theme, text in stored + [(normalize_theme(theme), text) for theme, text in recent]:
+            if not theme or not text or text.startswith(('❌', '⚠️')):
+                continue
+            theme_jokes = jokes.setdefault(theme, {})
+            if len(theme_jokes) < self.per_theme:
+                theme_jokes.setdefault(joke_hash(text), text)
+        
+        themes = sorted(jokes, key=lambda theme: popularity.get(theme, 0), reverse=True)[:self.max_themes]
+        results = {}
+        terms = []
+        for theme in themes:
+            emoji = theme_classifier.classify(theme).emoji
+            results[theme] = [self._article(value, theme, emoji, text) for value, text in jokes[theme].items()]
+            terms.append((theme, theme))
+            for word in theme.split():
+                if word != theme:
+                    terms.append((word, theme))
+        terms.sort()
+        
+        # Пустой запрос: по одному анекдоту самых популярных тем
+        popular = []
+        for theme in themes:
+            article = results[theme][0]
+            if all(article.id != other.id for other in popular):
+                popular.append(article)
+            if len(popular) >= self.max_results:
+                break
+        
+        logging.info(f"🔎 Inline index: {len(themes)} themes in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return _Snapshot(terms, results, popular, time.time())
+    
+    @staticmethod
+    def _article(value, theme, emoji, text):
+        return InlineQueryResultArticle(
+            id=f"j{value & 0xFFFFFFFFFFFFFFFF:x}",
+            title=f"{emoji} {theme}",
+            description=text[:100],
+            input_message_content=InputTextMessageContent(text[:Config.MAX_MESSAGE_LENGTH]),
+        )
+
+# Общий индекс процесса
+inline_index = lazy(lambda: InlineIndex(db), "inline_index")
@@ -0,0 +1,151 @@
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional, Tuple
+from config import Config
+from metrics import registry
+from utils.helpers import normalize_theme
+
+class JokePool:
+    """
+    Пул заранее сгенерированных анекдотов по темам.
+    Темы вытесняются по LRU, анекдоты - по TTL и общему лимиту памяти.
+    """
+    
+    def __init__(self, per_theme=None, ttl=None, max_bytes=None, clock=time.monotonic):
+        self.per_theme = per_theme or Config.JOKE_POOL_PER_THEME
+        self.ttl = ttl or Config.JOKE_POOL_TTL
+        self.max_bytes = max_bytes or Config.JOKE_POOL_MAX_BYTES
+        self.clock = clock
+        # theme_key -> deque[(created_at, joke, tokens_used, size)]
+        self._themes = OrderedDict()
+        self._bytes = 0
+        self._count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Пополнения не запускаются параллельно
+        self.refilling = False
+    
+    def take(self, theme: str) -> Optional[Tuple[str, int]]:
+        """Достает свежий анекдот на тему или None"""
+        key = normalize_theme(theme)
+        jokes = self._themes.get(key)
+        if jokes:
+            self._themes.move_to_end(key)
+            self._expire(key, jokes)
+            if jokes:
+                _, joke, tokens_used, size = jokes.popleft()
+                self._bytes -= size
+                self._count -= 1
+                self.hits += 1
+                return joke, tokens_used
+        
+        self.misses += 1
+        return None
+    
+    def put(self, theme: str, joke: str, tokens_used: int = 0):
+        """Кладет анекдот в пул"""
+        key = normalize_theme(theme)
+        jokes = self._themes.setdefault(key, deque())
+        self._themes.move_to_end(key)
+        if len(jokes) >= self.per_theme:
+            return
+        
+        size = len(joke.encode('utf-8'))
+        jokes.append((self.clock(), joke, tokens_used, size))
+        self._bytes += size
+        self._count += 1
+        self._enforce_memory_limit()
+    
+    def deficit(self, theme: str) -> int:
+        """Сколько анекдотов не хватает до полного запаса темы"""
+        key = normalize_theme(theme)
+        jokes = self._themes.get(key)
+        if jokes:
+            self._expire(key, jokes)
+            return max(0, self.per_theme - len(jokes))
+        return self.per_theme
+    
+    def stocked(self, themes) -> List[str]:
+        """Темы из списка, по которым в пуле есть анекдоты"""
+        return [theme for theme in themes if self._themes.get(normalize_theme(theme))]
+    
+    def random_theme(self, themes) -> str:
+        """Случайная тема, по возможности из тех, что есть в пуле"""
+        return random.choice(self.stocked(themes) or themes)
+    
+    async def refill(self, client, themes, limit=None, per_theme=None):
+        """
+        Догенерация анекдотов для тем с неполным запасом пакетными запросами.
+        per_theme ограничивает, сколько анекдотов на одну тему просить за раз.
+        """
+        if self.refilling:
+            return 0
+        limit = limit or Config.JOKE_POOL_REFILL_BATCH
+        wanted = []
+        for theme in themes:
+            wanted.extend([theme] * min(self.deficit(theme), per_theme or self.per_theme))
+            if len(wanted) >= limit:
+                break
+        wanted = wanted[:limit]
+        if not wanted:
+            return 0
+        
+        self.refilling = True
+        try:
+            results = await client.generate_batch_async(wanted)
+        except Exception as e:
+            logging.warning(f"Joke pool refill failed: {e}")
+            return 0
+        finally:
+            self.refilling = False
+        
+        added = 0
+        for theme, result in zip(wanted, results):
+            if result is None:
+                continue
+            joke, tokens_used = result
+            self.put(theme, joke, tokens_used)
+            added += 1
+        return added
+    
+    def stats(self) -> dict:
+        """Статистика пула"""
+        total = self.hits + self.misses
+        return {
+            "themes": len(self._themes),
+            "jokes": self._count,
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evicted": self.evicted,
+        }
+    
+    def _expire(self, key, jokes):
+        """Удаляет устаревшие анекдоты темы"""
+        deadline = self.clock() - self.ttl
+        while jokes and jokes[0][0] < deadline:
+            _, _, _, size = jokes.popleft()
+            self._bytes -= size
+            self._count -= 1
+            self.evicted += 1
+    
+    def _enforce_memory_limit(self):
+        """Вытесняет самые давно используемые темы при превышении лимита памяти"""
+        while self._bytes > self.max_bytes and self._themes:
+            key, jokes = next(iter(self._themes.items()))
+            if not jokes:
+                del self._themes[key]
+                continue
+            _, _, _, size = jokes.popleft()
+            self._bytes -= size
+            self._count -= 1
+            self.evicted += 1
+
+# Общий пул процесса
+joke_pool = JokePool()
+
+registry.gauge("anekdotych_joke_pool_size", "Анекдотов в пуле", lambda: joke_pool.stats()["jokes"])
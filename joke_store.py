@@ -0,0 +1,332 @@
+"""
+Хранилище анекдотов с адресацией по содержимому и фильтры "уже видел" по пользователям.
+
+Каждый показанный анекдот сохраняется в таблицу jokes под 64-битным хешем нормализованного
+текста, поэтому одинаковые анекдоты хранятся один раз. Для каждого пользователя ведется
+фильтр Блума из хешей показанных ему анекдотов; он хранится в users.seen_filter.
+Ложное срабатывание фильтра приводит только к пропуску непоказанного анекдота,
+повторов пользователь не увидит. Чтобы фильтр давнего пользователя не заполнился
+до состояния "видел все", он ведется двумя поколениями (SeenFilter).
+"""
+
+import hashlib
+import math
+import random
+import re
+import struct
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from database import db
+from metrics import registry
+from services import lazy
+from utils.helpers import normalize_theme
+
+_WORDS = re.compile(r"\w+")
+# Заголовок фильтра в базе: число хеш-функций и число добавленных анекдотов
+_HEADER = struct.Struct("<BI")
+# Заголовок фильтра из двух поколений: 0 (у одного поколения первый байт - число хеш-функций)
+# и длина текущего поколения в байтах
+_GENERATIONS = struct.Struct("<BI")
+
+def joke_hash(text: str) -> int:
+    """Хеш текста без учета регистра, пунктуации и пробелов; помещается в INTEGER SQLite"""
+    normalized = " ".join(_WORDS.findall(text.lower().replace('ё', 'е')))
+    digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+class BloomFilter:
+    """Фильтр Блума по 64-битным хешам (двойное хеширование половинками хеша)"""
+    __slots__ = ('bits', 'hashes', 'count', 'data')
+    
+    def __init__(self, bits=None, hashes=None, count=0, data=None):
+        self.bits = bits or Config.SEEN_FILTER_BITS
+        self.hashes = hashes or Config.SEEN_FILTER_HASHES
+        self.count = count
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+    
+    def add(self, value: int):
+        data = self.data
+        for index in self._indexes(value):
+            data[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+    
+    def __contains__(self, value: int) -> bool:
+        data = self.data
+        return all(data[index >> 3] & (1 << (index & 7)) for index in self._indexes(value))
+    
+    @property
+    def size(self) -> int:
+        """Байт в памяти и в базе"""
+        return len(self.data) + _HEADER.size
+    
+    def false_positive_rate(self) -> float:
+        """Оценка доли ложных срабатываний при текущем заполнении"""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+    
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(self.hashes, self.count) + bytes(self.data)
+    
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "BloomFilter":
+        hashes, count = _HEADER.unpack_from(blob)
+        data = bytearray(blob[_HEADER.size:])
+        return cls(len(data) * 8, hashes, count, data)
+    
+    def _indexes(self, value):
+        value &= 0xFFFFFFFFFFFFFFFF
+        first = value & 0xFFFFFFFF
+        # Нечетный шаг обходит все позиции и не вырождается в ноль
+        step = (value >> 32) | 1
+        return [(first + i * step) % self.bits for i in range(self.hashes)]
+
+class SeenFilter:
+    """
+    Фильтр просмотренного из двух поколений. Когда оценка ложных срабатываний текущего
+    поколения достигает SEEN_FILTER_ROTATE_FPR, оно становится предыдущим, а прежнее
+    предыдущее отбрасывается. Недавно показанные анекдоты остаются отмеченными
+    еще одно поколение, самые давние могут повториться.
+    """
+    __slots__ = ('current', 'previous')
+    
+    def __init__(self, current=None, previous=None):
+        self.current = current or BloomFilter()
+        self.previous = previous
+    
+    def add(self, value: int):
+        if self.current.false_positive_rate() >= Config.SEEN_FILTER_ROTATE_FPR:
+            self.previous = self.current
+            self.current = BloomFilter(self.previous.bits, self.previous.hashes)
+        self.current.add(value)
+    
+    def __contains__(self, value: int) -> bool:
+        return value in self.current or (self.previous is not None and value in self.previous)
+    
+    @property
+    def size(self) -> int:
+        """Байт в памяти и в базе"""
+        if self.previous is None:
+            return self.current.size
+        return _GENERATIONS.size + self.current.size + self.previous.size
+    
+    def false_positive_rate(self) -> float:
+        rate = self.current.false_positive_rate()
+        if self.previous is not None:
+            rate = 1 - (1 - rate) * (1 - self.previous.false_positive_rate())
+        return rate
+    
+    def to_bytes(self) -> bytes:
+        # Пока поколение одно, формат тот же, что у BloomFilter
+        current = self.current.to_bytes()
+        if self.previous is None:
+            return current
+        return _GENERATIONS.pack(0, len(current)) + current + self.previous.to_bytes()
+    
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "SeenFilter":
+        if blob[0]:
+            return cls(BloomFilter.from_bytes(blob))
+        _, length = _GENERATIONS.unpack_from(blob)
+        start = _GENERATIONS.size
+        return cls(BloomFilter.from_bytes(blob[start:start + length]), BloomFilter.from_bytes(blob[start + length:]))
+
+class _StoredJoke:
+    __slots__ = ('hash', 'text', 'tokens_used')
+    
+    def __init__(self, hash, text, tokens_used):
+        self.hash = hash
+        self.text = text
+        self.tokens_used = tokens_used
+
+class _Theme:
+    """Загруженные из базы анекдоты темы"""
+    __slots__ = ('jokes', 'hashes', 'loaded_at')
+    
+    def __init__(self, jokes, loaded_at):
+        self.jokes: List[_StoredJoke] = jokes
+        self.hashes = {joke.hash for joke in jokes}
+        self.loaded_at = loaded_at
+
+class JokeStore:
+    """
+    Выдача сохраненных анекдотов, которых пользователь еще не видел.
+    Анекдоты тем и фильтры пользователей кэшируются в памяти по LRU,
+    новые анекдоты и измененные фильтры записываются в базу периодически.
+    """
+    
+    def __init__(self, database, per_theme=None, max_themes=None, max_users=None, clock=time.monotonic):
+        self.db = database
+        self.per_theme = per_theme or Config.JOKE_STORE_PER_THEME
+        self.max_themes = max_themes or Config.JOKE_STORE_THEMES
+        self.max_users = max_users or Config.SEEN_FILTER_TRACKED_USERS
+        self.clock = clock
+        self._themes: "OrderedDict[str, _Theme]" = OrderedDict()
+        self._filters: "OrderedDict[int, SeenFilter]" = OrderedDict()
+        # Ждут записи в базу
+        self._new_jokes: Dict[int, Tuple[str, str, int]] = {}
+        self._dirty: Dict[int, SeenFilter] = {}
+        
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+    
+    async def pick(self, user_id: int, theme: str) -> Optional[Tuple[str, int]]:
+        """
+        Сохраненный анекдот на тему, которого пользователь не видел: (анекдот, 0) или None.
+        Токены - 0: повторный показ генерации не стоит.
+        Проверяется не больше JOKE_STORE_MAX_PROBES случайных кандидатов, поэтому выбор
+        не зависит ни от числа анекдотов темы, ни от истории пользователя.
+        Увиденным анекдот отмечает mark_seen - после того, как он доставлен.
+        """
+        key = normalize_theme(theme)
+        stored = await self._theme(key)
+        seen = await self._filter(user_id)
+        jokes = stored.jokes
+        if jokes:
+            start = random.randrange(len(jokes))
+            for offset in range(min(len(jokes), Config.JOKE_STORE_MAX_PROBES)):
+                joke = jokes[(start + offset) % len(jokes)]
+                if joke.hash not in seen:
+                    self.hits += 1
+                    return joke.text, 0
+        self.misses += 1
+        return None
+    
+    async def pick_any(self, theme: str) -> Optional[Tuple[str, int]]:
+        """
+        Любой сохраненный анекдот на тему, даже уже виденный: (анекдот, 0) или None.
+        Нужен в деградации, когда повтор лучше долгого ожидания или ошибки.
+        """
+        stored = await self._theme(normalize_theme(theme))
+        if not stored.jokes:
+            return None
+        return random.choice(stored.jokes).text, 0
+    
+    def store(self, theme: str, joke: str, tokens_used: int = 0):
+        """Новый анекдот в хранилище; в базу попадет при следующей синхронизации"""
+        value = joke_hash(joke)
+        key = normalize_theme(theme)
+        stored = self._themes.get(key)
+        if stored is not None and value not in stored.hashes:
+            stored.jokes.append(_StoredJoke(value, joke, tokens_used))
+            stored.hashes.add(value)
+            if len(stored.jokes) > self.per_theme:
+                stored.hashes.discard(stored.jokes.pop(0).hash)
+        self._new_jokes.setdefault(value, (key, joke, tokens_used))
+    
+    async def mark_seen(self, user_id: int, joke: str):
+        """Анекдот доставлен пользователю - больше его не предлагаем"""
+        value = joke_hash(joke)
+        seen = await self._filter(user_id)
+        if value not in seen:
+            self._mark_seen(user_id, seen, value)
+    
+    async def sync_async(self) -> int:
+        """Записывает новые анекдоты и измененные фильтры; возвращает число записей"""
+        jokes, self._new_jokes = self._new_jokes, {}
+        filters = {user_id: seen.to_bytes() for user_id, seen in self._dirty.items()}
+        self._dirty = {}
+        if not jokes and not filters:
+            return 0
+        try:
+            await self.db.engine.run(self._write, jokes, filters)
+        except Exception:
+            # Вернем несохраненное, чтобы записать при следующей синхронизации
+            for value, row in jokes.items():
+                self._new_jokes.setdefault(value, row)
+            for user_id in filters:
+                seen = self._filters.get(user_id)
+                if seen is not None:
+                    self._dirty.setdefault(user_id, seen)
+            raise
+        return len(jokes) + len(filters)
+    
+    def stats(self) -> dict:
+        """Попадания, память и оценка ложных срабатываний фильтров"""
+        filters = list(self._filters.values())
+        rates = [seen.false_positive_rate() for seen in filters]
+        total = self.hits + self.misses
+        return {
+            "themes": len(self._themes),
+            "jokes": sum(len(stored.jokes) for stored in self._themes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "users": len(filters),
+            "filter_bytes": filters[0].size if filters else SeenFilter().size,
+            "filters_bytes": sum(seen.size for seen in filters),
+            "fpr_avg": sum(rates) / len(rates) if rates else 0.0,
+            "fpr_max": max(rates, default=0.0),
+        }
+    
+    def _mark_seen(self, user_id, seen, value):
+        seen.add(value)
+        self._dirty[user_id] = seen
+    
+    async def _theme(self, key) -> _Theme:
+        stored = self._themes.get(key)
+        now = self.clock()
+        # Другие процессы (шарды) тоже пополняют хранилище - периодически перечитываем тему
+        if stored is None or now - stored.loaded_at > Config.JOKE_STORE_THEME_TTL:
+            rows = await self.db.engine.run(self._load_theme, key)
+            # От старых к новым: при переполнении вытесняется самый старый
+            stored = _Theme([_StoredJoke(*row) for row in reversed(rows)], now)
+            # Еще не записанные анекдоты темы тоже доступны
+            for value, (theme_key, joke, tokens_used) in self._new_jokes.items():
+                if theme_key == key and value not in stored.hashes and len(stored.jokes) < self.per_theme:
+                    stored.jokes.append(_StoredJoke(value, joke, tokens_used))
+                    stored.hashes.add(value)
+            self._themes[key] = stored
+            while len(self._themes) > self.max_themes:
+                self._themes.popitem(last=False)
+        self._themes.move_to_end(key)
+        return stored
+    
+    async def _filter(self, user_id) -> SeenFilter:
+        seen = self._filters.get(user_id)
+        if seen is None:
+            seen = self._dirty.get(user_id)
+        if seen is None:
+            blob = await self.db.engine.run(self._load_filter, user_id)
+            # Пока ждали базу, фильтр мог загрузить параллельный запрос того же пользователя
+            seen = self._filters.get(user_id) or self._dirty.get(user_id)
+            if seen is None:
+                seen = SeenFilter.from_bytes(blob) if blob else SeenFilter()
+        self._filters[user_id] = seen
+        self._filters.move_to_end(user_id)
+        # Вытесненный измененный фильтр остается в _dirty до записи
+        while len(self._filters) > self.max_users:
+            self._filters.popitem(last=False)
+        return seen
+    
+    # Синхронные функции - выполняются в потоке хранилища
+    
+    def _load_theme(self, key):
+        with self.db.engine.connection() as conn:
+            return conn.execute('''
+                SELECT joke_hash, joke_text, tokens_used FROM jokes
+                WHERE theme_key = ? ORDER BY created_at DESC LIMIT ?
+            ''', (key, self.per_theme)).fetchall()
+    
+    def _load_filter(self, user_id):
+        with self.db.engine.connection() as conn:
+            row = conn.execute('SELECT seen_filter FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            return row[0] if row else None
+    
+    def _write(self, jokes, filters):
+        with self.db.engine.connection() as conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO jokes (joke_hash, theme_key, joke_text, tokens_used)
+                VALUES (?, ?, ?, ?)
+            ''', [(value, key, joke, tokens_used) for value, (key, joke, tokens_used) in jokes.items()])
+            added = self.db.ensure_users(conn, filters)
+            conn.executemany('UPDATE users SET seen_filter = ? WHERE user_id = ?',
+                             [(blob, user_id) for user_id, blob in filters.items()])
+        self.db.stats.users_added(added)
+
+# Общее хранилище процесса
+joke_store = lazy(lambda: JokeStore(db), "joke_store")
+
+registry.gauge("anekdotych_seen_filters_bytes", "Память фильтров просмотренных анекдотов",
+               lambda: joke_store.stats()["filters_bytes"])
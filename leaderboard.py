@@ -0,0 +1,184 @@
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+from config import Config
+from counters import create_counters
+from services import lazy
+from utils.helpers import utc_today
+
+# Периоды рейтинга
+PERIODS = ("today", "week", "all")
+WEEK_DAYS = 7
+
+class _TopK:
+    """Топ-K по монотонно растущим счетчикам"""
+    __slots__ = ('size', 'items')
+    
+    def __init__(self, size):
+        self.size = size
+        self.items: List[Tuple[str, int]] = []
+    
+    def update(self, key, count):
+        """Учитывает новое значение счетчика за O(K)"""
+        for i, (item_key, _) in enumerate(self.items):
+            if item_key == key:
+                self.items[i] = (key, count)
+                break
+        else:
+            if len(self.items) >= self.size and count <= self.items[-1][1]:
+                return
+            self.items.append((key, count))
+        self.items.sort(key=lambda item: item[1], reverse=True)
+        del self.items[self.size:]
+    
+    def rebuild(self, counts: Dict[str, int]):
+        self.items = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:self.size]
+
+class ThemeLeaderboard:
+    """
+    Рейтинг тем в памяти за сегодня, неделю и все время.
+    Обновляется при записи запросов, чтение топа стоит O(K).
+    """
+    
+    def __init__(self, size=10):
+        self.size = size
+        self._lock = threading.Lock()
+        self._all: Dict[str, int] = {}
+        self._days: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._week: Dict[str, int] = {}
+        self._today = utc_today()
+        self._tops = {period: _TopK(size) for period in PERIODS}
+    
+    def load(self, totals, daily):
+        """
+        Загрузка при старте.
+        totals: [(theme_key, count)], daily: [(theme_key, day, count)] за последние дни
+        """
+        with self._lock:
+            self._all = dict(totals)
+            self._days = defaultdict(dict)
+            for theme_key, day, count in daily:
+                self._days[day][theme_key] = count
+            self._today = utc_today()
+            self._rebuild()
+    
+    def record(self, theme_counts):
+        """Учитывает записанные запросы: {(theme_key, day): count}"""
+        with self._lock:
+            self._roll_day()
+            week_start = self._week_start()
+            for (theme_key, day), count in theme_counts.items():
+                total = self._all.get(theme_key, 0) + count
+                self._all[theme_key] = total
+                self._tops["all"].update(theme_key, total)
+                
+                # Запросы старше недели в оконные рейтинги не попадают
+                if day < week_start:
+                    continue
+                day_counts = self._days[day]
+                day_counts[theme_key] = day_counts.get(theme_key, 0) + count
+                week_total = self._week.get(theme_key, 0) + count
+                self._week[theme_key] = week_total
+                self._tops["week"].update(theme_key, week_total)
+                if day == self._today:
+                    self._tops["today"].update(theme_key, day_counts[theme_key])
+    
+    def top(self, period="all", limit=None) -> List[Tuple[str, int]]:
+        """Топ тем за период"""
+        with self._lock:
+            self._roll_day()
+            return list(self._tops[period].items[:limit or self.size])
+    
+    def _roll_day(self):
+        """При смене дня отбрасывает дни вне недельного окна"""
+        today = utc_today()
+        if today == self._today:
+            return
+        self._today = today
+        week_start = self._week_start()
+        for day in [day for day in self._days if day < week_start]:
+            del self._days[day]
+        self._rebuild()
+    
+    def _rebuild(self):
+        self._week = defaultdict(int)
+        for day_counts in self._days.values():
+            for theme_key, count in day_counts.items():
+                self._week[theme_key] += count
+        self._week = dict(self._week)
+        self._tops["all"].rebuild(self._all)
+        self._tops["week"].rebuild(self._week)
+        self._tops["today"].rebuild(self._days.get(self._today, {}))
+    
+    def _week_start(self) -> str:
+        return (date.fromisoformat(self._today) - timedelta(days=WEEK_DAYS - 1)).isoformat()
+
+class SharedLeaderboard:
+    """
+    Рейтинг тем в общем хранилище счетчиков - для режима с несколькими процессами.
+    Группы счетчиков: "all" и "day:<дата>", недельный топ - сумма семи дней.
+    Загрузку из базы выполняет только владелец (фронт-процесс), воркеры лишь пишут и читают.
+    """
+    
+    def __init__(self, counters, size=10, owner=False):
+        self.counters = counters
+        self.size = size
+        self.owner = owner
+        self._lock = threading.Lock()
+        self._today = utc_today()
+    
+    def load(self, totals, daily):
+        """Пересборка общих счетчиков из базы (только у владельца)"""
+        if not self.owner:
+            return
+        groups = {"all": dict(totals)}
+        for theme_key, day, count in daily:
+            groups.setdefault(f"day:{day}", {})[theme_key] = count
+        self.counters.replace(groups)
+    
+    def record(self, theme_counts):
+        """Учитывает записанные запросы: {(theme_key, day): count}"""
+        self._roll_day()
+        totals = {}
+        days = defaultdict(dict)
+        for (theme_key, day), count in theme_counts.items():
+            totals[theme_key] = totals.get(theme_key, 0) + count
+            days[day][theme_key] = days[day].get(theme_key, 0) + count
+        self.counters.incr("all", totals)
+        for day, counts in days.items():
+            self.counters.incr(f"day:{day}", counts)
+    
+    def top(self, period="all", limit=None) -> List[Tuple[str, int]]:
+        """Топ тем за период"""
+        self._roll_day()
+        if period == "all":
+            names = ["all"]
+        elif period == "today":
+            names = [f"day:{self._today}"]
+        else:
+            today = date.fromisoformat(self._today)
+            names = [f"day:{today - timedelta(days=i)}" for i in range(WEEK_DAYS)]
+        return [tuple(item) for item in self.counters.top(names, limit or self.size)]
+    
+    def _roll_day(self):
+        """При смене дня удаляет дневные счетчики вне недельного окна"""
+        with self._lock:
+            today = utc_today()
+            if today == self._today:
+                return
+            self._today = today
+        week_start = (date.fromisoformat(today) - timedelta(days=WEEK_DAYS - 1)).isoformat()
+        self.counters.delete([
+            name for name in self.counters.names()
+            if name.startswith("day:") and name[4:] < week_start
+        ])
+
+def create_leaderboard():
+    """В режиме шардов рейтинг живет в общем хранилище, иначе - в памяти процесса"""
+    if Config.SHARDS:
+        return SharedLeaderboard(create_counters(Config.COUNTERS_URL))
+    return ThemeLeaderboard()
+
+# Общий рейтинг процесса; хранилище счетчиков подключается при первом обращении
+leaderboard = lazy(create_leaderboard)
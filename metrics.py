@@ -0,0 +1,226 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы гистограмм по умолчанию (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (50, 100, 150, 200, 250, 300, 400, 500, 750, 1000)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=None):
+    items = list(key) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+class Counter:
+    """Монотонный счетчик с метками"""
+    
+    kind = "counter"
+    
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+    
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values().items()]
+
+class Gauge:
+    """Текущее значение, которое читается функцией в момент выгрузки"""
+    
+    kind = "gauge"
+    
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+    
+    def render(self):
+        try:
+            return [f"{self.name} {self.func()}"]
+        except Exception as e:
+            logging.debug(f"Gauge {self.name} failed: {e}")
+            return []
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # key -> [counts по корзинам (+Inf последней), сумма, количество]
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[key] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока кода"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def snapshot(self):
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+    
+    def quantile(self, q, **labels):
+        """Оценка квантиля по корзинам (верхняя граница корзины)"""
+        series = self.snapshot().get(_label_key(labels))
+        if not series or not series[2]:
+            return 0.0
+        counts, _, count = series
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+    
+    def render(self):
+        lines = []
+        for key, (counts, total, count) in self.snapshot().items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Набор метрик процесса с выгрузкой в текстовом формате Prometheus"""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def counter(self, name, help_text):
+        return self._register(name, lambda: Counter(name, help_text))
+    
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._register(name, lambda: Histogram(name, help_text, buckets))
+    
+    def gauge(self, name, help_text, func):
+        return self._register(name, lambda: Gauge(name, help_text, func))
+    
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+    
+    def _register(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = factory()
+                self._metrics[name] = metric
+            return metric
+
+# Общий реестр процесса и основные метрики бота
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "anekdotych_stage_seconds", "Длительность этапов обработки запроса на анекдот"
+)
+telegram_send_seconds = registry.histogram(
+    "anekdotych_telegram_send_seconds", "Длительность попыток отправки сообщений в Telegram"
+)
+telegram_send_failures = registry.counter(
+    "anekdotych_telegram_send_failures_total", "Неудачные попытки отправки сообщений"
+)
+upstream_responses = registry.counter(
+    "anekdotych_upstream_responses_total", "Ответы OpenRouter по статусам и моделям"
+)
+tokens_used = registry.histogram(
+    "anekdotych_tokens_used", "Токены на одну генерацию", buckets=TOKEN_BUCKETS
+)
+tokens_per_joke = registry.histogram(
+    "anekdotych_tokens_per_joke", "Токены на один анекдот: поштучно или пакетом", buckets=TOKEN_BUCKETS
+)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host, port):
+    """Запуск HTTP-эндпоинта /metrics в фоновом потоке"""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"📈 Metrics endpoint: http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
+
+def summary_lines():
+    """Краткая сводка для /admin"""
+    lines = []
+    for stage in ("validation", "generation", "log_request", "send", "db_flush"):
+        p50 = stage_seconds.quantile(0.5, stage=stage)
+        p95 = stage_seconds.quantile(0.95, stage=stage)
+        if p95:
+            lines.append(f"⏱ {stage}: p50 ≤ {p50 * 1000:.0f} мс, p95 ≤ {p95 * 1000:.0f} мс")
+    
+    statuses = {}
+    for key, value in upstream_responses.values().items():
+        status = dict(key).get('status')
+        statuses[status] = statuses.get(status, 0) + value
+    if statuses:
+        parts = [f"{status}: {value}" for status, value in sorted(statuses.items())]
+        lines.append("🌐 OpenRouter: " + ", ".join(parts))
+    
+    for mode, title in (("single", "поштучно"), ("batch", "пакетом")):
+        token_p50 = tokens_per_joke.quantile(0.5, mode=mode)
+        if token_p50:
+            token_p95 = tokens_per_joke.quantile(0.95, mode=mode)
+            lines.append(f"🔤 Токенов на анекдот {title}: p50 ≤ {token_p50:.0f}, p95 ≤ {token_p95:.0f}")
+    return lines
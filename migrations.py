@@ -0,0 +1,215 @@
+"""
+Версионированные миграции схемы базы. Текущая версия хранится в PRAGMA user_version,
+поэтому при актуальной схеме старт бота не выполняет ни одного DDL-запроса.
+Миграция и новая версия записываются в одной явной транзакции: прерванная миграция
+не оставляет схему наполовину измененной и при следующем старте повторяется целиком.
+
+Новая миграция добавляется в конец MIGRATIONS со следующим номером версии;
+уже выпущенные миграции не меняются.
+"""
+
+import logging
+from utils.helpers import normalize_theme
+
+def _initial_schema(conn):
+    """Пользователи, запросы, дневные квоты и счетчики тем"""
+    # Таблица пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            request_count INTEGER DEFAULT 0,
+            last_request TIMESTAMP
+        )
+    ''')
+    
+    # Таблица запросов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            theme TEXT,
+            joke_text TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tokens_used INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # Дневные квоты пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_quotas (
+            user_id INTEGER,
+            day TEXT,
+            request_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    ''')
+    
+    # Счетчики тем (ключ - нормализованная тема)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS theme_stats (
+            theme_key TEXT PRIMARY KEY,
+            request_count INTEGER DEFAULT 0,
+            last_request TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS theme_daily_stats (
+            theme_key TEXT,
+            day TEXT,
+            request_count INTEGER DEFAULT 0,
+            PRIMARY KEY (theme_key, day)
+        )
+    ''')
+    
+    # Индексы для оконных рейтингов и выборок по времени
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_theme_daily_day ON theme_daily_stats (day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_created_at ON requests (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_user ON requests (user_id)')
+    
+    _backfill_theme_stats(conn)
+
+def _backfill_theme_stats(conn):
+    """Однократное заполнение счетчиков тем из уже накопленной истории"""
+    if conn.execute('SELECT 1 FROM theme_stats LIMIT 1').fetchone():
+        return
+    if not conn.execute('SELECT 1 FROM requests LIMIT 1').fetchone():
+        return
+    
+    conn.create_function('normalize_theme', 1, normalize_theme)
+    conn.execute('''
+        INSERT INTO theme_daily_stats (theme_key, day, request_count)
+        SELECT normalize_theme(theme), substr(created_at, 1, 10), COUNT(*)
+        FROM requests
+        GROUP BY 1, 2
+    ''')
+    conn.execute('''
+        INSERT INTO theme_stats (theme_key, request_count, last_request)
+        SELECT normalize_theme(theme), COUNT(*), MAX(created_at)
+        FROM requests
+        GROUP BY 1
+    ''')
+
+def _request_archive(conn):
+    """Итоги заархивированных месяцев"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS request_archive (
+            month TEXT PRIMARY KEY,
+            request_count INTEGER DEFAULT 0,
+            tokens_used INTEGER DEFAULT 0,
+            last_id INTEGER DEFAULT 0
+        )
+    ''')
+
+def _incremental_vacuum(conn):
+    """
+    Постраничное освобождение места. auto_vacuum меняется только перестройкой файла
+    (VACUUM), а она невозможна внутри транзакции - шаг выполняется до нее и повторяем.
+    Для новой базы перестройка мгновенна.
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+def _joke_store(conn):
+    """Анекдоты по хешу текста и фильтры просмотренного у пользователей"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jokes (
+            joke_hash INTEGER PRIMARY KEY,
+            theme_key TEXT,
+            joke_text TEXT,
+            tokens_used INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jokes_theme ON jokes (theme_key, created_at)')
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(users)')]
+    if 'seen_filter' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN seen_filter BLOB')
+
+def _token_accounting(conn):
+    """Дневные токены пользователей и тем, общий расход OpenRouter по дням"""
+    for table in ('daily_quotas', 'theme_stats', 'theme_daily_stats'):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if 'tokens_used' not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN tokens_used INTEGER DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS token_usage (
+            day TEXT PRIMARY KEY,
+            tokens_used INTEGER DEFAULT 0,
+            generations INTEGER DEFAULT 0
+        )
+    ''')
+    
+    # Токены тем - из еще не заархивированной истории
+    conn.create_function('normalize_theme', 1, normalize_theme)
+    daily = conn.execute('''
+        SELECT normalize_theme(theme), substr(created_at, 1, 10), SUM(tokens_used)
+        FROM requests
+        GROUP BY 1, 2
+    ''').fetchall()
+    conn.executemany('''
+        UPDATE theme_daily_stats SET tokens_used = ? WHERE theme_key = ? AND day = ?
+    ''', [(tokens or 0, theme_key, day) for theme_key, day, tokens in daily])
+    totals = {}
+    for theme_key, _, tokens in daily:
+        totals[theme_key] = totals.get(theme_key, 0) + (tokens or 0)
+    conn.executemany('''
+        UPDATE theme_stats SET tokens_used = ? WHERE theme_key = ?
+    ''', [(tokens, theme_key) for theme_key, tokens in totals.items()])
+    conn.executemany('''
+        UPDATE daily_quotas SET tokens_used = ? WHERE user_id = ? AND day = ?
+    ''', conn.execute('''
+        SELECT COALESCE(SUM(tokens_used), 0), user_id, substr(created_at, 1, 10)
+        FROM requests
+        GROUP BY 2, 3
+    ''').fetchall())
+    conn.execute('''
+        INSERT OR IGNORE INTO token_usage (day, tokens_used, generations)
+        SELECT substr(created_at, 1, 10), COALESCE(SUM(tokens_used), 0), COUNT(*)
+        FROM requests
+        GROUP BY 1
+    ''')
+
+# (версия, описание, функция(conn)[, шаг вне транзакции(conn)]) по возрастанию версий.
+# Шаг вне транзакции выполняется перед ней и должен быть идемпотентным.
+# Первая миграция идемпотентна: базы, созданные до появления версий (user_version = 0),
+# проходят ее без потери данных.
+MIGRATIONS = (
+    (1, "начальная схема", _initial_schema),
+    (2, "архив запросов", _request_archive, _incremental_vacuum),
+    (3, "хранилище анекдотов", _joke_store),
+    (4, "учет токенов", _token_accounting),
+)
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn, migrations=MIGRATIONS) -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции; возвращает версию схемы"""
+    version = schema_version(conn)
+    for target, description, apply, *prepare in migrations:
+        if target <= version:
+            continue
+        logging.info(f"🗄️ Schema migration {target}: {description}")
+        # sqlite3 сам не открывает транзакцию перед DDL - открываем явно
+        if conn.in_transaction:
+            conn.commit()
+        for step in prepare:
+            step(conn)
+        conn.execute('BEGIN')
+        try:
+            apply(conn)
+            # PRAGMA не принимает параметры, версия - число из списка выше
+            conn.execute(f'PRAGMA user_version = {int(target)}')
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        version = target
+    return version
@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Tuple
+from config import Config
+from metrics import registry
+from openrouter_client import UpstreamError
+from slo_controller import slo_controller
+
+router_events = registry.counter(
+    "anekdotych_router_events_total", "Хеджирование, фолбэки и срабатывания предохранителя по моделям"
+)
+
+class CircuitBreaker:
+    """
+    Предохранитель модели: после серии ошибок или 429 модель на время
+    выводится из ротации, затем пропускается один пробный запрос.
+    """
+    __slots__ = ('failure_threshold', 'open_seconds', 'throttle_seconds', 'clock',
+                 'failures', 'open_until', 'probing')
+    
+    def __init__(self, failure_threshold=None, open_seconds=None, throttle_seconds=None, clock=time.monotonic):
+        self.failure_threshold = failure_threshold or Config.BREAKER_FAILURE_THRESHOLD
+        self.open_seconds = open_seconds if open_seconds is not None else Config.BREAKER_OPEN_SECONDS
+        self.throttle_seconds = throttle_seconds if throttle_seconds is not None else Config.BREAKER_THROTTLE_SECONDS
+        self.clock = clock
+        self.failures = 0
+        self.open_until = None
+        self.probing = False
+    
+    @property
+    def state(self) -> str:
+        if self.open_until is None:
+            return "closed"
+        if self.clock() < self.open_until:
+            return "open"
+        return "half_open"
+    
+    def allow(self) -> bool:
+        """Можно ли отправить запрос; в полуоткрытом состоянии - только один пробный"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.probing:
+            return False
+        self.probing = True
+        return True
+    
+    def record_success(self):
+        self.failures = 0
+        self.open_until = None
+        self.probing = False
+    
+    def record_failure(self, error: UpstreamError):
+        """Учитывает ошибку; возвращает True, если предохранитель сработал"""
+        self.probing = False
+        if error.throttled:
+            # Модель нас ограничивает - не долбим ее до конца Retry-After
+            self._open(error.retry_after or self.throttle_seconds)
+            return True
+        self.failures += 1
+        if self.open_until is not None or self.failures >= self.failure_threshold:
+            self._open(self.open_seconds)
+            return True
+        return False
+    
+    def release(self):
+        """Запрос отменен без результата - освобождаем место пробного"""
+        self.probing = False
+    
+    def _open(self, seconds):
+        self.open_until = self.clock() + seconds
+
+class _Race:
+    """Запросы одной генерации к разным моделям"""
+    __slots__ = ('pending', 'tried', 'winner', 'hedged')
+    
+    def __init__(self):
+        # task -> (модель, время запуска)
+        self.pending: Dict[asyncio.Task, Tuple[str, float]] = {}
+        self.tried: List[str] = []
+        self.winner = None
+        self.hedged = False
+
+class ModelRouter:
+    """
+    Маршрутизация генераций по списку моделей OpenRouter.
+    Если основная модель не ответила за заданный перцентиль своей задержки,
+    параллельно уходит запасной запрос к следующей модели и берется тот ответ,
+    что придет первым. Упавшие и ограниченные (429) модели отключает предохранитель,
+    а общее время генерации ограничено GENERATION_DEADLINE (в деградации - короче).
+    """
+    
+    def __init__(self, client, models=None, clock=time.monotonic):
+        self.client = client
+        self.models = list(models or Config.OPENROUTER_MODELS)
+        self.breakers = {model: CircuitBreaker(clock=clock) for model in self.models}
+        self._latencies = {}
+        
+        # Метрики
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+    
+    async def generate_joke_async(self, theme=None):
+        """Генерация с хеджированием; возвращает (анекдот, токены) как OpenRouterClient"""
+        try:
+            return await self._race("complete", lambda model, race: self.client.complete(theme, model))
+        except UpstreamError as e:
+            return self.client.error_text(e), 0
+    
+    async def generate_jokes_async(self, theme=None, count=1):
+        """Несколько анекдотов на одну тему: [(анекдот, токены)], при ошибке - [(текст ошибки, 0)]"""
+        if count == 1:
+            return [await self.generate_joke_async(theme)]
+        try:
+            jokes = await self._batch([theme] * count)
+        except UpstreamError as e:
+            return [(self.client.error_text(e), 0)]
+        # Недостающие анекдоты участники объединения догенерируют сами
+        return [joke for joke in jokes if joke]
+    
+    async def generate_batch_async(self, themes):
+        """Пакетная генерация по списку тем: [(анекдот, токены) или None] в порядке тем"""
+        try:
+            return await self._batch(themes)
+        except UpstreamError as e:
+            logging.warning(f"Batch generation failed: {e}")
+            return [None] * len(themes)
+    
+    async def generate_joke_stream(self, theme=None, on_text=None):
+        """
+        Потоковая генерация. Запасной запрос соревнуется с основным до первого фрагмента:
+        пользователю показывается поток модели, которая ответила первой, остальные отменяются.
+        """
+        async def call(model, race):
+            async def forward(text):
+                if race.winner is None:
+                    self._claim(race, model)
+                if race.winner == model and on_text:
+                    await on_text(text)
+            return await self.client.stream(theme, forward, model)
+        
+        try:
+            return await self._race("stream", call)
+        except UpstreamError as e:
+            return self.client.error_text(e), 0
+    
+    def hedge_delay(self, model, kind="complete") -> float:
+        """Через сколько секунд без ответа модели отправлять запасной запрос"""
+        samples = self._latencies.get((kind, model))
+        if not samples or len(samples) < Config.HEDGE_MIN_SAMPLES:
+            return Config.HEDGE_DEFAULT_DELAY
+        ordered = sorted(samples)
+        value = ordered[min(len(ordered) - 1, int(len(ordered) * Config.HEDGE_PERCENTILE))]
+        return min(Config.HEDGE_MAX_DELAY, max(Config.HEDGE_MIN_DELAY, value))
+    
+    def stats(self) -> dict:
+        """Состояние предохранителей и счетчики хеджирования"""
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "breakers": {model: breaker.state for model, breaker in self.breakers.items()},
+            "hedge_delay": {model: self.hedge_delay(model) for model in self.models},
+        }
+    
+    async def _race(self, kind, call):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + slo_controller.deadline()
+        race = _Race()
+        can_hedge = True
+        last_error = None
+        
+        try:
+            if not self._launch(race, call):
+                raise UpstreamError("unavailable", "все модели временно недоступны")
+            
+            while race.pending:
+                now = loop.time()
+                # Начавшийся поток дедлайном не обрываем - его ограничивает таймаут клиента
+                if race.winner is None and now >= deadline:
+                    raise self._expire(race)
+                
+                timeout = deadline - now if race.winner is None else None
+                hedge_at = None
+                if can_hedge and race.winner is None and len(race.pending) == 1:
+                    model, started = next(iter(race.pending.values()))
+                    hedge_at = started + self.hedge_delay(model, kind)
+                    timeout = max(0.0, min(timeout, hedge_at - now))
+                
+                done, _ = await asyncio.wait(race.pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                for task in done:
+                    # Запрос мог быть отменен победителем потока, пока мы ждали
+                    if task not in race.pending:
+                        continue
+                    model, started = race.pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self.breakers[model].record_success()
+                        # Для потока задержка и победа хеджа учтены при первом фрагменте
+                        if kind == "complete":
+                            self._observe(kind, model, loop.time() - started)
+                            if race.hedged and model != race.tried[0]:
+                                self.hedge_wins += 1
+                                router_events.inc(event="hedge_win", model=model)
+                        return task.result()
+                    
+                    if not isinstance(error, UpstreamError):
+                        error = UpstreamError("error", str(error))
+                    last_error = error
+                    self._fail(model, error)
+                    # Поток уже показан пользователю - на другую модель не переключаемся
+                    if race.winner == model:
+                        raise error
+                
+                if not race.pending:
+                    # Быстрая ошибка - сразу пробуем следующую модель
+                    if not self._launch(race, call):
+                        raise last_error
+                    self.fallbacks += 1
+                    router_events.inc(event="fallback", model=race.tried[-1])
+                elif not done and hedge_at is not None and loop.time() >= hedge_at:
+                    if self._launch(race, call):
+                        race.hedged = True
+                        self.hedges += 1
+                        router_events.inc(event="hedge", model=race.tried[-1])
+                    else:
+                        can_hedge = False
+            
+            raise last_error or UpstreamError("error", "не удалось сгенерировать анекдот")
+        finally:
+            for task, (model, _) in race.pending.items():
+                task.cancel()
+                self.breakers[model].release()
+    
+    async def _batch(self, themes):
+        """Пакеты по BATCH_MAX_JOKES тем, каждый - с хеджированием; ошибку бросает, только если упали все"""
+        chunks = [themes[i:i + Config.BATCH_MAX_JOKES] for i in range(0, len(themes), Config.BATCH_MAX_JOKES)]
+        results = await asyncio.gather(
+            *(self._race("batch", lambda model, race, chunk=chunk: self.client.complete_batch(chunk, model))
+              for chunk in chunks),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if len(errors) == len(results):
+            raise errors[0]
+        jokes = []
+        for chunk, result in zip(chunks, results):
+            jokes.extend([None] * len(chunk) if isinstance(result, Exception) else result)
+        return jokes
+    
+    def _launch(self, race, call) -> bool:
+        """Запускает запрос к следующей доступной модели"""
+        for model in self.models:
+            if model in race.tried or not self.breakers[model].allow():
+                continue
+            race.tried.append(model)
+            task = asyncio.ensure_future(call(model, race))
+            race.pending[task] = (model, asyncio.get_running_loop().time())
+            return True
+        return False
+    
+    def _claim(self, race, model):
+        """Первый фрагмент потока: модель побеждает, остальные запросы отменяются"""
+        race.winner = model
+        current = asyncio.current_task()
+        for task, (other, started) in list(race.pending.items()):
+            if task is current:
+                self._observe("stream", model, asyncio.get_running_loop().time() - started)
+                if race.hedged and model != race.tried[0]:
+                    self.hedge_wins += 1
+                    router_events.inc(event="hedge_win", model=model)
+                continue
+            del race.pending[task]
+            task.cancel()
+            self.breakers[other].release()
+    
+    def _expire(self, race):
+        """Общий дедлайн истек: все модели в полете считаются упавшими по таймауту"""
+        error = UpstreamError("timeout", "превышено время ожидания ответа")
+        now = asyncio.get_running_loop().time()
+        for model, started in race.pending.values():
+            self._fail(model, error)
+            # Отмененные запросы клиент не замеряет - для SLO это тоже таймауты
+            slo_controller.observe(now - started, False)
+        return error
+    
+    def _fail(self, model, error):
+        if self.breakers[model].record_failure(error):
+            logging.warning(f"⚡ Model {model} disabled: {error}")
+            router_events.inc(event="breaker_open", model=model)
+    
+    def _observe(self, kind, model, seconds):
+        samples = self._latencies.get((kind, model))
+        if samples is None:
+            samples = self._latencies[(kind, model)] = deque(maxlen=Config.HEDGE_WINDOW)
+        samples.append(seconds)
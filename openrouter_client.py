@@ -1,7 +1,25 @@
-import requests
+import asyncio
+import logging
+import httpx
 import json
 import time
 from config import Config
+from metrics import upstream_responses, tokens_used as tokens_histogram, tokens_per_joke
+from slo_controller import slo_controller
+from completion_tuner import completion_tuner
+from token_budget import token_budget
+
+class UpstreamError(Exception):
+    """Неуспешный ответ OpenRouter; status - код HTTP, таймаут или сетевая ошибка"""
+    
+    def __init__(self, status, message="", retry_after=None):
+        super().__init__(message or str(status))
+        self.status = status
+        self.retry_after = retry_after
+    
+    @property
+    def throttled(self):
+        return self.status == 429
 
 class OpenRouterClient:
     def __init__(self):
@@ -13,21 +31,266 @@ class OpenRouterClient:
             "HTTP-Referer": "https://t.me/anekdotych_bot",
             "X-Title": "Anekdotych Telegram Bot"
         }
-        self.last_request_time = 0
-        self.request_cooldown = Config.REQUEST_COOLDOWN
+        # Асинхронный клиент создается лениво внутри работающего event loop
+        self._async_client = None
+        self._semaphore = None
     
     def generate_joke(self, theme=None):
         """Генерация анекдота через OpenRouter"""
+        payload = self._build_payload(theme)
+        
+        try:
+            logging.info("🔄 Отправка запроса к OpenRouter API...")
+            
+            # requests нужен только синхронному вызову - не тянем его при старте бота
+            import requests
+            response = requests.post(
+                self.api_url,
+                headers=self.headers,
+                json=payload,
+                timeout=Config.OPENROUTER_TIMEOUT
+            )
+            return self._parse_response(response)
+                
+        except Exception as e:
+            return f"❌ Ошибка: {str(e)}", 0
+    
+    async def generate_joke_async(self, theme=None, model=None):
+        """Неблокирующая генерация анекдота через общий пул соединений"""
+        try:
+            return await self.complete(theme, model)
+        except UpstreamError as e:
+            return self.error_text(e), 0
+    
+    async def generate_jokes_async(self, theme=None, count=1):
+        """Несколько анекдотов на одну тему: [(анекдот, токены)]"""
+        return list(await asyncio.gather(
+            *(self.generate_joke_async(theme) for _ in range(count))
+        ))
+    
+    async def generate_joke_stream(self, theme=None, on_text=None, model=None):
+        """
+        Потоковая генерация анекдота (SSE, stream: true).
+        on_text - корутина, которая получает накопленный текст после каждого фрагмента.
+        Возвращает (анекдот, токены) как generate_joke_async.
+        """
+        try:
+            return await self.stream(theme, on_text, model)
+        except UpstreamError as e:
+            return self.error_text(e), 0
+    
+    async def generate_batch_async(self, themes):
+        """
+        Пакетная генерация: по анекдоту на каждую тему списка (None - случайная тема).
+        Возвращает [(анекдот, токены) или None] в порядке тем.
+        """
+        chunks = [themes[i:i + Config.BATCH_MAX_JOKES] for i in range(0, len(themes), Config.BATCH_MAX_JOKES)]
+        results = await asyncio.gather(*(self.complete_batch(chunk) for chunk in chunks), return_exceptions=True)
+        jokes = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Batch generation failed: {result}")
+                result = [None] * len(chunk)
+            jokes.extend(result)
+        return jokes
+    
+    async def complete(self, theme=None, model=None):
+        """Один запрос chat completions; при неудаче бросает UpstreamError"""
+        payload = self._build_payload(theme, model)
+        result = await self._request(payload)
+        choice = result['choices'][0]
+        joke = choice['message']['content'].strip()
+        usage = result.get('usage', {})
+        tokens_used = usage.get('total_tokens', 0)
+        completion_tuner.observe(
+            theme, usage.get('completion_tokens', 0), choice.get('finish_reason'), joke, payload["stop"]
+        )
+        token_budget.spend(tokens_used)
+        tokens_histogram.observe(tokens_used)
+        tokens_per_joke.observe(tokens_used, mode="single")
+        return joke, tokens_used
+    
+    async def complete_batch(self, themes, model=None):
+        """
+        Несколько анекдотов одним запросом: системный промпт оплачивается один раз.
+        Возвращает [(анекдот, токены на анекдот) или None] в порядке тем,
+        если ни одного годного анекдота нет - бросает UpstreamError.
+        """
+        payload = self._build_batch_payload(themes, model)
+        result = await self._request(payload)
+        content = result['choices'][0]['message']['content']
+        texts = self._parse_batch(content, len(themes))
+        valid = sum(1 for text in texts if text)
+        if not valid:
+            raise UpstreamError("error", "некорректный ответ модели")
+        
+        tokens_used = result.get('usage', {}).get('total_tokens', 0)
+        if result['choices'][0].get('finish_reason') == "length":
+            # Длины отдельных анекдотов пакета неизвестны - лимит пакета растет через общее окно
+            completion_tuner.observe(None, payload["max_tokens"] // len(themes), "length")
+        token_budget.spend(tokens_used)
+        tokens_histogram.observe(tokens_used)
+        share = tokens_used // valid
+        for _ in range(valid):
+            tokens_per_joke.observe(share, mode="batch")
+        if valid < len(themes):
+            logging.debug(f"Batch returned {valid} of {len(themes)} jokes")
+        return [(text, share) if text else None for text in texts]
+    
+    async def stream(self, theme=None, on_text=None, model=None):
+        """Потоковый запрос (SSE); при неудаче бросает UpstreamError"""
+        payload = self._build_payload(theme, model)
+        payload["stream"] = True
+        # Просим OpenRouter прислать usage в последнем событии
+        payload["usage"] = {"include": True}
+        client = self._get_async_client()
+        text = ""
+        tokens_used = 0
+        completion_tokens = 0
+        finish_reason = None
+        started = None
+        observed = False
+        
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                async with client.stream("POST", self.api_url, json=payload, timeout=self._timeout()) as response:
+                    upstream_responses.inc(status=str(response.status_code), model=payload["model"])
+                    if response.status_code != 200:
+                        await response.aread()
+                        raise self._status_error(response)
+                    
+                    async for line in response.aiter_lines():
+                        # Строки-комментарии (": OPENROUTER PROCESSING") и пустые пропускаем
+                        if not line.startswith("data:"):
+                            continue
+                        if not observed:
+                            # Для SLO потока важно время до первого фрагмента
+                            observed = True
+                            slo_controller.observe(time.monotonic() - started, True)
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        
+                        event = json.loads(data)
+                        if event.get('error'):
+                            error = event['error']
+                            raise UpstreamError(error.get('code', "error"), error.get('message', 'ошибка генерации'))
+                        if event.get('usage'):
+                            tokens_used = event['usage'].get('total_tokens', 0)
+                            completion_tokens = event['usage'].get('completion_tokens', 0)
+                        
+                        choices = event.get('choices') or []
+                        if choices and choices[0].get('finish_reason'):
+                            finish_reason = choices[0]['finish_reason']
+                        delta = choices[0].get('delta', {}).get('content') if choices else None
+                        if delta:
+                            text += delta
+                            if on_text:
+                                await on_text(text)
+        
+        except UpstreamError:
+            self._observe_failure(started, observed)
+            raise
+        except httpx.TimeoutException:
+            upstream_responses.inc(status="timeout", model=payload["model"])
+            self._observe_failure(started, observed)
+            raise UpstreamError("timeout", "превышено время ожидания ответа")
+        except (httpx.HTTPError, ValueError) as e:
+            upstream_responses.inc(status="error", model=payload["model"])
+            self._observe_failure(started, observed)
+            raise UpstreamError("error", str(e))
         
-        # Защита от слишком частых запросов
-        current_time = time.time()
-        if current_time - self.last_request_time < self.request_cooldown:
-            time.sleep(self.request_cooldown - (current_time - self.last_request_time))
+        token_budget.spend(tokens_used)
+        joke = text.strip()
+        if not joke:
+            raise UpstreamError("error", "пустой ответ модели")
+        completion_tuner.observe(theme, completion_tokens, finish_reason, joke, payload["stop"])
+        tokens_histogram.observe(tokens_used)
+        tokens_per_joke.observe(tokens_used, mode="single")
+        return joke, tokens_used
+    
+    async def _request(self, payload):
+        """POST к chat completions; возвращает JSON ответа или бросает UpstreamError"""
+        client = self._get_async_client()
+        started = None
+        
+        try:
+            # Ограничиваем число одновременных запросов к API
+            async with self._semaphore:
+                started = time.monotonic()
+                response = await client.post(self.api_url, json=payload, timeout=self._timeout())
+        except httpx.TimeoutException:
+            upstream_responses.inc(status="timeout", model=payload["model"])
+            self._observe_failure(started)
+            raise UpstreamError("timeout", "превышено время ожидания ответа")
+        except httpx.HTTPError as e:
+            upstream_responses.inc(status="error", model=payload["model"])
+            self._observe_failure(started)
+            raise UpstreamError("error", str(e))
         
+        upstream_responses.inc(status=str(response.status_code), model=payload["model"])
+        slo_controller.observe(time.monotonic() - started, response.status_code == 200)
+        if response.status_code != 200:
+            raise self._status_error(response)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise UpstreamError("error", f"некорректный JSON: {e}")
+    
+    def error_text(self, error):
+        """Текст ошибки для пользователя"""
+        if isinstance(error.status, int):
+            return self._error_message(error.status)
+        return f"❌ Ошибка: {error}"
+    
+    def _status_error(self, response):
+        retry_after = response.headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        return UpstreamError(response.status_code, f"HTTP {response.status_code}", retry_after)
+    
+    def _timeout(self):
+        """Таймаут запроса: в деградации короче, чтобы быстрее уйти на запасные пути"""
+        return httpx.Timeout(slo_controller.timeout(), connect=Config.OPENROUTER_CONNECT_TIMEOUT)
+    
+    def _observe_failure(self, started, observed=False):
+        """Ошибка для SLO; запросы, не дождавшиеся семафора, и уже начавшиеся потоки не учитываются"""
+        if started is not None and not observed:
+            slo_controller.observe(time.monotonic() - started, False)
+    
+    def _get_async_client(self):
+        """Общий HTTP-клиент с keep-alive соединениями"""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(
+                    Config.OPENROUTER_TIMEOUT,
+                    connect=Config.OPENROUTER_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=Config.OPENROUTER_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.OPENROUTER_MAX_CONNECTIONS,
+                    keepalive_expiry=Config.OPENROUTER_KEEPALIVE_EXPIRY
+                )
+            )
+            self._semaphore = asyncio.Semaphore(Config.OPENROUTER_MAX_CONCURRENCY)
+        return self._async_client
+    
+    async def aclose(self):
+        """Закрытие пула соединений"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+    
+    def _build_payload(self, theme, model=None, stop=True):
+        """Тело запроса к chat completions; stop=False - без стоп-последовательностей"""
         prompt = self._build_prompt(theme)
         
         payload = {
-            "model": "deepseek/deepseek-chat",
+            "model": model or Config.OPENROUTER_MODELS[0],
             "messages": [
                 {
                     "role": "system",
@@ -38,37 +301,85 @@ class OpenRouterClient:
                     "content": prompt
                 }
             ],
-            "max_tokens": 250,
+            "max_tokens": completion_tuner.max_tokens(theme),
             "temperature": 0.85,
             "top_p": 0.9
         }
-        
+        if stop:
+            payload["stop"] = completion_tuner.stop(theme)
+        return payload
+    
+    def _build_batch_payload(self, themes, model=None):
+        """Тело пакетного запроса со структурированным (JSON) ответом"""
+        # Стоп-последовательности оборвали бы JSON со многими анекдотами
+        payload = self._build_payload(None, model, stop=False)
+        payload["messages"][1]["content"] = self._build_batch_prompt(themes)
+        payload["max_tokens"] = completion_tuner.batch_tokens(themes)
+        payload["response_format"] = {"type": "json_object"}
+        return payload
+    
+    def _build_batch_prompt(self, themes):
+        """Промпт пакетной генерации: нумерованный список тем и формат ответа"""
+        lines = "\n".join(f"{i}. {theme or 'любая тема'}" for i, theme in enumerate(themes, 1))
+        return f'''Напиши {len(themes)} разных смешных анекдотов, по одному на каждую тему из списка:
+{lines}
+Требования к каждому анекдоту:
+- Длина: 2-4 предложения
+- Стиль: классический русский анекдот
+- Без оскорблений, политики и черного юмора
+- Анекдоты не должны повторяться
+Ответь только JSON без пояснений: {{"jokes": [{{"id": 1, "text": "..."}}]}}, где id - номер темы.'''
+    
+    def _parse_batch(self, content, count):
+        """Разбор и проверка JSON пакетного ответа: тексты по номерам тем (None - не получен)"""
+        texts = [None] * count
+        # Модели иногда оборачивают JSON в ```json ... ``` - берем от первой до последней скобки
+        start, end = content.find("{"), content.rfind("}")
         try:
-            print("🔄 Отправка запроса к OpenRouter API...")
-            self.last_request_time = time.time()
-            
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            
-            print(f"📊 Статус ответа: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                joke = result['choices'][0]['message']['content'].strip()
-                tokens_used = result.get('usage', {}).get('total_tokens', 0)
-                return joke, tokens_used
+            data = json.loads(content[start:end + 1]) if start != -1 else None
+        except ValueError:
+            logging.debug(f"Batch response is not JSON: {content[:200]}")
+            return texts
+        
+        items = data.get("jokes") if isinstance(data, dict) else None
+        seen = set()
+        for position, item in enumerate(items or []):
+            if isinstance(item, dict):
+                text, index = item.get("text"), item.get("id", position + 1)
             else:
-                error_msg = f"❌ Ошибка API ({response.status_code})"
-                if response.status_code == 429:
-                    error_msg += ": Превышен лимит запросов"
-                return error_msg, 0
-                
-        except Exception as e:
-            return f"❌ Ошибка: {str(e)}", 0
+                text, index = item, position + 1
+            if not isinstance(text, str) or not isinstance(index, int):
+                continue
+            text = text.strip()
+            index -= 1
+            if not Config.BATCH_MIN_CHARS <= len(text) <= Config.BATCH_MAX_CHARS or text in seen:
+                continue
+            if 0 <= index < count and texts[index] is None:
+                texts[index] = text
+                seen.add(text)
+        return texts
+    
+    def _parse_response(self, response):
+        """Разбор ответа API в пару (анекдот, токены)"""
+        logging.debug(f"📊 Статус ответа: {response.status_code}")
+        upstream_responses.inc(status=str(response.status_code), model=Config.OPENROUTER_MODELS[0])
+        
+        if response.status_code == 200:
+            result = response.json()
+            joke = result['choices'][0]['message']['content'].strip()
+            tokens_used = result.get('usage', {}).get('total_tokens', 0)
+            token_budget.spend(tokens_used)
+            tokens_histogram.observe(tokens_used)
+            return joke, tokens_used
+        else:
+            return self._error_message(response.status_code), 0
+    
+    def _error_message(self, status_code):
+        """Текст ошибки API для пользователя"""
+        error_msg = f"❌ Ошибка API ({status_code})"
+        if status_code == 429:
+            error_msg += ": Превышен лимит запросов"
+        return error_msg
     
     def _build_prompt(self, theme):
         """Построение промпта"""
@@ -106,15 +417,24 @@ class OpenRouterClient:
 
 Всегда старайся создать оригинальный и смешной анекдот!"""
     
-    def generate_random_joke(self):
-        """Генерация случайного анекдота"""
-        themes = [
+    def _random_themes(self):
+        """Темы для случайных анекдотов"""
+        return [
             "программисты", "студенты", "семья", "работа", 
             "животные", "школа", "друзья", "технологии",
             "еда", "отпуск", "спорт", "музыка", "математика",
             "физика", "рыбалка", "погода", "деньги", "хобби",
             "кошки", "собаки", "путешествия", "шоппинг"
         ]
+    
+    def generate_random_joke(self):
+        """Генерация случайного анекдота"""
+        import random
+        theme = random.choice(self._random_themes())
+        return self.generate_joke(theme)
+    
+    async def generate_random_joke_async(self):
+        """Неблокирующая генерация случайного анекдота"""
         import random
-        theme = random.choice(themes)
-        return self.generate_joke(theme)
\ No newline at end of file
+        theme = random.choice(self._random_themes())
+        return await self.generate_joke_async(theme)
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+Профилирование по запросу администратора (/admin profile <секунды>).
+На время замера включаются:
+    - выборочный профиль CPU: поток раз в PROFILE_SAMPLE_INTERVAL снимает стек event loop;
+    - tracemalloc: разница снимков памяти в начале и в конце замера;
+    - отладочный режим asyncio: колбэки дольше PROFILE_SLOW_CALLBACK попадают в отчет;
+    - обертки обработчиков (@profiled): CPU и память, потраченные на шаги самого обработчика.
+Вне замера обертки стоят одну проверку флага, остальное выключено.
+Результат - отчет и стеки в формате flamegraph (collapsed) в PROFILE_DIR.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import Config
+
+class _HandlerStats:
+    """Затраты одного обработчика за замер"""
+    __slots__ = ('calls', 'errors', 'cpu', 'wall', 'allocated', 'peak')
+    
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cpu = 0.0
+        self.wall = 0.0
+        # Прирост памяти, оставшийся после шагов обработчика, и наибольший пик внутри шага
+        self.allocated = 0
+        self.peak = 0
+
+class _Measured:
+    """
+    Корутина обработчика, которую event loop продвигает по шагам через эту обертку.
+    CPU и память считаются только на шагах самого обработчика, а не других задач,
+    которые выполнялись, пока он ждал.
+    """
+    __slots__ = ('coro', 'stats')
+    
+    def __init__(self, coro, stats: _HandlerStats):
+        self.coro = coro
+        self.stats = stats
+    
+    def __await__(self):
+        stats = self.stats
+        stats.calls += 1
+        started = time.perf_counter()
+        value, error = None, None
+        try:
+            while True:
+                cpu = time.thread_time()
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                try:
+                    yielded = self.coro.throw(error) if error is not None else self.coro.send(value)
+                except StopIteration as e:
+                    return e.value
+                except BaseException:
+                    stats.errors += 1
+                    raise
+                finally:
+                    current, peak = tracemalloc.get_traced_memory()
+                    stats.cpu += time.thread_time() - cpu
+                    stats.allocated += current - memory
+                    stats.peak = max(stats.peak, peak - memory)
+                
+                try:
+                    value, error = (yield yielded), None
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            stats.wall += time.perf_counter() - started
+
+class _SlowCallbacks(logging.Handler):
+    """Сообщения asyncio о долгих колбэках ("Executing <Handle ...> took 0.123 seconds")"""
+    
+    def __init__(self, limit):
+        super().__init__(logging.WARNING)
+        self.limit = limit
+        self.records: List[str] = []
+        self.dropped = 0
+    
+    def emit(self, record):
+        message = record.getMessage()
+        if not message.startswith("Executing"):
+            return
+        if len(self.records) < self.limit:
+            self.records.append(f"{datetime.fromtimestamp(record.created):%H:%M:%S.%f} {message}")
+        else:
+            self.dropped += 1
+
+class Profiler:
+    """Один замер за раз; запускается из event loop, который профилирует"""
+    
+    def __init__(self, directory=None):
+        self.directory = directory or Config.PROFILE_DIR
+        self.active = False
+        self.handlers: Dict[str, _HandlerStats] = {}
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+    
+    def measure(self, name: str, coro):
+        """Обертка корутины обработчика для подсчета его затрат"""
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = _HandlerStats()
+        return _Measured(coro, stats)
+    
+    async def capture(self, seconds: float) -> List[str]:
+        """Замер на seconds секунд; возвращает пути файлов с результатами"""
+        if self.active:
+            raise RuntimeError("профилирование уже идет")
+        loop = asyncio.get_running_loop()
+        self.handlers = {}
+        self._stacks = Counter()
+        self._samples = 0
+        self._stop.clear()
+        
+        own_tracing = not tracemalloc.is_tracing()
+        if own_tracing:
+            tracemalloc.start(Config.PROFILE_TRACEMALLOC_FRAMES)
+        memory_before = tracemalloc.take_snapshot()
+        
+        slow = _SlowCallbacks(Config.PROFILE_TOP * 5)
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.addHandler(slow)
+        debug, slow_duration = loop.get_debug(), loop.slow_callback_duration
+        loop.set_debug(True)
+        loop.slow_callback_duration = Config.PROFILE_SLOW_CALLBACK
+        
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="profiler", daemon=True
+        )
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        self.active = True
+        sampler.start()
+        logging.info(f"🔬 Profiling for {seconds:.0f}s")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.active = False
+            self._stop.set()
+            sampler.join()
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_duration
+            asyncio_logger.removeHandler(slow)
+            memory_after = tracemalloc.take_snapshot()
+            if own_tracing:
+                tracemalloc.stop()
+        
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        # Запись файлов - в потоке, чтобы не задерживать обработку обновлений
+        return await loop.run_in_executor(
+            None, self._write, elapsed, cpu, memory_before, memory_after, slow
+        )
+    
+    def _sample(self, thread_id):
+        """Поток выборки: стек потока event loop раз в PROFILE_SAMPLE_INTERVAL"""
+        interval = Config.PROFILE_SAMPLE_INTERVAL
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self._stacks[tuple(reversed(stack))] += 1
+                self._samples += 1
+    
+    def _write(self, elapsed, cpu, memory_before, memory_after, slow) -> List[str]:
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(self.directory, f"profile-{datetime.now():%Y%m%d-%H%M%S}")
+        
+        stacks_path = f"{prefix}-stacks.txt"
+        with open(stacks_path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        
+        report_path = f"{prefix}-report.txt"
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(f"Замер: {elapsed:.1f} с, CPU процесса: {cpu:.2f} с ({cpu / elapsed:.0%}), "
+                    f"выборок стека: {self._samples}\n")
+            self._write_functions(f)
+            self._write_handlers(f)
+            self._write_memory(f, memory_before, memory_after)
+            f.write(f"\n== Колбэки дольше {Config.PROFILE_SLOW_CALLBACK * 1000:.0f} мс: "
+                    f"{len(slow.records) + slow.dropped} ==\n")
+            for line in slow.records:
+                f.write(line + "\n")
+            if slow.dropped:
+                f.write(f"... и еще {slow.dropped}\n")
+        
+        logging.info(f"🔬 Profile written to {report_path}")
+        return [report_path, stacks_path]
+    
+    def _write_functions(self, f):
+        """Функции по доле выборок: собственной (вершина стека) и общей (где-то в стеке)"""
+        own, total = Counter(), Counter()
+        for stack, count in self._stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+        samples = self._samples or 1
+        f.write("\n== CPU event loop: собственное время ==\n")
+        for name, count in own.most_common(Config.PROFILE_TOP):
+            f.write(f"{count / samples:7.1%}  {name}\n")
+        f.write("\n== CPU event loop: с вызванными функциями ==\n")
+        for name, count in total.most_common(Config.PROFILE_TOP):
+            f.write(f"{count / samples:7.1%}  {name}\n")
+    
+    def _write_handlers(self, f):
+        f.write("\n== Обработчики ==\n")
+        f.write(f"{'обработчик':<28}{'вызовов':>8}{'ошибок':>8}{'CPU мс':>10}{'CPU/выз':>10}"
+                f"{'время/выз':>11}{'память КБ':>11}{'пик КБ':>9}\n")
+        ordered = sorted(self.handlers.items(), key=lambda item: item[1].cpu, reverse=True)
+        for name, stats in ordered:
+            calls = stats.calls or 1
+            f.write(f"{name:<28}{stats.calls:>8}{stats.errors:>8}{stats.cpu * 1000:>10.1f}"
+                    f"{stats.cpu * 1000 / calls:>10.2f}{stats.wall * 1000 / calls:>11.1f}"
+                    f"{stats.allocated / 1024:>11.1f}{stats.peak / 1024:>9.1f}\n")
+    
+    def _write_memory(self, f, before, after):
+        """Строки кода с наибольшим приростом памяти за замер"""
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+        diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        grown = sum(stat.size_diff for stat in diff)
+        f.write(f"\n== Память: прирост {grown / 1024:.1f} КБ ==\n")
+        for stat in diff[:Config.PROFILE_TOP]:
+            f.write(f"{stat}\n")
+
+def profiled(name: Optional[str] = None):
+    """Декоратор обработчика: во время замера его CPU и память попадают в отчет"""
+    def decorator(handler):
+        label = name or handler.__name__
+        
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            if not profiler.active:
+                return await handler(*args, **kwargs)
+            return await profiler.measure(label, handler(*args, **kwargs))
+        return wrapper
+    return decorator
+
+# Общий профилировщик процесса
+profiler = Profiler()
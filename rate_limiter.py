@@ -0,0 +1,133 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+from config import Config
+from utils.helpers import utc_today
+
+class _UserLimits:
+    """Состояние лимитов одного пользователя"""
+    __slots__ = ('tokens', 'updated', 'day', 'count', 'dirty')
+    
+    def __init__(self, tokens, updated, day, count=0):
+        self.tokens = tokens
+        self.updated = updated
+        self.day = day
+        self.count = count
+        self.dirty = False
+
+class RateLimiter:
+    """
+    Лимиты запросов пользователей в памяти.
+    Пауза между запросами - token bucket, дневная квота - счетчик.
+    С базой синхронизируется только периодически через load()/pop_dirty();
+    pop_dirty() вызывается в потоке хранилища, поэтому состояние защищено блокировкой.
+    """
+    
+    def __init__(self, cooldown=None, daily_limit=None, burst=None, clock=time.monotonic):
+        cooldown = cooldown if cooldown is not None else Config.REQUEST_COOLDOWN
+        self.rate = 1.0 / cooldown if cooldown > 0 else float('inf')
+        self.capacity = burst if burst is not None else Config.REQUEST_BURST
+        self.daily_limit = daily_limit if daily_limit is not None else Config.MAX_REQUESTS_PER_USER
+        self.clock = clock
+        self._users: Dict[int, _UserLimits] = {}
+        self._lock = threading.Lock()
+        # Несохраненные счетчики прошедших дней
+        self._pending: List[Tuple[int, str, int]] = []
+    
+    def acquire(self, user_id: int) -> Tuple[bool, str, float]:
+        """
+        Пытается списать запрос у пользователя.
+        Возвращает (allowed, reason, retry_after), reason: "" | "cooldown" | "daily"
+        """
+        now = self.clock()
+        today = utc_today()
+        with self._lock:
+            state = self._get_state(user_id, now, today)
+            
+            if state.count >= self.daily_limit:
+                return False, "daily", 0.0
+            
+            # Пополняем ведро токенов
+            state.tokens = min(self.capacity, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            
+            if state.tokens < 1:
+                return False, "cooldown", (1 - state.tokens) / self.rate
+            
+            state.tokens -= 1
+            state.count += 1
+            state.dirty = True
+            return True, "", 0.0
+    
+    def refund(self, user_id: int):
+        """Возвращает списанный запрос, если анекдот так и не был выдан"""
+        today = utc_today()
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None or state.day != today or state.count <= 0:
+                return
+            state.count -= 1
+            state.tokens = min(self.capacity, state.tokens + 1)
+            state.dirty = True
+    
+    def remaining(self, user_id: int) -> int:
+        """Остаток дневной квоты"""
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None or state.day != utc_today():
+                return self.daily_limit
+            return max(0, self.daily_limit - state.count)
+    
+    def load(self, day: str, rows):
+        """Загрузка дневных счетчиков из базы при старте"""
+        now = self.clock()
+        with self._lock:
+            for user_id, count in rows:
+                self._users[user_id] = _UserLimits(self.capacity, now, day, count)
+    
+    def pop_dirty(self) -> List[Tuple[int, str, int]]:
+        """Измененные с прошлой синхронизации счетчики: (user_id, day, count)"""
+        today = utc_today()
+        with self._lock:
+            rows = self._pending
+            self._pending = []
+            stale = []
+            for user_id, state in self._users.items():
+                if state.dirty:
+                    rows.append((user_id, state.day, state.count))
+                    state.dirty = False
+                elif state.day != today:
+                    stale.append(user_id)
+            
+            # Пользователи без активности сегодня не занимают память
+            for user_id in stale:
+                del self._users[user_id]
+        return rows
+    
+    def restore(self, rows):
+        """Счетчики из pop_dirty(), которые не удалось записать, - ждут следующей синхронизации"""
+        with self._lock:
+            for user_id, day, count in rows:
+                state = self._users.get(user_id)
+                if state is not None and state.day == day:
+                    # В памяти счетчик того же дня не старше записываемого
+                    state.dirty = True
+                else:
+                    self._pending.append((user_id, day, count))
+    
+    def _get_state(self, user_id, now, today):
+        state = self._users.get(user_id)
+        if state is None:
+            state = _UserLimits(self.capacity, now, today)
+            self._users[user_id] = state
+        elif state.day != today:
+            # Новый день - сохраняем вчерашний счетчик и обнуляем квоту
+            if state.dirty:
+                self._pending.append((user_id, state.day, state.count))
+            state.day = today
+            state.count = 0
+            state.dirty = False
+        return state
+
+# Общий лимитер процесса
+limiter = RateLimiter()
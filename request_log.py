@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from config import Config
+from metrics import registry, stage_seconds
+
+request_log_dropped = registry.counter(
+    "anekdotych_request_log_dropped_total", "Строки журнала запросов, отброшенные из-за переполнения очереди"
+)
+
+class RequestLogWriter:
+    """
+    Отложенная (write-behind) запись запросов в базу.
+    Строки копятся в памяти и сбрасываются одной транзакцией
+    каждые batch_size строк или flush_interval секунд.
+    Пока база недоступна, очередь растет не дальше max_pending строк: самые старые отбрасываются.
+    """
+    
+    def __init__(self, db, batch_size=None, flush_interval=None, max_pending=None):
+        self.db = db
+        self.batch_size = batch_size or Config.LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.LOG_FLUSH_INTERVAL
+        self.max_pending = max_pending or Config.LOG_MAX_PENDING
+        self._rows = []
+        self._lock = None
+        self._task = None
+        self._pending_flush = None
+        
+        # Метрики
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+    
+    @property
+    def depth(self) -> int:
+        """Число строк, ожидающих записи"""
+        return len(self._rows)
+    
+    def enqueue(self, user_id, theme, joke_text, tokens_used):
+        """Ставит запрос в очередь на запись"""
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._rows.append((user_id, theme, joke_text, tokens_used, created_at))
+        self._drop_overflow()
+        
+        # Полный пакет сбрасываем сразу, не дожидаясь таймера
+        if len(self._rows) >= self.batch_size and self._task is not None:
+            if self._pending_flush is None or self._pending_flush.done():
+                self._pending_flush = asyncio.create_task(self.flush())
+    
+    async def start(self):
+        """Запуск фонового сброса"""
+        if self._task is None:
+            self._lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Остановка со сбросом остатка очереди"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending_flush is not None:
+            await asyncio.gather(self._pending_flush, return_exceptions=True)
+        await self.flush()
+    
+    async def flush(self):
+        """Записывает накопленные строки одной транзакцией"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            if not self._rows:
+                return 0
+            rows, self._rows = self._rows, []
+            
+            start = time.perf_counter()
+            try:
+                await self.db.log_requests_async(rows)
+            except Exception as e:
+                # Возвращаем строки в начало очереди до следующей попытки
+                self._rows[:0] = rows
+                self._drop_overflow()
+                self.failed_flushes += 1
+                logging.error(f"❌ Request log flush failed ({len(rows)} rows, {self.dropped_rows} dropped so far): {e}")
+                return 0
+            
+            elapsed = time.perf_counter() - start
+            stage_seconds.observe(elapsed, stage="db_flush")
+            elapsed_ms = elapsed * 1000
+            self.flush_count += 1
+            self.flushed_rows += len(rows)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            return len(rows)
+    
+    def _drop_overflow(self):
+        """Отбрасывает самые старые строки сверх max_pending"""
+        overflow = len(self._rows) - self.max_pending
+        if overflow <= 0:
+            return
+        del self._rows[:overflow]
+        self.dropped_rows += overflow
+        request_log_dropped.inc(overflow)
+    
+    def stats(self) -> dict:
+        """Метрики очереди"""
+        return {
+            "depth": self.depth,
+            "flushed_rows": self.flushed_rows,
+            "flush_count": self.flush_count,
+            "failed_flushes": self.failed_flushes,
+            "dropped_rows": self.dropped_rows,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flush_count if self.flush_count else 0.0,
+        }
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
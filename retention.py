@@ -0,0 +1,148 @@
+"""
+Хранение журнала запросов. Таблица requests держит только последние RETENTION_DAYS дней:
+более старые строки переносятся в сжатые помесячные архивы
+ARCHIVE_DIR/requests-ГГГГ-ММ.jsonl.gz, а освободившиеся страницы базы
+возвращаются через PRAGMA incremental_vacuum.
+
+Статистика (/stats, /top, /admin) считается по users и theme_stats и от архивации
+не зависит; итоги по месяцам архива лежат в таблице request_archive.
+"""
+
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+from config import Config
+from database import db
+from metrics import registry
+from services import lazy
+
+requests_archived = registry.counter(
+    "anekdotych_requests_archived_total", "Строки журнала запросов, перенесенные в архив"
+)
+
+COLUMNS = ("id", "user_id", "theme", "joke_text", "tokens_used", "created_at")
+
+class RequestArchiver:
+    """Перенос старых запросов из базы в архивные файлы"""
+    
+    def __init__(self, database, directory=None, days=None, batch=None):
+        self.db = database
+        self.directory = directory or Config.ARCHIVE_DIR
+        self.days = days if days is not None else Config.RETENTION_DAYS
+        self.batch = batch or Config.RETENTION_BATCH
+    
+    def path(self, month: str) -> str:
+        return os.path.join(self.directory, f"requests-{month}.jsonl.gz")
+    
+    def cutoff(self, now=None) -> str:
+        """Граница срока хранения в формате created_at"""
+        return ((now or datetime.utcnow()) - timedelta(days=self.days)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    def run(self, now=None) -> int:
+        """Архивирует все строки старше срока хранения и освобождает страницы; возвращает число строк"""
+        cutoff = self.cutoff(now)
+        archived = 0
+        while True:
+            count = self.archive_batch(cutoff)
+            archived += count
+            if count < self.batch:
+                break
+        self.vacuum()
+        return archived
+    
+    def archive_batch(self, cutoff: str) -> int:
+        """Переносит в архив одну порцию строк старше cutoff; возвращает их число"""
+        with self.db.engine.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {", ".join(COLUMNS)} FROM requests
+                WHERE created_at < ? ORDER BY id LIMIT ?
+            ''', (cutoff, self.batch)).fetchall()
+        if not rows:
+            return 0
+        
+        # Сначала файл, потом удаление: при сбое между ними строки попадут в архив
+        # повторно, и читатель архива пропустит дубли по id
+        months = self._write(rows)
+        with self.db.engine.connection() as conn:
+            conn.executemany('''
+                INSERT INTO request_archive (month, request_count, tokens_used, last_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (month) DO UPDATE SET
+                    request_count = request_count + excluded.request_count,
+                    tokens_used = tokens_used + excluded.tokens_used,
+                    last_id = MAX(last_id, excluded.last_id)
+            ''', [(month, count, tokens, last_id) for month, (count, tokens, last_id) in months.items()])
+            conn.executemany('DELETE FROM requests WHERE id = ?', [(row[0],) for row in rows])
+        
+        requests_archived.inc(len(rows))
+        return len(rows)
+    
+    def vacuum(self, pages=None) -> int:
+        """Возвращает системе до pages свободных страниц файла базы; возвращает их число"""
+        pages = int(pages or Config.RETENTION_VACUUM_PAGES)
+        with self.db.engine.connection() as conn:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            # Каждый шаг прагмы освобождает одну страницу - executescript выполняет ее до конца
+            conn.executescript(f'PRAGMA incremental_vacuum({pages})')
+            return free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    
+    async def run_async(self, now=None) -> int:
+        """
+        То же, что run, но каждая порция и освобождение страниц - отдельное задание
+        потока хранилища: запросы пользователей выполняются между ними, а не ждут весь архив.
+        """
+        cutoff = self.cutoff(now)
+        archived = 0
+        while True:
+            count = await self.db.engine.run(self.archive_batch, cutoff)
+            archived += count
+            if count < self.batch:
+                break
+        await self.db.engine.run(self.vacuum)
+        return archived
+    
+    def months(self) -> List[Tuple[str, int, int]]:
+        """Заархивированные месяцы: [(месяц, запросов, токенов)]"""
+        with self.db.engine.connection() as conn:
+            return conn.execute('''
+                SELECT month, request_count, tokens_used FROM request_archive ORDER BY month
+            ''').fetchall()
+    
+    def read_month(self, month: str) -> Iterator[Dict]:
+        """Запросы месяца из архива в порядке записи"""
+        path = self.path(month)
+        if not os.path.exists(path):
+            return
+        seen = set()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if row["id"] in seen:
+                    continue
+                seen.add(row["id"])
+                yield row
+    
+    def _write(self, rows):
+        """Дописывает строки в файлы их месяцев; возвращает {месяц: (строк, токенов, последний id)}"""
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row[5][:7], []).append(row)
+        
+        os.makedirs(self.directory, exist_ok=True)
+        months = {}
+        for month, month_rows in by_month.items():
+            # Каждая дозапись - отдельный член gzip, gzip.open читает их подряд
+            with open(self.path(month), "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as f:
+                    for row in month_rows:
+                        f.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False).encode("utf-8") + b"\n")
+                raw.flush()
+                os.fsync(raw.fileno())
+            months[month] = (len(month_rows), sum(row[4] or 0 for row in month_rows), month_rows[-1][0])
+        return months
+
+# Общий архиватор процесса
+request_archiver = lazy(lambda: RequestArchiver(db), "request_archiver")
@@ -0,0 +1,50 @@
+"""
+Ленивые общие сервисы процесса: объект создается при первом обращении,
+а не при импорте модуля. Так импорт бота не открывает базу и не выполняет
+запросы, пока они не понадобятся.
+"""
+
+import threading
+
+class LazyService:
+    """Заместитель сервиса: атрибуты и присваивания передаются настоящему объекту"""
+    __slots__ = ('_factory', '_instance', '_lock', '_name')
+    
+    def __init__(self, factory, name=None):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+        object.__setattr__(self, '_name', name or getattr(factory, '__name__', 'service'))
+    
+    @property
+    def created(self) -> bool:
+        """Создан ли уже настоящий объект"""
+        return self._instance is not None
+    
+    def resolve(self):
+        """Настоящий объект; создается один раз, в том числе при обращении из нескольких потоков"""
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = self._factory()
+                    object.__setattr__(self, '_instance', instance)
+        return instance
+    
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+    
+    def __bool__(self):
+        return bool(self.resolve())
+    
+    def __repr__(self):
+        state = repr(self._instance) if self.created else "not created"
+        return f"<lazy {self._name}: {state}>"
+
+def lazy(factory, name=None) -> LazyService:
+    """Общий сервис, который создается при первом обращении"""
+    return LazyService(factory, name)
@@ -0,0 +1,247 @@
+"""
+Режим шардов: фронт-процесс принимает обновления Telegram (polling или вебхук)
+и раздает их N воркерам по хешу user_id. Все обновления одного пользователя
+обрабатывает один воркер, поэтому порядок и лимиты пользователя остаются верными,
+а обработка масштабируется по ядрам.
+
+Запуск: SHARDS=4 python bot.py  или  python sharding.py --shards 4
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import zlib
+from typing import Dict, List, Optional
+from telegram.ext import BaseUpdateProcessor
+from config import Config
+
+def shard_for(user_id: int, shards: int) -> int:
+    """Номер воркера пользователя; одинаков во всех процессах и перезапусках"""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+def update_routing_key(data: dict) -> int:
+    """Ключ маршрутизации обновления: отправитель, иначе чат, иначе номер обновления"""
+    for field in ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result"):
+        payload = data.get(field)
+        if not payload:
+            continue
+        sender = payload.get("from")
+        if sender:
+            return sender["id"]
+        chat = payload.get("chat")
+        if chat:
+            return chat["id"]
+    return data.get("update_id", 0)
+
+def shard_share(items: List) -> List:
+    """Доля списка для текущего воркера; без шардов - весь список"""
+    if not Config.SHARDS:
+        return list(items)
+    return [item for position, item in enumerate(items) if position % Config.SHARDS == Config.SHARD_INDEX]
+
+class UserOrderedProcessor(BaseUpdateProcessor):
+    """
+    Обработка обновлений воркера: разные пользователи - параллельно,
+    обновления одного пользователя - строго по порядку поступления.
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # user_id -> [блокировка, обновлений в обработке и в ожидании]
+        self._users: Dict[int, list] = {}
+    
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await coroutine
+            return
+        entry = self._users.get(user.id)
+        if entry is None:
+            entry = self._users[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            try:
+                await entry[0].acquire()
+            except asyncio.CancelledError:
+                # Обработка так и не началась
+                coroutine.close()
+                raise
+            try:
+                await coroutine
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[user.id]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+def configure_worker(index: int, shards: int, overrides: Optional[Dict] = None):
+    """
+    Настройки воркера до импорта бота: общие лимиты Bot API делятся между воркерами,
+    у каждого воркера свой порт метрик.
+    """
+    Config.SHARDS = shards
+    Config.SHARD_INDEX = index
+    for name, value in (overrides or {}).items():
+        setattr(Config, name, value)
+    Config.TELEGRAM_GLOBAL_RATE = Config.TELEGRAM_GLOBAL_RATE / shards
+    if Config.METRICS_PORT:
+        Config.METRICS_PORT += index + 1
+
+def run_worker(index: int, shards: int, updates, overrides: Optional[Dict] = None):
+    """Точка входа процесса-воркера"""
+    configure_worker(index, shards, overrides)
+    logging.basicConfig(
+        format=f'%(asctime)s - shard-{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    try:
+        asyncio.run(_serve_worker(index, updates))
+    except KeyboardInterrupt:
+        pass
+
+async def _serve_worker(index, updates):
+    from telegram import Update
+    from anekdotych import AnekdotychBot
+    
+    anekdotych = AnekdotychBot()
+    application = anekdotych.application
+    await application.initialize()
+    await application.start()
+    await anekdotych.on_startup(application)
+    logging.info(f"🧩 Shard {index} ready")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # Блокирующее чтение очереди - в потоке, остаток забираем без ожидания
+            batch = [await loop.run_in_executor(None, updates.get)]
+            try:
+                while len(batch) < 100:
+                    batch.append(updates.get_nowait())
+            except queue.Empty:
+                pass
+            
+            for data in batch:
+                if data is None:
+                    return
+                await application.update_queue.put(Update.de_json(json.loads(data), application.bot))
+    finally:
+        await application.stop()
+        await anekdotych.on_shutdown(application)
+        await application.shutdown()
+
+class ShardRouter:
+    """Воркеры и их очереди во фронт-процессе"""
+    
+    def __init__(self, shards: int, overrides: Optional[Dict] = None):
+        self.shards = shards
+        self.overrides = overrides
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue(Config.SHARD_QUEUE_SIZE) for _ in range(shards)]
+        self.workers: List[Optional[multiprocessing.Process]] = [None] * shards
+        self.routed = [0] * shards
+        self.dropped = 0
+    
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+    
+    def dispatch(self, data: dict) -> bool:
+        """Кладет обновление в очередь воркера его пользователя"""
+        index = shard_for(update_routing_key(data), self.shards)
+        worker = self.workers[index]
+        if worker is None or not worker.is_alive():
+            logging.error(f"❌ Shard {index} is down, restarting")
+            self._spawn(index)
+        try:
+            self.queues[index].put_nowait(json.dumps(data))
+        except queue.Full:
+            # Воркер не успевает - лучше потерять обновление, чем остановить прием
+            self.dropped += 1
+            logging.warning(f"⚠️ Shard {index} queue is full, update {data.get('update_id')} dropped")
+            return False
+        self.routed[index] += 1
+        return True
+    
+    async def route(self, update, context):
+        """Обработчик фронт-процесса для всех обновлений"""
+        self.dispatch(update.to_dict())
+    
+    def stop(self, timeout: float = 10.0):
+        """Просит воркеры завершиться после своей очереди и ждет их"""
+        for updates in self.queues:
+            try:
+                updates.put(None, timeout=1)
+            except queue.Full:
+                pass
+        for worker in self.workers:
+            if worker is None:
+                continue
+            worker.join(timeout)
+            if worker.is_alive():
+                logging.warning(f"⚠️ {worker.name} did not stop in time, terminating")
+                worker.terminate()
+    
+    def _spawn(self, index):
+        worker = self._context.Process(
+            target=run_worker,
+            args=(index, self.shards, self.queues[index], self.overrides),
+            name=f"shard-{index}",
+        )
+        worker.start()
+        self.workers[index] = worker
+
+def main(argv=None):
+    logging.basicConfig(
+        format='%(asctime)s - front - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Анекдотыч: фронт-процесс и воркеры по user_id")
+    parser.add_argument("--shards", type=int, default=Config.SHARDS or os.cpu_count() or 1,
+                        help="Число воркеров (по умолчанию SHARDS или число ядер)")
+    args = parser.parse_args(argv)
+    Config.SHARDS = args.shards
+    os.environ["SHARDS"] = str(args.shards)
+    
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+    from bot import serve_updates
+    from database import db
+    
+    # Общий рейтинг тем собирается из базы один раз, до старта воркеров
+    db.leaderboard.owner = True
+    db.load_leaderboard()
+    db.close()
+    
+    router = ShardRouter(args.shards)
+    router.start()
+    
+    async def on_shutdown(application):
+        router.stop()
+    
+    # Фронт обрабатывает обновления по одному, чтобы сохранить порядок в очередях
+    application = (
+        Application.builder()
+        .token(Config.TELEGRAM_TOKEN)
+        .base_url(Config.TELEGRAM_API_URL)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, router.route))
+    
+    print(f"🧩 Фронт Анекдотыча: {args.shards} воркеров, режим {Config.BOT_MODE}")
+    serve_updates(application)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Деградация по SLO: контроллер следит за задержкой и ошибками OpenRouter в скользящем окне
+и при нарушении целей по шагу переводит бота в более экономные режимы,
+а когда метрики возвращаются в норму - по шагу обратно. Шаги делает health_check.
+"""
+
+import logging
+import time
+from collections import deque
+from config import Config
+from metrics import registry
+from utils.constants import POPULAR_THEMES
+from utils.helpers import normalize_theme
+
+# Режимы по возрастанию деградации; каждый включает ограничения предыдущих
+MODES = (
+    ("normal", "🟢 обычный"),
+    ("lean", "🟡 короткие ответы"),
+    ("fast", "🟠 короткие таймауты"),
+    ("stored_popular", "🟠 популярные темы из хранилища"),
+    ("stored_only", "🔴 только сохраненные анекдоты"),
+)
+LEAN, FAST, STORED_POPULAR, STORED_ONLY = 1, 2, 3, 4
+
+class SLOController:
+    """Скользящие замеры ответов OpenRouter и текущий режим деградации"""
+    
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.level = 0
+        # (время, длительность, успех)
+        self._samples = deque()
+        self.popular = frozenset(normalize_theme(theme) for theme in POPULAR_THEMES)
+        self.changed_at = clock()
+        self.transitions = 0
+    
+    @property
+    def mode(self) -> str:
+        return MODES[self.level][0]
+    
+    @property
+    def title(self) -> str:
+        return MODES[self.level][1]
+    
+    def observe(self, seconds: float, ok: bool):
+        """Ответ OpenRouter: полный для обычного запроса, до первого фрагмента - для потока"""
+        self._samples.append((self.clock(), seconds, ok))
+    
+    def health(self):
+        """(p95 задержки успешных ответов или None, доля ошибок, число замеров) за окно"""
+        horizon = self.clock() - Config.SLO_WINDOW
+        while self._samples and self._samples[0][0] < horizon:
+            self._samples.popleft()
+        if not self._samples:
+            return None, 0.0, 0
+        latencies = sorted(seconds for _, seconds, ok in self._samples if ok)
+        errors = sum(1 for _, _, ok in self._samples if not ok)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+        return p95, errors / len(self._samples), len(self._samples)
+    
+    def evaluate(self) -> str:
+        """Шаг режима по замерам окна: на один уровень вверх при нарушении SLO, вниз - при запасе"""
+        p95, error_rate, samples = self.health()
+        if samples < Config.SLO_MIN_SAMPLES:
+            return self.mode
+        
+        breached = error_rate > Config.SLO_ERROR_RATE or (p95 or 0) > Config.SLO_LATENCY_P95
+        healthy = (error_rate <= Config.SLO_ERROR_RATE * Config.SLO_RECOVERY_MARGIN
+                   and (p95 or 0) <= Config.SLO_LATENCY_P95 * Config.SLO_RECOVERY_MARGIN)
+        if breached and self.level < len(MODES) - 1:
+            self._set(self.level + 1, p95, error_rate)
+        elif healthy and self.level > 0:
+            self._set(self.level - 1, p95, error_rate)
+        return self.mode
+    
+    def needs_probe(self) -> bool:
+        """В деградации живых запросов мало - health_check делает пробный, чтобы заметить восстановление"""
+        return self.level > 0 and self.health()[2] < Config.SLO_MIN_SAMPLES
+    
+    def max_tokens(self, base: int) -> int:
+        if self.level >= LEAN:
+            return max(1, int(base * Config.SLO_LEAN_TOKENS))
+        return base
+    
+    def timeout(self) -> float:
+        """Таймаут одного запроса к OpenRouter"""
+        return Config.SLO_FAST_TIMEOUT if self.level >= FAST else Config.OPENROUTER_TIMEOUT
+    
+    def deadline(self) -> float:
+        """Общее время генерации со всеми повторами"""
+        return Config.SLO_FAST_DEADLINE if self.level >= FAST else Config.GENERATION_DEADLINE
+    
+    def serve_stored(self, theme_key: str) -> bool:
+        """Отдавать ли тему из хранилища (даже повтором) вместо генерации"""
+        if self.level >= STORED_ONLY:
+            return True
+        return self.level >= STORED_POPULAR and theme_key in self.popular
+    
+    def allow_live(self) -> bool:
+        """Разрешена ли живая генерация для запросов пользователей"""
+        return self.level < STORED_ONLY
+    
+    def stats(self) -> dict:
+        p95, error_rate, samples = self.health()
+        return {
+            "mode": self.mode,
+            "title": self.title,
+            "level": self.level,
+            "p95": p95,
+            "error_rate": error_rate,
+            "samples": samples,
+            "transitions": self.transitions,
+            "since": self.clock() - self.changed_at,
+        }
+    
+    def _set(self, level, p95, error_rate):
+        previous = self.title
+        self.level = level
+        self.changed_at = self.clock()
+        self.transitions += 1
+        latency = f"{p95:.1f}s" if p95 is not None else "n/a"
+        log = logging.warning if level else logging.info
+        log(f"🩺 Degradation mode: {previous} -> {self.title} (p95 {latency}, errors {error_rate:.0%})")
+
+# Общий контроллер процесса
+slo_controller = SLOController()
+
+registry.gauge("anekdotych_degradation_level", "Уровень деградации (0 - обычный режим)", lambda: slo_controller.level)
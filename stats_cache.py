@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+from config import Config
+
+class _UserStats:
+    """Статистика пользователя в кэше"""
+    __slots__ = ('request_count', 'last_request')
+    
+    def __init__(self, request_count, last_request):
+        self.request_count = request_count
+        self.last_request = last_request
+
+class StatsCache:
+    """
+    Кэш статистики для /stats и /admin поверх базы.
+    Записи пользователей вытесняются по LRU, общие счетчики и множество активных дней
+    загружаются из базы один раз и дальше обновляются при записи запросов
+    (раз в STATS_GLOBAL_TTL перечитываются - в режиме шардов пишут и другие процессы).
+    Все методы вызываются из потока хранилища, поэтому блокировки не нужны.
+    """
+    
+    def __init__(self, max_users=None, global_ttl=None, clock=time.monotonic):
+        self.max_users = max_users or Config.STATS_CACHE_USERS
+        self.global_ttl = global_ttl or Config.STATS_GLOBAL_TTL
+        self.clock = clock
+        self._users: "OrderedDict[int, _UserStats]" = OrderedDict()
+        self.total_users = 0
+        self.total_requests = 0
+        self._days = set()
+        self._loaded_at = None
+        
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def active_days(self) -> int:
+        return len(self._days)
+    
+    def get_user(self, user_id) -> Optional[Tuple[int, str]]:
+        record = self._users.get(user_id)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._users.move_to_end(user_id)
+        return record.request_count, record.last_request
+    
+    def put_user(self, user_id, request_count, last_request):
+        self._users[user_id] = _UserStats(request_count, last_request)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+    
+    def global_stats(self) -> Optional[Tuple[int, int, int]]:
+        """(пользователей, запросов, активных дней) или None, если пора перечитать из базы"""
+        if self._loaded_at is None or self.clock() - self._loaded_at > self.global_ttl:
+            return None
+        return self.total_users, self.total_requests, self.active_days
+    
+    def load_global(self, total_users, total_requests, days: Iterable[str]):
+        self.total_users = total_users or 0
+        self.total_requests = total_requests or 0
+        self._days = set(days)
+        self._loaded_at = self.clock()
+    
+    def users_added(self, count: int):
+        self.total_users += count
+    
+    def requests_logged(self, counters, days: Iterable[str]):
+        """Записанные запросы: counters {user_id: (запросов, последний запрос)}"""
+        for user_id, (count, last_request) in counters.items():
+            self.total_requests += count
+            record = self._users.get(user_id)
+            if record is not None:
+                record.request_count += count
+                record.last_request = max(record.last_request or last_request, last_request)
+        self._days.update(days)
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
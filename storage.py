@@ -0,0 +1,73 @@
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+# Настройки SQLite для одного долгоживущего соединения
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA busy_timeout=5000",
+)
+
+class StorageEngine:
+    """
+    Общее хранилище: одно соединение SQLite в режиме WAL
+    и выделенный поток, в котором выполняются запросы из event loop.
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.initialized = False
+        self._conn = None
+        self._lock = threading.RLock()
+        self._executor = None
+    
+    @contextmanager
+    def connection(self):
+        """Соединение под блокировкой; транзакция фиксируется при выходе"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                yield conn
+    
+    async def run(self, func, *args, **kwargs):
+        """Выполняет синхронную функцию базы в потоке хранилища"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+    
+    def close(self):
+        """Закрытие соединения и потока"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                self._conn.execute(pragma)
+        return self._conn
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(db_path) -> StorageEngine:
+    """Единственный экземпляр хранилища на файл базы"""
+    with _engines_lock:
+        engine = _engines.get(db_path)
+        if engine is None:
+            engine = StorageEngine(db_path)
+            _engines[db_path] = engine
+        return engine
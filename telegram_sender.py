@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Dict
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from config import Config
+from metrics import registry, telegram_send_seconds, telegram_send_failures
+
+telegram_queue_wait = registry.histogram(
+    "anekdotych_telegram_queue_wait_seconds", "Ожидание сообщения в очереди отправки"
+)
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst подряд"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'clock')
+    
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.updated = clock()
+    
+    def delay(self) -> float:
+        """Через сколько секунд появится токен (0 - уже есть)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+    
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+    
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class _Outgoing:
+    """Сообщение в очереди отправки"""
+    __slots__ = ('method', 'call', 'text', 'mergeable', 'reply_to', 'future', 'attempts', 'queued_at')
+    
+    def __init__(self, method, call, text, mergeable, future, queued_at, reply_to=None):
+        self.method = method
+        # call(text) -> корутина запроса к Bot API
+        self.call = call
+        self.text = text
+        self.mergeable = mergeable
+        # Сообщение, на которое отвечаем: склеиваются только ответы на одно и то же
+        self.reply_to = reply_to
+        self.future = future
+        self.attempts = 0
+        self.queued_at = queued_at
+
+class _Chat:
+    """Очередь и лимит одного чата"""
+    __slots__ = ('items', 'bucket', 'blocked_until', 'busy', 'queued', 'timer')
+    
+    def __init__(self, bucket):
+        self.items = deque()
+        self.bucket = bucket
+        self.blocked_until = 0.0
+        # Сообщение чата в полете - следующее ждет, чтобы сохранить порядок
+        self.busy = False
+        # Чат уже стоит в очереди готовых или ждет таймера
+        self.queued = False
+        self.timer = None
+
+class TelegramSender:
+    """
+    Планировщик исходящих сообщений: очередь на каждый чат, общее ведро токенов
+    на бота (Telegram допускает около 30 сообщений в секунду) и ведро на чат.
+    Чаты обслуживаются по кругу, RetryAfter приостанавливает чат на указанное время,
+    сетевые ошибки повторяются с экспоненциальной задержкой и разбросом.
+    Подряд идущие короткие сообщения в один чат склеиваются в одно.
+    """
+    
+    def __init__(self, rate=None, chat_rate=None, chat_burst=None, max_retries=None, clock=time.monotonic):
+        self.rate = rate
+        self.chat_rate = chat_rate or Config.TELEGRAM_CHAT_RATE
+        self.chat_burst = chat_burst or Config.TELEGRAM_CHAT_BURST
+        self.max_retries = max_retries or Config.TELEGRAM_SEND_RETRIES
+        self.clock = clock
+        self._bucket = None
+        self._chats: Dict[int, _Chat] = {}
+        self._ready = deque()
+        self._wakeup = None
+        self._task = None
+        self._deliveries = set()
+        
+        # Метрики
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.throttled = 0
+        self.failed = 0
+    
+    @property
+    def bucket(self) -> TokenBucket:
+        """
+        Общее ведро бота. Создается при первой отправке: воркер шарда получает
+        свою долю TELEGRAM_GLOBAL_RATE в configure_worker, уже после импорта модуля.
+        """
+        if self._bucket is None:
+            rate = self.rate or Config.TELEGRAM_GLOBAL_RATE
+            self._bucket = TokenBucket(rate, rate, self.clock)
+        return self._bucket
+    
+    @property
+    def depth(self) -> int:
+        """Сообщения, ожидающие отправки"""
+        return sum(len(chat.items) for chat in self._chats.values())
+    
+    async def send_message(self, bot, chat_id: int, text: str, mergeable: bool = True,
+                           reply_to_message_id: int = None):
+        """
+        Отправка сообщения через очередь; возвращает Message.
+        mergeable=False - сообщение нельзя склеивать (например, заглушку, которую потом правят)
+        reply_to_message_id - отправить ответом на сообщение чата
+        """
+        return await self._enqueue(
+            chat_id, "sendMessage",
+            lambda text: bot.send_message(chat_id, text, reply_to_message_id=reply_to_message_id),
+            text, mergeable, reply_to_message_id
+        )
+    
+    async def edit_message(self, message, text: str):
+        """Правка отправленного сообщения через очередь его чата"""
+        return await self._enqueue(message.chat_id, "editMessageText", message.edit_text, text, False)
+    
+    async def edit_inline_message(self, bot, inline_message_id: str, text: str):
+        """Правка сообщения, отправленного через инлайн-режим; у него нет чата, очередь - по его id"""
+        return await self._enqueue(
+            inline_message_id, "editMessageText",
+            lambda text: bot.edit_message_text(text, inline_message_id=inline_message_id), text, False
+        )
+    
+    def try_acquire(self, chat_id: int) -> bool:
+        """
+        Место для необязательной отправки (промежуточной правки потока):
+        True, только если очередь чата пуста и в обоих лимитах есть запас.
+        """
+        chat = self._chats.get(chat_id)
+        if chat and (chat.items or chat.busy or chat.blocked_until > self.clock() or chat.bucket.delay() > 0):
+            return False
+        if self.bucket.delay() > 0:
+            return False
+        self.bucket.take()
+        self._chat(chat_id).bucket.take()
+        return True
+    
+    def stats(self) -> dict:
+        """Метрики очереди отправки"""
+        return {
+            "depth": self.depth,
+            "chats": sum(1 for chat in self._chats.values() if chat.items),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "failed": self.failed,
+        }
+    
+    async def stop(self, timeout: float = 5.0):
+        """Дожидается отправки очереди и останавливает планировщик"""
+        deadline = self.clock() + timeout
+        while (self.depth or self._deliveries) and self.clock() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for chat in self._chats.values():
+            if chat.timer:
+                chat.timer.cancel()
+            for item in chat.items:
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("Telegram sender stopped"))
+        self._chats.clear()
+        self._ready.clear()
+    
+    async def _enqueue(self, chat_id, method, call, text, mergeable, reply_to=None):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        chat = self._chat(chat_id)
+        chat.items.append(_Outgoing(method, call, text, mergeable, future, self.clock(), reply_to))
+        self._mark_ready(chat_id, chat)
+        return await future
+    
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    def _chat(self, chat_id) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= Config.TELEGRAM_TRACKED_CHATS:
+                self._forget_idle()
+            chat = _Chat(TokenBucket(self.chat_rate, self.chat_burst, self.clock))
+            self._chats[chat_id] = chat
+        return chat
+    
+    def _mark_ready(self, chat_id, chat):
+        if chat.queued or chat.busy or not chat.items:
+            return
+        chat.queued = True
+        self._ready.append(chat_id)
+        self._wakeup.set()
+    
+    def _wake_later(self, chat_id, chat, delay):
+        """Чат ждет своего лимита - возвращаем его в круг по таймеру"""
+        def wake():
+            chat.timer = None
+            chat.queued = False
+            self._mark_ready(chat_id, chat)
+        
+        chat.timer = asyncio.get_running_loop().call_later(delay, wake)
+    
+    async def _run(self):
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            chat_id = self._ready.popleft()
+            chat = self._chats.get(chat_id)
+            if chat is None or not chat.items:
+                if chat:
+                    chat.queued = False
+                continue
+            
+            wait = max(chat.blocked_until - self.clock(), chat.bucket.delay())
+            if wait > 0:
+                self._wake_later(chat_id, chat, wait)
+                continue
+            
+            global_wait = self.bucket.delay()
+            if global_wait > 0:
+                self._ready.appendleft(chat_id)
+                await asyncio.sleep(global_wait)
+                continue
+            
+            chat.queued = False
+            self.bucket.take()
+            chat.bucket.take()
+            chat.busy = True
+            task = asyncio.create_task(self._deliver(chat_id, chat, self._take(chat)))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+    
+    def _take(self, chat):
+        """Первое сообщение чата и склеенные с ним следующие"""
+        items = [chat.items.popleft()]
+        if not items[0].mergeable:
+            return items
+        length = len(items[0].text)
+        while chat.items and chat.items[0].mergeable and chat.items[0].reply_to == items[0].reply_to:
+            length += 2 + len(chat.items[0].text)
+            if length > Config.MAX_MESSAGE_LENGTH:
+                break
+            items.append(chat.items.popleft())
+        self.merged += len(items) - 1
+        return items
+    
+    async def _deliver(self, chat_id, chat, items):
+        head = items[0]
+        head.attempts += 1
+        if head.attempts == 1:
+            now = self.clock()
+            for item in items:
+                telegram_queue_wait.observe(now - item.queued_at)
+        
+        try:
+            with telegram_send_seconds.time(method=head.method, attempt=str(head.attempts)):
+                result = await head.call("\n\n".join(item.text for item in items))
+        except RetryAfter as e:
+            telegram_send_failures.inc(method=head.method)
+            self.throttled += 1
+            logging.warning(f"Telegram flood control for chat {chat_id}: retry in {e.retry_after}s")
+            chat.blocked_until = self.clock() + e.retry_after
+            chat.items.extendleft(reversed(items))
+        except BadRequest as e:
+            # Текст уже совпадает - править нечего
+            if "not modified" in str(e).lower():
+                self._resolve(items, None)
+            else:
+                telegram_send_failures.inc(method=head.method)
+                self._fail(items, e)
+        except Forbidden as e:
+            # Пользователь заблокировал бота - повторять бессмысленно
+            telegram_send_failures.inc(method=head.method)
+            self._fail(items, e)
+        except Exception as e:
+            telegram_send_failures.inc(method=head.method)
+            if head.attempts >= self.max_retries:
+                logging.error(f"Failed to {head.method} after {head.attempts} attempts: {e}")
+                self._fail(items, e)
+            else:
+                delay = min(Config.TELEGRAM_BACKOFF_MAX, Config.TELEGRAM_BACKOFF_BASE * 2 ** (head.attempts - 1))
+                delay *= random.uniform(0.5, 1.5)
+                logging.warning(f"{head.method} attempt {head.attempts} failed, retrying in {delay:.1f}s: {e}")
+                self.retried += 1
+                chat.blocked_until = self.clock() + delay
+                chat.items.extendleft(reversed(items))
+        else:
+            self.sent += 1
+            self._resolve(items, result)
+        finally:
+            chat.busy = False
+            self._mark_ready(chat_id, chat)
+    
+    def _resolve(self, items, result):
+        for item in items:
+            if not item.future.done():
+                item.future.set_result(result)
+    
+    def _fail(self, items, error):
+        self.failed += 1
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error)
+    
+    def _forget_idle(self):
+        """Удаляет чаты без сообщений, чей лимит уже восстановился"""
+        idle = [
+            chat_id for chat_id, chat in self._chats.items()
+            if not chat.items and not chat.busy and not chat.queued and chat.bucket.full
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+# Общий планировщик процесса
+telegram_sender = TelegramSender()
+
+registry.gauge("anekdotych_telegram_queue_depth", "Сообщения в очереди отправки", lambda: telegram_sender.depth)
+registry.gauge(
+    "anekdotych_telegram_queue_chats", "Чаты с сообщениями в очереди", lambda: telegram_sender.stats()["chats"]
+)
@@ -0,0 +1,126 @@
+"""Планировщик генераций: порядок выдачи мест по весам классов и по кругу пользователей"""
+
+import asyncio
+from generation_scheduler import GenerationScheduler
+
+WEIGHTS = {"admin": 4, "command": 2, "text": 1}
+
+async def grant_order(scheduler, requests):
+    """
+    Ставит заявки (имя, user_id, класс) в очередь за занятым местом
+    и возвращает имена в порядке, в котором им досталось место.
+    """
+    order = []
+    release = asyncio.Event()
+    
+    async def hold():
+        async with scheduler.slot(0, "text"):
+            await release.wait()
+    
+    async def request(name, user_id, priority):
+        async with scheduler.slot(user_id, priority):
+            order.append(name)
+    
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    tasks = []
+    for name, user_id, priority in requests:
+        tasks.append(asyncio.create_task(request(name, user_id, priority)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+def test_round_robin_between_users_of_one_class():
+    scheduler = GenerationScheduler(limit=1, weights=WEIGHTS)
+    requests = [("a1", 1, "text"), ("a2", 1, "text"), ("a3", 1, "text"), ("b1", 2, "text"), ("c1", 3, "text")]
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+def test_classes_share_slots_by_weight():
+    scheduler = GenerationScheduler(limit=1, weights=WEIGHTS)
+    requests = (
+        [(f"t{i}", 100 + i, "text") for i in range(1, 5)]
+        + [(f"c{i}", 200 + i, "command") for i in range(1, 5)]
+        + [(f"a{i}", 300 + i, "admin") for i in range(1, 6)]
+    )
+    order = asyncio.run(grant_order(scheduler, requests))
+    # За раунд: 4 места администраторам, 2 командам, 1 тексту - старшие классы первыми
+    assert order == ["a1", "a2", "a3", "a4", "c1", "c2", "t1", "a5", "c3", "c4", "t2", "t3", "t4"]
+
+def test_text_is_not_starved_by_commands():
+    scheduler = GenerationScheduler(limit=1, weights=WEIGHTS)
+    requests = [("t1", 1, "text")] + [(f"c{i}", 10 + i, "command") for i in range(1, 7)]
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order.index("t1") == 2
+
+def test_unknown_class_is_treated_as_text():
+    scheduler = GenerationScheduler(limit=1, weights=WEIGHTS)
+    requests = [("t1", 1, "text"), ("x1", 2, "bogus"), ("c1", 3, "command")]
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order == ["c1", "t1", "x1"]
+
+def test_position_predicts_grant_order():
+    async def run():
+        scheduler = GenerationScheduler(limit=1, weights=WEIGHTS)
+        positions = {}
+        release = asyncio.Event()
+        
+        async def hold():
+            async with scheduler.slot(0, "text"):
+                await release.wait()
+        
+        async def request(name, user_id, priority):
+            async def on_position(position):
+                positions.setdefault(name, position)
+            async with scheduler.slot(user_id, priority, on_position):
+                pass
+        
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        tasks = []
+        for name, user_id, priority in [("t1", 1, "text"), ("t2", 2, "text"), ("c1", 3, "command"), ("a1", 4, "admin")]:
+            tasks.append(asyncio.create_task(request(name, user_id, priority)))
+            await asyncio.sleep(0)
+        # Позиция на момент постановки: каждая следующая заявка старшего класса встает впереди
+        assert positions == {"t1": 1, "t2": 2, "c1": 1, "a1": 1}
+        waiting = [("admin", 4), ("command", 3), ("text", 1), ("text", 2)]
+        tickets = [scheduler._classes[priority].flows[user_id][0] for priority, user_id in waiting]
+        assert [scheduler.position(ticket) for ticket in tickets] == [1, 2, 3, 4]
+        release.set()
+        await asyncio.gather(holder, *tasks)
+    
+    asyncio.run(run())
+
+def test_cancelled_request_leaves_queue():
+    async def run():
+        scheduler = GenerationScheduler(limit=1, weights=WEIGHTS)
+        order = []
+        release = asyncio.Event()
+        
+        async def hold():
+            async with scheduler.slot(0, "text"):
+                await release.wait()
+        
+        async def request(name, user_id):
+            async with scheduler.slot(user_id, "text"):
+                order.append(name)
+        
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        first = asyncio.create_task(request("first", 1))
+        second = asyncio.create_task(request("second", 2))
+        await asyncio.sleep(0)
+        assert scheduler.depth == 2
+        
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert scheduler.depth == 1
+        
+        release.set()
+        await asyncio.gather(holder, second)
+        assert order == ["second"]
+        stats = scheduler.stats()
+        assert (stats["active"], stats["depth"], stats["cancelled"]) == (0, 0, 1)
+    
+    asyncio.run(run())
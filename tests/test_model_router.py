@@ -0,0 +1,155 @@
+"""Предохранитель моделей (открыт, полуоткрыт, закрыт) и хеджирование запросов"""
+
+import asyncio
+from config import Config
+from model_router import CircuitBreaker, ModelRouter
+from openrouter_client import UpstreamError
+
+class FakeClock:
+    """Часы, которые двигаются только вручную"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+class FakeClient:
+    """Клиент OpenRouter: у каждой модели своя задержка ответа или ошибка"""
+    
+    def __init__(self, delays=None, errors=None):
+        self.delays = delays or {}
+        self.errors = errors or {}
+        self.calls = []
+        self.cancelled = []
+    
+    async def complete(self, theme, model):
+        self.calls.append(model)
+        try:
+            await asyncio.sleep(self.delays.get(model, 0))
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if model in self.errors:
+            raise self.errors[model]
+        return f"анекдот от {model}", 10
+    
+    def error_text(self, error):
+        return f"❌ Ошибка: {error}"
+
+def make_breaker():
+    clock = FakeClock()
+    return CircuitBreaker(failure_threshold=2, open_seconds=30, throttle_seconds=60, clock=clock), clock
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker, clock = make_breaker()
+    assert not breaker.record_failure(UpstreamError(500))
+    assert breaker.state == "closed"
+    assert breaker.record_failure(UpstreamError(500))
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_success_resets_failure_count():
+    breaker, clock = make_breaker()
+    breaker.record_failure(UpstreamError(500))
+    breaker.record_success()
+    assert not breaker.record_failure(UpstreamError(500))
+    assert breaker.state == "closed"
+
+def test_throttling_opens_for_retry_after():
+    breaker, clock = make_breaker()
+    assert breaker.record_failure(UpstreamError(429, retry_after=5))
+    assert breaker.state == "open"
+    clock.now += 5
+    assert breaker.state == "half_open"
+    
+    breaker, clock = make_breaker()
+    breaker.record_failure(UpstreamError(429))
+    clock.now += 59
+    assert breaker.state == "open"
+
+def test_half_open_allows_single_probe():
+    breaker, clock = make_breaker()
+    breaker.record_failure(UpstreamError(500))
+    breaker.record_failure(UpstreamError(500))
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    
+    # Отмененный пробный запрос освобождает место для следующего
+    breaker.release()
+    assert breaker.allow()
+
+def test_successful_probe_closes_breaker():
+    breaker, clock = make_breaker()
+    breaker.record_failure(UpstreamError(500))
+    breaker.record_failure(UpstreamError(500))
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+def test_failed_probe_reopens_breaker():
+    breaker, clock = make_breaker()
+    breaker.record_failure(UpstreamError(500))
+    breaker.record_failure(UpstreamError(500))
+    clock.now += 30
+    assert breaker.allow()
+    # В полуоткрытом состоянии хватает одной ошибки
+    assert breaker.record_failure(UpstreamError(500))
+    assert breaker.state == "open"
+    clock.now += 30
+    assert breaker.state == "half_open"
+
+def make_router(monkeypatch, client, models=("a", "b")):
+    monkeypatch.setattr(Config, "HEDGE_DEFAULT_DELAY", 0.05)
+    monkeypatch.setattr(Config, "HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(Config, "GENERATION_DEADLINE", 2)
+    return ModelRouter(client, models=list(models))
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    client = FakeClient()
+    router = make_router(monkeypatch, client)
+    joke, tokens = asyncio.run(router.generate_joke_async("кот"))
+    assert joke == "анекдот от a"
+    assert client.calls == ["a"]
+    assert router.stats()["hedges"] == 0
+
+def test_slow_primary_is_hedged_and_loser_cancelled(monkeypatch):
+    client = FakeClient(delays={"a": 1.0, "b": 0.0})
+    router = make_router(monkeypatch, client)
+    joke, tokens = asyncio.run(router.generate_joke_async("кот"))
+    assert joke == "анекдот от b"
+    assert client.calls == ["a", "b"]
+    assert client.cancelled == ["a"]
+    stats = router.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+    # Отмененный запрос не считается ошибкой модели
+    assert stats["breakers"] == {"a": "closed", "b": "closed"}
+
+def test_fast_failure_falls_back_to_next_model(monkeypatch):
+    client = FakeClient(errors={"a": UpstreamError(500)})
+    router = make_router(monkeypatch, client)
+    joke, tokens = asyncio.run(router.generate_joke_async("кот"))
+    assert joke == "анекдот от b"
+    assert router.stats()["fallbacks"] == 1
+
+def test_open_breaker_skips_model(monkeypatch):
+    client = FakeClient(errors={"a": UpstreamError(429, retry_after=60)})
+    router = make_router(monkeypatch, client)
+    asyncio.run(router.generate_joke_async("кот"))
+    assert router.stats()["breakers"]["a"] == "open"
+    
+    client.calls.clear()
+    joke, tokens = asyncio.run(router.generate_joke_async("кот"))
+    assert joke == "анекдот от b"
+    assert client.calls == ["b"]
+
+def test_all_models_failing_returns_error_text(monkeypatch):
+    client = FakeClient(errors={"a": UpstreamError(500), "b": UpstreamError(502)})
+    router = make_router(monkeypatch, client)
+    joke, tokens = asyncio.run(router.generate_joke_async("кот"))
+    assert joke.startswith("❌")
+    assert tokens == 0
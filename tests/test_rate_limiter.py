@@ -0,0 +1,108 @@
+"""Лимитер запросов: пополнение ведра, возврат запроса и смена дня по UTC"""
+
+import rate_limiter
+from rate_limiter import RateLimiter
+
+class FakeClock:
+    """Часы, которые двигаются только вручную"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+def make_limiter(monkeypatch, day="2026-01-01", **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "utc_today", lambda: day)
+    options = dict(cooldown=10, daily_limit=3, burst=1, clock=clock)
+    options.update(kwargs)
+    return RateLimiter(**options), clock
+
+def test_cooldown_refills_over_time(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    assert limiter.acquire(1) == (True, "", 0.0)
+    
+    allowed, reason, retry_after = limiter.acquire(1)
+    assert (allowed, reason) == (False, "cooldown")
+    assert retry_after == 10
+    
+    clock.now += 4
+    allowed, reason, retry_after = limiter.acquire(1)
+    assert (allowed, reason) == (False, "cooldown")
+    assert abs(retry_after - 6) < 1e-9
+    
+    clock.now += 6
+    assert limiter.acquire(1)[0]
+
+def test_burst_caps_refill(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch, burst=2, daily_limit=10)
+    clock.now += 1000
+    assert limiter.acquire(1)[0]
+    assert limiter.acquire(1)[0]
+    assert limiter.acquire(1)[1] == "cooldown"
+
+def test_daily_limit(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    for _ in range(3):
+        assert limiter.acquire(1)[0]
+        clock.now += 10
+    assert limiter.acquire(1) == (False, "daily", 0.0)
+    assert limiter.remaining(1) == 0
+
+def test_refund_returns_quota_and_token(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    assert limiter.acquire(1)[0]
+    assert limiter.remaining(1) == 2
+    
+    limiter.refund(1)
+    assert limiter.remaining(1) == 3
+    # Возвращенный токен позволяет повторить запрос без паузы
+    assert limiter.acquire(1)[0]
+    assert limiter.pop_dirty() == [(1, "2026-01-01", 1)]
+
+def test_refund_never_goes_below_zero(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    limiter.refund(1)
+    assert limiter.acquire(1)[0]
+    limiter.refund(1)
+    limiter.refund(1)
+    assert limiter.remaining(1) == 3
+
+def test_refund_after_day_change_is_ignored(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    assert limiter.acquire(1)[0]
+    
+    monkeypatch.setattr(rate_limiter, "utc_today", lambda: "2026-01-02")
+    limiter.refund(1)
+    assert limiter.pop_dirty() == [(1, "2026-01-01", 1)]
+
+def test_utc_day_rollover_resets_quota(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    for _ in range(3):
+        assert limiter.acquire(1)[0]
+        clock.now += 10
+    assert limiter.acquire(1)[1] == "daily"
+    
+    monkeypatch.setattr(rate_limiter, "utc_today", lambda: "2026-01-02")
+    assert limiter.remaining(1) == 3
+    assert limiter.acquire(1)[0]
+    # Вчерашний счетчик не теряется - он уходит в синхронизацию отдельной строкой
+    assert sorted(limiter.pop_dirty()) == [(1, "2026-01-01", 3), (1, "2026-01-02", 1)]
+
+def test_idle_users_are_dropped_after_rollover(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    assert limiter.acquire(1)[0]
+    assert limiter.pop_dirty() == [(1, "2026-01-01", 1)]
+    
+    monkeypatch.setattr(rate_limiter, "utc_today", lambda: "2026-01-02")
+    assert limiter.pop_dirty() == []
+    assert 1 not in limiter._users
+
+def test_restore_keeps_unsaved_counters(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    assert limiter.acquire(1)[0]
+    rows = limiter.pop_dirty()
+    
+    limiter.restore(rows)
+    assert limiter.pop_dirty() == rows
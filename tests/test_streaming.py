@@ -0,0 +1,60 @@
+"""Потоковая генерация против локальной заглушки SSE: правки заглушки идут не чаще интервала"""
+
+import asyncio
+import time
+from benchmarks.fake_servers import FakeOpenRouterServer, JOKE_TEXT
+from handlers.messages import StreamingReply
+from openrouter_client import OpenRouterClient
+
+INTERVAL = 0.3
+
+class FakeMessage:
+    """Сообщение-заглушка: запоминает время и текст каждой правки"""
+    
+    def __init__(self, chat_id=1, text="🎭 Генерирую анекдот..."):
+        self.chat_id = chat_id
+        self.text = text
+        self.edits = []
+    
+    async def edit_text(self, text):
+        self.edits.append((time.monotonic(), text))
+
+def stream_joke(message, token_delay=0.05):
+    server = FakeOpenRouterServer(latency=0.0, jitter=0.0, token_delay=token_delay).start()
+    client = OpenRouterClient()
+    client.api_url = server.url
+    reply = StreamingReply(message, interval=INTERVAL)
+    
+    async def run():
+        try:
+            return await client.stream("программисты", reply.update)
+        finally:
+            await client.aclose()
+    try:
+        return asyncio.run(run()), server
+    finally:
+        server.stop()
+
+def test_stream_returns_full_joke():
+    (joke, tokens_used), server = stream_joke(FakeMessage())
+    assert joke == JOKE_TEXT
+    assert tokens_used > 0
+    assert server.requests == 1
+
+def test_placeholder_edits_are_throttled():
+    message = FakeMessage()
+    started = time.monotonic()
+    stream_joke(message)
+    elapsed = time.monotonic() - started
+    
+    words = len(JOKE_TEXT.split(" "))
+    times = [at for at, _ in message.edits]
+    assert times, "промежуточных правок не было"
+    # Событий SSE по слову, правок - не больше одной за интервал
+    assert len(times) < words
+    assert len(times) <= elapsed / INTERVAL + 1
+    assert all(later - earlier >= INTERVAL for earlier, later in zip(times, times[1:]))
+    # Промежуточный текст помечен курсором и растет
+    assert all(text.endswith(" ▌") for _, text in message.edits)
+    lengths = [len(text) for _, text in message.edits]
+    assert lengths == sorted(lengths)
@@ -0,0 +1,168 @@
+"""
+Учет токенов OpenRouter за день: общий расход всех генераций (включая пул, пакеты
+и запасные запросы) и токены показанных анекдотов по пользователям и темам.
+Счетчики ведутся в памяти приращениями, общий расход периодически сводится
+через таблицу token_usage, поэтому дневной бюджет общий для всех процессов.
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from metrics import registry
+from utils.helpers import utc_today
+
+class TokenBudget:
+    """Дневные счетчики токенов и проверка общего бюджета на пути лимитера"""
+    
+    def __init__(self, daily_budget=None, today=utc_today):
+        self.daily_budget = daily_budget if daily_budget is not None else Config.DAILY_TOKEN_BUDGET
+        self.today = today
+        self.day = today()
+        self._lock = threading.Lock()
+        # Общий расход: сведенный из базы плюс локальный с прошлой синхронизации
+        self.spent = 0
+        self.generations = 0
+        self._pending = 0
+        self._pending_generations = 0
+        # Несведенный расход прошедших дней: [(день, токены, генерации)]
+        self._carry: List[Tuple[str, int, int]] = []
+        # Показанные анекдоты
+        self.users: Dict[int, int] = {}
+        self.themes: Dict[str, int] = {}
+        self.jokes = 0
+        self.joke_tokens = 0
+    
+    def spend(self, tokens: int, generations: int = 1):
+        """Ответ OpenRouter: токены, за которые заплачено, даже если анекдот не показан"""
+        with self._lock:
+            self._roll_day()
+            self.spent += tokens
+            self.generations += generations
+            self._pending += tokens
+            self._pending_generations += generations
+    
+    def charge(self, users: Dict[int, int], themes: Dict[str, int], jokes: int):
+        """Записанные в журнал анекдоты: {user_id: токены}, {theme_key: токены}"""
+        with self._lock:
+            self._roll_day()
+            for user_id, tokens in users.items():
+                self.users[user_id] = self.users.get(user_id, 0) + tokens
+            for theme_key, tokens in themes.items():
+                self.themes[theme_key] = self.themes.get(theme_key, 0) + tokens
+            self.jokes += jokes
+            self.joke_tokens += sum(users.values())
+    
+    def allows(self, reserve: float = 0.0) -> bool:
+        """
+        Есть ли бюджет на генерацию. reserve - доля бюджета, которую надо оставить:
+        фоновые генерации останавливаются раньше запросов пользователей.
+        """
+        if not self.daily_budget:
+            return True
+        with self._lock:
+            self._roll_day()
+            return self.spent < self.daily_budget * (1 - reserve)
+    
+    def headroom(self) -> Optional[int]:
+        """Остаток бюджета на сегодня; None - бюджет не ограничен"""
+        if not self.daily_budget:
+            return None
+        with self._lock:
+            self._roll_day()
+            return max(0, self.daily_budget - self.spent)
+    
+    def top_themes(self, limit: int = 3):
+        """Самые затратные темы дня: [(theme_key, токены)]"""
+        with self._lock:
+            self._roll_day()
+            return sorted(self.themes.items(), key=lambda item: item[1], reverse=True)[:limit]
+    
+    def user_tokens(self, user_id: int) -> int:
+        with self._lock:
+            self._roll_day()
+            return self.users.get(user_id, 0)
+    
+    def load(self, day: str, spent: int, generations: int, users, themes, jokes: int):
+        """Сегодняшние счетчики из базы при старте"""
+        with self._lock:
+            if day != self.day:
+                return
+            self.spent = spent + self._pending
+            self.generations = generations + self._pending_generations
+            self.users = dict(users)
+            self.themes = dict(themes)
+            self.jokes = jokes
+            self.joke_tokens = sum(self.themes.values())
+    
+    def pop_pending(self) -> List[Tuple[str, int, int]]:
+        """Локальный расход с прошлой синхронизации: [(день, токены, генерации)]"""
+        with self._lock:
+            self._roll_day()
+            rows, self._carry = self._carry, []
+            if self._pending or self._pending_generations:
+                rows.append((self.day, self._pending, self._pending_generations))
+            self._pending = 0
+            self._pending_generations = 0
+            return rows
+    
+    def restore(self, rows: List[Tuple[str, int, int]]):
+        """Расход из pop_pending(), который не удалось записать, - ждет следующей синхронизации"""
+        with self._lock:
+            self._roll_day()
+            for day, tokens, generations in rows:
+                if day == self.day:
+                    self._pending += tokens
+                    self._pending_generations += generations
+                else:
+                    self._carry.append((day, tokens, generations))
+    
+    def refresh(self, day: str, spent: int, generations: int):
+        """Общий расход всех процессов после синхронизации"""
+        with self._lock:
+            if day != self.day:
+                return
+            # Расход, случившийся во время записи, еще не в базе
+            self.spent = spent + self._pending
+            self.generations = generations + self._pending_generations
+    
+    def stats(self) -> dict:
+        with self._lock:
+            self._roll_day()
+            return {
+                "day": self.day,
+                "budget": self.daily_budget,
+                "spent": self.spent,
+                "headroom": max(0, self.daily_budget - self.spent) if self.daily_budget else None,
+                "generations": self.generations,
+                "per_generation": self.spent / self.generations if self.generations else 0.0,
+                "jokes": self.jokes,
+                "per_joke": self.joke_tokens / self.jokes if self.jokes else 0.0,
+                "users": len(self.users),
+                "themes": len(self.themes),
+            }
+    
+    def _roll_day(self):
+        """Новый день - счетчики с нуля, несведенный вчерашний расход ждет синхронизации"""
+        today = self.today()
+        if today == self.day:
+            return
+        if self._pending or self._pending_generations:
+            self._carry.append((self.day, self._pending, self._pending_generations))
+        self.day = today
+        self.spent = 0
+        self.generations = 0
+        self._pending = 0
+        self._pending_generations = 0
+        self.users = {}
+        self.themes = {}
+        self.jokes = 0
+        self.joke_tokens = 0
+
+# Общий учет процесса
+token_budget = TokenBudget()
+
+registry.gauge("anekdotych_tokens_spent_today", "Токены OpenRouter за сегодня", lambda: token_budget.stats()["spent"])
+registry.gauge(
+    "anekdotych_token_budget_headroom", "Остаток дневного бюджета токенов (-1 - без ограничения)",
+    lambda: -1 if token_budget.headroom() is None else token_budget.headroom()
+)
@@ -42,6 +42,34 @@ POPULAR_THEMES = [
     "врачи", "полиция", "армия", "деревня", "город"
 ]
 
+# Эмодзи тем: ключевое слово в начальной форме -> эмодзи
+THEME_EMOJIS = {
+    'программист': '💻',
+    'студент': '🎓',
+    'семья': '👨‍👩‍👧‍👦',
+    'работа': '💼',
+    'животные': '🐾',
+    'школа': '🏫',
+    'друг': '👥',
+    'друзья': '👥',
+    'технология': '🔧',
+    'еда': '🍕',
+    'отпуск': '🏖️',
+    'спорт': '⚽',
+    'музыка': '🎵',
+    'математика': '📐',
+    'физика': '⚛️',
+    'рыбалка': '🎣',
+    'погода': '🌤️',
+    'деньги': '💰',
+    'хобби': '🎨',
+    'кот': '🐱',
+    'кошка': '🐱',
+    'собака': '🐶',
+    'путешествия': '✈️',
+    'шоппинг': '🛍️'
+}
+
 # Настройки генерации анекдотов
 GENERATION_SETTINGS = {
     "max_length": 4,  # максимальное количество предложений
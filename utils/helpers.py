@@ -1,7 +1,9 @@
 import re
 import time
+from datetime import datetime, timezone
 from typing import List, Tuple
 from config import Config
+from utils.theme_classifier import theme_classifier
 
 def split_message(text: str, max_length: int = None) -> List[str]:
     """
@@ -53,32 +55,30 @@ def split_message(text: str, max_length: int = None) -> List[str]:
 
 def validate_theme(theme: str) -> Tuple[bool, str]:
     """
-    Проверяет тему на валидность.
+    Проверяет тему на валидность, включая запрещенные темы.
     Возвращает (is_valid, error_message)
     """
-    if not theme or len(theme.strip()) == 0:
-        return False, "Тема не может быть пустой"
-    
-    theme = theme.strip()
-    
-    # Проверка длины
-    if len(theme) > 100:
-        return False, "Тема слишком длинная (максимум 100 символов)"
-    
-    if len(theme) < 2:
-        return False, "Тема слишком короткая (минимум 2 символа)"
-    
-    # Проверка на запрещенные символы
-    forbidden_chars = r'[<>{}|\\^`]'
-    if re.search(forbidden_chars, theme):
-        return False, "Тема содержит запрещенные символы"
-    
-    # Проверка на повторяющиеся слова (анти-спам)
-    words = theme.split()
-    if len(words) > 10:
-        return False, "Слишком много слов в теме (максимум 10)"
+    info = theme_classifier.classify(theme)
+    return info.valid, info.error
+
+def normalize_theme(theme: str) -> str:
+    """
+    Приводит тему к ключу для кэшей и статистики:
+    нижний регистр, ё -> е, без знаков препинания и лишних пробелов.
+    """
+    if not theme:
+        return ""
     
-    return True, ""
+    theme = theme.lower().replace('ё', 'е')
+    theme = re.sub(r'[^\w\s-]', ' ', theme)
+    return ' '.join(theme.split())
+
+def utc_today() -> str:
+    """
+    Ключ текущего дня (ГГГГ-ММ-ДД) по UTC - один для квот, бюджета токенов,
+    журнала запросов и рейтинга тем, независимо от часового пояса сервера
+    """
+    return datetime.now(timezone.utc).date().isoformat()
 
 def format_user_stats(stats_data) -> str:
     """Форматирует статистику пользователя в красивый текст"""
@@ -103,10 +103,17 @@ def rate_limit_check(user_id: int, db) -> Tuple[bool, str]:
     Проверяет лимиты запросов для пользователя.
     Возвращает (can_make_request, error_message)
     """
-    if not db.can_make_request(user_id):
-        return False, f"⚠️ Вы превысили дневной лимит ({Config.MAX_REQUESTS_PER_USER} запросов). Попробуйте завтра!"
+    allowed, reason, retry_after = db.check_limits(user_id)
+    if allowed:
+        return True, ""
     
-    return True, ""
+    if reason == "budget":
+        return False, "⚠️ Дневной бюджет генераций бота исчерпан. Загляните завтра!"
+    
+    if reason == "cooldown":
+        return False, f"⏳ Слишком часто! Подождите {max(1, round(retry_after))} сек. перед следующим запросом."
+    
+    return False, f"⚠️ Вы превысили дневной лимит ({Config.MAX_REQUESTS_PER_USER} запросов). Попробуйте завтра!"
 
 def clean_joke_text(text: str) -> str:
     """Очищает текст анекдота от лишних пробелов и форматирования"""
@@ -126,34 +133,4 @@ def clean_joke_text(text: str) -> str:
 
 def get_theme_emoji(theme: str) -> str:
     """Возвращает эмодзи для темы"""
-    theme_emojis = {
-        'программист': '💻',
-        'студент': '🎓', 
-        'семья': '👨‍👩‍👧‍👦',
-        'работа': '💼',
-        'животные': '🐾',
-        'школа': '🏫',
-        'друг': '👥',
-        'технология': '🔧',
-        'еда': '🍕',
-        'отпуск': '🏖️',
-        'спорт': '⚽',
-        'музыка': '🎵',
-        'математика': '📐',
-        'физика': '⚛️',
-        'рыбалка': '🎣',
-        'погода': '🌤️',
-        'деньги': '💰',
-        'хобби': '🎨',
-        'кот': '🐱',
-        'собака': '🐶',
-        'путешествия': '✈️',
-        'шоппинг': '🛍️'
-    }
-    
-    theme_lower = theme.lower()
-    for key, emoji in theme_emojis.items():
-        if key in theme_lower:
-            return emoji
-    
-    return '🎭'  # Эмодзи по умолчанию
\ No newline at end of file
+    return theme_classifier.classify(theme).emoji
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""
+Классификатор тем: за один проход по тексту пользователя проверяет тему,
+строит ключ, подбирает эмодзи и отсеивает запрещенные темы.
+"""
+
+from typing import Dict, List, Optional, Tuple
+from utils.constants import FORBIDDEN_THEMES, THEME_EMOJIS
+
+DEFAULT_EMOJI = '🎭'
+MAX_THEME_LENGTH = 100
+MIN_THEME_LENGTH = 2
+MAX_THEME_WORDS = 10
+FORBIDDEN_CHARS = frozenset('<>{}|\\^`')
+
+# Окончания для облегченного стемминга, длинные раньше коротких
+_ENDINGS = (
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ий', 'ый', 'ой', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ия', 'ию', 'ов', 'ев', 'ей', 'ом', 'ем', 'ам', 'ям',
+    'а', 'я', 'ы', 'и', 'о', 'е', 'у', 'ю', 'ь', 'й',
+)
+_MIN_STEM = 3
+
+def stem(word: str) -> str:
+    """Отрезает падежное окончание, оставляя основу не короче трех букв"""
+    word = word.lower().replace('ё', 'е')
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+class ThemeInfo:
+    """Результат классификации темы"""
+    __slots__ = ('key', 'category', 'emoji', 'valid', 'error', 'forbidden')
+    
+    def __init__(self, key, category, emoji, valid, error="", forbidden=False):
+        self.key = key
+        self.category = category
+        self.emoji = emoji
+        self.valid = valid
+        self.error = error
+        self.forbidden = forbidden
+
+class _Automaton:
+    """Автомат Ахо-Корасик по основам слов"""
+    
+    def __init__(self, patterns: Dict[str, Tuple[str, bool]]):
+        # Переходы, суффиксные ссылки и выходы: (длина основы, (категория, запрещена))
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, Tuple[str, bool]]]] = [[]]
+        for pattern, value in patterns.items():
+            self._add(pattern, value)
+        self._link()
+    
+    def _add(self, pattern, value):
+        state = 0
+        for ch in pattern:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][ch] = next_state
+            state = next_state
+        self.out[state].append((len(pattern), value))
+    
+    def _link(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                link = self.goto[fallback].get(ch, 0)
+                self.fail[next_state] = link if link != next_state else 0
+                self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+    
+    def step(self, state, ch):
+        while state and ch not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(ch, 0)
+
+class ThemeClassifier:
+    """
+    Словари эмодзи и запрещенных тем компилируются один раз в автомат по основам.
+    Совпадением считается основа в начале слова, поэтому "кошками" находит "кошка",
+    а "антикот" - нет.
+    """
+    
+    def __init__(self, emojis: Dict[str, str], forbidden: List[str]):
+        self.emojis = {}
+        patterns = {}
+        for word, emoji in emojis.items():
+            patterns[stem(word)] = (word, False)
+            self.emojis[word] = emoji
+        # Запрещенные основы важнее эмодзи
+        for word in forbidden:
+            patterns[stem(word)] = (word, True)
+        self._automaton = _Automaton(patterns)
+    
+    def classify(self, text: Optional[str]) -> ThemeInfo:
+        """Проверка, ключ, эмодзи и запрет темы за один проход"""
+        text = (text or "").strip()
+        if not text:
+            return ThemeInfo("", None, DEFAULT_EMOJI, False, "Тема не может быть пустой")
+        if len(text) > MAX_THEME_LENGTH:
+            return ThemeInfo("", None, DEFAULT_EMOJI, False,
+                             f"Тема слишком длинная (максимум {MAX_THEME_LENGTH} символов)")
+        
+        automaton = self._automaton
+        key = []
+        state = 0
+        word_position = 0  # Позиция символа внутри слова для проверки начала основы
+        words = 0
+        in_word = False
+        bad_chars = False
+        category = None
+        forbidden = False
+        
+        for raw in text:
+            if raw.isspace():
+                in_word = False
+            elif not in_word:
+                in_word = True
+                words += 1
+            if raw in FORBIDDEN_CHARS:
+                bad_chars = True
+            
+            ch = raw.lower()
+            if ch == 'ё':
+                ch = 'е'
+            
+            # Ключ темы в том же виде, что normalize_theme
+            if ch.isalnum() or ch in '_-':
+                key.append(ch)
+            elif key and key[-1] != ' ':
+                key.append(' ')
+            
+            if not ch.isalnum():
+                state = 0
+                word_position = 0
+                continue
+            
+            state = automaton.step(state, ch)
+            word_position += 1
+            for length, (word, is_forbidden) in automaton.out[state]:
+                if length != word_position:
+                    continue
+                if is_forbidden:
+                    forbidden = True
+                elif category is None:
+                    category = word
+        
+        key = "".join(key).strip()
+        emoji = self.emojis.get(category, DEFAULT_EMOJI)
+        
+        if len(text) < MIN_THEME_LENGTH:
+            error = f"Тема слишком короткая (минимум {MIN_THEME_LENGTH} символа)"
+        elif bad_chars:
+            error = "Тема содержит запрещенные символы"
+        elif words > MAX_THEME_WORDS:
+            error = f"Слишком много слов в теме (максимум {MAX_THEME_WORDS})"
+        elif forbidden:
+            error = "На эту тему анекдоты не сочиняю"
+        else:
+            return ThemeInfo(key, category, emoji, True)
+        return ThemeInfo(key, category, emoji, False, error, forbidden)
+
+# Компилируется при импорте, то есть один раз при старте бота
+theme_classifier = ThemeClassifier(THEME_EMOJIS, FORBIDDEN_THEMES)